@@ -2,11 +2,11 @@
 # Import pkg_resources first so namespace handling is properly done so the
 # paste imports work
 import pkg_resources
-from paste.registry import StackedObjectProxy
 
 from pylons.configuration import config
 from pylons.controllers.util import Request
 from pylons.controllers.util import Response
+from pylons.requestlocal import ContextProxy
 
 __all__ = ['app_globals', 'cache', 'config', 'request', 'response',
            'session', 'tmpl_context', 'url', 'Request', 'Response']
@@ -30,12 +30,12 @@ def __figure_version():
 
 __version__ = __figure_version()
 
-app_globals = StackedObjectProxy(name="app_globals")
-cache = StackedObjectProxy(name="cache")
-request = StackedObjectProxy(name="request")
-response = StackedObjectProxy(name="response")
-session = StackedObjectProxy(name="session")
-tmpl_context = StackedObjectProxy(name="tmpl_context or C")
-url = StackedObjectProxy(name="url")
+app_globals = ContextProxy('app_globals')
+cache = ContextProxy('cache')
+request = ContextProxy('request')
+response = ContextProxy('response')
+session = ContextProxy('session')
+tmpl_context = ContextProxy('tmpl_context', name="tmpl_context or C")
+url = ContextProxy('url')
 
-translator = StackedObjectProxy(name="translator")
+translator = ContextProxy('translator')
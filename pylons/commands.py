@@ -14,6 +14,8 @@ Commands available:
     Create a REST Controller and accompanying functional test
 ``shell``
     Open an interactive shell with the Pylons app loaded
+``compile-templates``
+    Compile the project's templates ahead of time
 
 Example usage::
 
@@ -41,6 +43,7 @@ Example usage::
 """
 import os
 import sys
+import time
 
 import paste.fixture
 import paste.registry
@@ -51,6 +54,7 @@ from tempita import paste_script_template_renderer
 
 import pylons
 import pylons.util as util
+from pylons.templating import compile_templates
 
 __all__ = ['ControllerCommand', 'RestControllerCommand', 'ShellCommand']
 
@@ -431,6 +435,101 @@ class RoutesCommand(Command):
             print mapper
 
 
+class CompileTemplatesCommand(Command):
+    """Compile the project's templates ahead of time
+
+    Compiles every template in the project's template directories with
+    the template engine set up in its environment, writing the Mako
+    modules to the lookup's ``module_directory`` and the Jinja2
+    bytecode to the environment's ``bytecode_cache``, so the
+    application's processes start with compiled templates. Genshi
+    templates are only checked for errors.
+
+    The optional CONFIG_FILE argument specifies the config file to use.
+    CONFIG_FILE defaults to 'development.ini'.
+
+    Example::
+
+        $ paster compile-templates production.ini
+
+    """
+    summary = __doc__.splitlines()[0]
+    usage = '\n' + __doc__
+
+    min_args = 0
+    max_args = 1
+    group_name = 'pylons'
+
+    parser = Command.standard_parser(simulate=True)
+    parser.add_option('-e', '--extension',
+                      action='append',
+                      dest='extensions',
+                      help=("Only compile files with this extension, e.g. "
+                            "-e .mako (may be given more than once)"))
+    parser.add_option('-q',
+                      action='count',
+                      dest='quiet',
+                      default=0,
+                      help=("Do not load logging configuration from the "
+                            "config file"))
+
+    def command(self):
+        """Main command to compile the templates"""
+        if len(self.args) == 0:
+            # Assume the .ini file is ./development.ini
+            config_file = 'development.ini'
+            if not os.path.isfile(config_file):
+                raise BadCommand('%sError: CONFIG_FILE not found at: .%s%s\n'
+                                 'Please specify a CONFIG_FILE' % \
+                                 (self.parser.get_usage(), os.path.sep,
+                                  config_file))
+        else:
+            config_file = self.args[0]
+
+        config_name = 'config:%s' % config_file
+        here_dir = os.getcwd()
+
+        if not self.options.quiet:
+            # Configure logging from the config file
+            self.logging_file_config(config_file)
+
+        # Load the wsgi app first so that everything is initialized right
+        sys.path.insert(0, here_dir)
+        wsgiapp = loadapp(config_name, relative_to=here_dir)
+        test_app = paste.fixture.TestApp(wsgiapp)
+
+        # Query the test app to setup the environment and get the config
+        tresponse = test_app.get('/_test_vars')
+        config = tresponse.config
+        app_globals = config['pylons.app_globals']
+        directories = config['pylons.paths']['templates']
+
+        lookup = getattr(app_globals, 'mako_lookup', None)
+        if lookup is not None and \
+                not lookup.template_args.get('module_directory'):
+            print ("Warning: the Mako TemplateLookup has no module_directory, "
+                   "the compiled templates won't be kept")
+        env = getattr(app_globals, 'jinja2_env', None)
+        if env is not None and env.bytecode_cache is None:
+            print ("Warning: the Jinja2 Environment has no bytecode_cache, "
+                   "the compiled templates won't be kept")
+
+        count = 0
+        errors = []
+        start = time.time()
+        for engine, name, seconds, error in compile_templates(
+                app_globals, directories, self.options.extensions):
+            count += 1
+            if error is None:
+                print '  %-6s %9.1fms  %s' % (engine, seconds * 1000, name)
+            else:
+                print '  %-6s %11s  %s: %s' % (engine, 'ERROR', name, error)
+                errors.append(name)
+        print 'Compiled %d templates in %.2fs' % (count, time.time() - start)
+        if errors:
+            raise BadCommand('%d templates failed to compile' % len(errors))
+
+
 class ShellCommand(Command):
     """Open an interactive shell with the Pylons app loaded
 
@@ -17,10 +17,11 @@ import copy
 import logging
 import os
 
-from paste.config import DispatchingConfig
 from paste.deploy.converters import asbool
 from webhelpers.mimehelper import MIMETypes
 
+from pylons.requestlocal import ContextConfig
+
 
 request_defaults = dict(charset='utf-8', errors='replace',
                         decode_param_names=False, language='en-us')
@@ -32,7 +33,7 @@ response_defaults = dict(content_type='text/html',
 log = logging.getLogger(__name__)
 
 
-config = DispatchingConfig()
+config = ContextConfig()
 
 
 class PylonsConfig(dict):
@@ -65,6 +66,12 @@ class PylonsConfig(dict):
         Whether or not the ``tmpl_context`` object should throw an
         attribute error when access is attempted to an attribute that
         doesn't exist. Defaults to True.
+    ``pylons.tmpl_context_stats``
+        Whether the ``tmpl_context`` object should record the
+        attributes each template reads, and the ones it reads that
+        aren't set, see :data:`~pylons.util.tmpl_context_stats`. Slows
+        down every access to the object, so only meant for
+        development. Defaults to False.
     ``pylons.tmpl_context_attach_args``
         Whethor or not Routes variables should automatically be
         attached to the tmpl_context object when specified in a
@@ -81,6 +88,57 @@ class PylonsConfig(dict):
         contain the values ``content_type``, ``charset`` and
         ``errors``. Overrides the Pylons default values specified by
         the ``response_defaults`` dict.
+    ``pylons.cache_policies``
+        Dict of the HTTP cache policies routes can name with their
+        ``cache_policy``, each a
+        :class:`~pylons.controllers.util.CachePolicy` or a dict of its
+        arguments.
+    ``pylons.lean_context``
+        Whether :class:`~pylons.wsgiapp.PylonsApp` should use the
+        :class:`~pylons.util.LeanPylonsContext` for requests. The
+        default response headers are then built once, and the response
+        and translator objects are only created when they're first
+        used. No attributes other than the standard ones can be set on
+        the ``pylons`` context object in this mode. Defaults to False.
+    ``pylons.preload_controllers``
+        Whether :class:`~pylons.wsgiapp.PylonsApp` should import all
+        of the application's controllers when it's created, rather
+        than on the first request to each. Useful under forking
+        servers, where it lets the workers share the loaded
+        controllers. Defaults to False.
+    ``pylons.use_registry``
+        Whether :class:`~pylons.wsgiapp.PylonsApp` should register the
+        Pylons globals with ``paste.registry``, when the
+        ``RegistryManager`` middleware is in use. The globals are read
+        from the request's context either way, so this is only needed
+        by code that uses the registry directly. Defaults to True.
+    ``pylons.context_backend``
+        Where the request-local context is kept, ``thread`` (the
+        default), ``greenlet`` (for gevent and eventlet workers) or
+        ``contextvars``, or a ``module:Class`` path to a backend class.
+        See :mod:`pylons.requestlocal`. With a backend that isn't bound
+        to threads, ``paste.registry`` isn't used. Every application in
+        a process must use the same backend.
+    ``pylons.translator_cache_size``
+        Number of gettext translators kept by
+        :class:`~pylons.i18n.translation.TranslatorCache`, one for each
+        set of message catalogs found for the languages asked for.
+        Defaults to 100.
+    ``pylons.template_profiling``
+        Whether to time the templates rendered by the
+        :mod:`pylons.templating` render functions, see
+        :data:`~pylons.templating.template_stats`. Defaults to False.
+    ``pylons.compress``
+        Whether the ``config/middleware.py`` of new projects adds
+        :class:`~pylons.middleware.CompressionMiddleware`, compressing
+        text, JSON and XML responses for the clients accepting gzip or
+        deflate. An action can leave its response uncompressed by
+        setting ``request.environ['pylons.compress'] = False``.
+        Defaults to False.
+    ``pylons.static``
+        The application's :class:`~pylons.static.StaticFiles`, which
+        :func:`~pylons.static.static_url` uses to build fingerprinted
+        URLs. Set by ``config/middleware.py``.
     ``routes.map``
         Mapper object used for Routing. Yes, it is possible to add
         routes after your application has started running.
@@ -99,8 +157,18 @@ class PylonsConfig(dict):
         'pylons.h': None,
         'pylons.request_options': request_defaults.copy(),
         'pylons.response_options': response_defaults.copy(),
+        'pylons.cache_policies': {},
         'pylons.strict_tmpl_context': True,
+        'pylons.tmpl_context_stats': False,
         'pylons.tmpl_context_attach_args': False,
+        'pylons.lean_context': False,
+        'pylons.preload_controllers': False,
+        'pylons.use_registry': True,
+        'pylons.context_backend': 'thread',
+        'pylons.translator_cache_size': 100,
+        'pylons.template_profiling': False,
+        'pylons.compress': False,
+        'pylons.static': None,
     }
 
     def init_app(self, global_conf, app_conf, package=None, paths=None):
@@ -1,11 +1,13 @@
 """The core WSGIController"""
-import inspect
 import logging
 import types
 
 from webob.exc import HTTPException, HTTPNotFound
 
 import pylons
+from pylons.controllers.dispatch import dispatch_table
+from pylons.controllers.util import CachePolicy, EncodedAppIter
+from pylons.requestlocal import request_local
 
 __all__ = ['WSGIController']
 
@@ -42,7 +44,9 @@ class WSGIController(object):
     that it is only passed the arguments in the Routes match dict that
     it asks for. The arguments passed into the action can be customized
     by overriding the :meth:`_get_method_args` function which is
-    expected to return a dict.
+    expected to return a dict. Actions are compiled into a per-class
+    :class:`~pylons.controllers.dispatch.DispatchTable` the first time
+    the controller is used, so the inspection only happens once.
 
     In the event that an action is not found to handle the request, the
     Controller will raise an "Action Not Found" error if in debug mode,
@@ -66,40 +70,30 @@ class WSGIController(object):
         If the function has been decorated, it is assumed that the
         decorator preserved the function signature.
 
-        """
-        # Check to see if the class has a cache of argspecs yet
-        try:
-            cached_argspecs = self.__class__._cached_argspecs
-        except AttributeError:
-            self.__class__._cached_argspecs = cached_argspecs = {}
+        The inspection is done once per function and cached in the
+        controller class's :class:`~pylons.controllers.dispatch.DispatchTable`.
 
-        # function could be callable
-        func_key = getattr(func, 'im_func', func.__call__)
-        try:
-            argspec = cached_argspecs[func_key]
-        except KeyError:
-            argspec = cached_argspecs[func_key] = inspect.getargspec(func_key)
-        kargs = self._get_method_args()
+        """
+        record = dispatch_table(self.__class__).inspect(func)
 
         log_debug = self._pylons_log_debug
-        c = self._py_object.tmpl_context
-        environ = self._py_object.request.environ
-        args = None
-
-        if argspec[2]:
-            if self._py_object.config['pylons.tmpl_context_attach_args']:
-                for k, val in kargs.iteritems():
-                    setattr(c, k, val)
-            args = kargs
-        else:
+        py_object = self._py_object
+
+        if record.varkw:
+            args = self._get_method_args()
+        elif record.argnames:
+            kargs = self._get_method_args()
             args = {}
-            argnames = argspec[0][isinstance(func, types.MethodType)
-                                  and 1 or 0:]
-            for name in argnames:
+            for name in record.argnames:
                 if name in kargs:
-                    if self._py_object.config['pylons.tmpl_context_attach_args']:
-                        setattr(c, name, kargs[name])
                     args[name] = kargs[name]
+        else:
+            # Nothing to pass, don't bother building the arguments
+            args = {}
+        if args and py_object.config['pylons.tmpl_context_attach_args']:
+            c = py_object.tmpl_context
+            for k, val in args.iteritems():
+                setattr(c, k, val)
         if log_debug:
             log.debug("Calling %r method with keyword args: **%r",
                       func.__name__, args)
@@ -113,6 +107,7 @@ class WSGIController(object):
             result = httpe
 
             # Store the exception in the environ
+            environ = py_object.request.environ
             environ['pylons.controller.exception'] = httpe
 
             # 304 Not Modified's shouldn't have a content-type set
@@ -139,6 +134,31 @@ class WSGIController(object):
         kargs['pylons'] = self._py_object
         return kargs
 
+    def _get_cache_policy(self):
+        """Return the :class:`~pylons.controllers.util.CachePolicy` of
+        the request, or None
+
+        The policy named by the route's ``cache_policy`` comes first,
+        then the one set on the action with the
+        :func:`~pylons.decorators.cache.cache_control` decorator.
+
+        """
+        py_object = self._py_object
+        environ = py_object.request.environ
+        name = environ['pylons.routes_dict'].get('cache_policy')
+        if name is None:
+            return getattr(environ.get('pylons.action_method'),
+                           '_cache_policy', None)
+        policies = py_object.config['pylons.cache_policies']
+        try:
+            policy = policies[name]
+        except KeyError:
+            raise KeyError('No cache policy named %r in the '
+                           'pylons.cache_policies option' % name)
+        if isinstance(policy, dict):
+            policy = policies[name] = CachePolicy(**policy)
+        return policy
+
     def _dispatch_call(self):
         """Handles dispatching the request to the function using
         Routes"""
@@ -149,14 +169,22 @@ class WSGIController(object):
         except KeyError:
             raise Exception("No action matched from Routes, unable to"
                             "determine action dispatch.")
-        action_method = action.replace('-', '_')
+        # Compiled public actions are a single dict lookup, anything
+        # else (instance attributes, __getattr__, methods added after
+        # the class was compiled) is looked up the slow way
+        record = dispatch_table(self.__class__).lookup(action)
+        if record is not None:
+            action_method = record.name
+            func = getattr(self, action_method, None)
+        else:
+            action_method = action.replace('-', '_')
+            try:
+                func = getattr(self, action_method, None)
+            except UnicodeEncodeError:
+                func = None
         if log_debug:
             log.debug("Looking for %r method to handle the request",
                       action_method)
-        try:
-            func = getattr(self, action_method, None)
-        except UnicodeEncodeError:
-            func = None
         if action_method != 'start_response' and callable(func):
             # Store function used to handle request
             req.environ['pylons.action_method'] = func
@@ -206,7 +234,8 @@ class WSGIController(object):
             return start_response(status, headers, exc_info)
         self.start_response = repl_start_response
 
-        if hasattr(self, '__before__'):
+        table = dispatch_table(self.__class__)
+        if table.has_before:
             response = self._inspect_call(self.__before__)
             if hasattr(response, '_exception'):
                 return response(environ, self.start_response)
@@ -221,13 +250,12 @@ class WSGIController(object):
                 if log_debug:
                     log.debug("Controller returned a string "
                               ", writing it to pylons.response")
-                py_response.body = py_response.body + response
+                _append_body(py_response, response)
             elif isinstance(response, unicode):
                 if log_debug:
                     log.debug("Controller returned a unicode string "
                               ", writing it to pylons.response")
-                py_response.unicode_body = py_response.unicode_body + \
-                        response
+                _append_body(py_response, response)
             elif hasattr(response, 'wsgi_response'):
                 # It's an exception that got tossed.
                 if log_debug:
@@ -238,30 +266,59 @@ class WSGIController(object):
                         response.headers.add(name, value)
                     else:
                         response.headers.setdefault(name, value)
-                try:
-                    registry = environ['paste.registry']
-                    registry.replace(pylons.response, response)
-                except KeyError:
-                    # Ignore the case when someone removes the registry
-                    pass
+                self._py_object.response = response
+                if request_local.registry_safe:
+                    try:
+                        registry = environ['paste.registry']
+                        registry.replace(pylons.response, response)
+                    except KeyError:
+                        # Ignore the case when someone removes the registry
+                        pass
                 py_response = response
             elif response is None:
                 if log_debug:
                     log.debug("Controller returned None")
+            elif isinstance(response, types.GeneratorType):
+                if log_debug:
+                    log.debug("Controller returned a generator, streaming "
+                              "it as pylons.response.app_iter")
+                # The generator may yield unicode, which is encoded a
+                # chunk at a time as it's sent
+                py_response.app_iter = EncodedAppIter(
+                    response, py_response.charset)
+            elif isinstance(response, EncodedAppIter):
+                if log_debug:
+                    log.debug("Controller returned an encoded stream, "
+                              "setting it as pylons.response.app_iter")
+                # A streamed render, already encoded
+                py_response.app_iter = response
             else:
                 if log_debug:
                     log.debug("Assuming controller returned an iterable, "
                               "setting it as pylons.response.app_iter")
+                if isinstance(response, (list, tuple)):
+                    response = list(EncodedAppIter(response,
+                                                   py_response.charset))
                 py_response.app_iter = response
             response = py_response
 
-        if hasattr(self, '__after__'):
+        if table.has_after:
             after = self._inspect_call(self.__after__)
             if hasattr(after, '_exception'):
                 after.wsgi_response = True
                 response = after
 
         if hasattr(response, 'wsgi_response'):
+            policy = self._get_cache_policy()
+            if policy is not None:
+                status = response.status_int
+                if status < 300 or status == 304:
+                    if log_debug:
+                        log.debug("Applying %r", policy)
+                    options = self._py_object.config['pylons.response_options']
+                    policy.apply(response,
+                                 options['headers'].get('Cache-Control'))
+
             # Copy the response object into the testing vars if we're testing
             if 'paste.testing_variables' in environ:
                 environ['paste.testing_variables']['response'] = response
@@ -274,3 +331,28 @@ class WSGIController(object):
             log.debug("Response assumed to be WSGI content, returning "
                       "un-touched")
         return response
+
+
+def _append_body(response, body):
+    """Add the string ``body`` an action returned to ``response``,
+    after what's already been written to it
+
+    What's been written isn't copied, and the Content-Length is kept
+    when it's known.
+
+    """
+    app_iter = response.app_iter
+    if not isinstance(app_iter, list):
+        # An iterator can only be appended to once it's been read
+        response.write(body)
+    elif not any(app_iter):
+        if isinstance(body, unicode):
+            response.unicode_body = body
+        else:
+            response.body = body
+    else:
+        if isinstance(body, unicode):
+            body = body.encode(response.charset)
+        app_iter.append(body)
+        if response.content_length is not None:
+            response.content_length += len(body)
@@ -0,0 +1,160 @@
+"""Precompiled action dispatch tables for WSGIController
+
+Resolving an action used to require a ``getattr``, a ``callable``
+check and an argspec inspection on every request. Instead, the first
+time a controller class is used (or eagerly, when the application
+preloads its controllers) each of its public actions is compiled into
+an :class:`ActionRecord` and stored in a per-class
+:class:`DispatchTable`. Dispatching a request is then a single dict
+lookup.
+
+Actions that are not found in the table (attributes set on the
+instance, names resolved through ``__getattr__``, methods added to the
+class after it was compiled) still work, they are simply resolved the
+slow way.
+
+"""
+import inspect
+import types
+
+__all__ = ['ActionRecord', 'DispatchTable', 'dispatch_table']
+
+# Compiled tables, keyed by controller class
+_tables = {}
+
+
+class ActionRecord(object):
+    """Call information compiled once for a controller action
+
+    ``name``
+        Name of the method on the controller.
+    ``argnames``
+        Tuple of the argument names the action accepts, not including
+        ``self``.
+    ``varkw``
+        Whether the action accepts ``**kwargs``, in which case it is
+        passed every available argument.
+
+    """
+    __slots__ = ('name', 'argnames', 'varkw')
+
+    def __init__(self, name, argnames, varkw):
+        self.name = name
+        self.argnames = argnames
+        self.varkw = varkw
+
+    def __repr__(self):
+        return '<ActionRecord %s(%s%s)>' % (
+            self.name, ', '.join(self.argnames),
+            self.varkw and ', **kwargs' or '')
+
+
+def compile_callable(func):
+    """Return an :class:`ActionRecord` for ``func``
+
+    ``func`` may be a bound method, a plain function or any other
+    callable object. For bound methods the first (``self``) argument
+    is skipped.
+
+    If the function has been decorated, it is assumed that the
+    decorator preserved the function signature.
+
+    """
+    func_key = getattr(func, 'im_func', None)
+    if func_key is None:
+        if isinstance(func, types.FunctionType):
+            func_key = func
+        else:
+            func_key = func.__call__
+    argnames, varargs, varkw, defaults = inspect.getargspec(func_key)
+    if isinstance(func, types.MethodType):
+        argnames = argnames[1:]
+    return ActionRecord(getattr(func, '__name__', None), tuple(argnames),
+                        bool(varkw))
+
+
+class DispatchTable(object):
+    """Compiled actions for a single controller class
+
+    ``actions``
+        Dict of action name to :class:`ActionRecord` for every public
+        method of the class.
+    ``has_before`` / ``has_after``
+        Whether the class defines ``__before__`` / ``__after__``.
+
+    """
+    def __init__(self, controller_class):
+        self.controller_class = controller_class
+        self.actions = {}
+        self.has_before = hasattr(controller_class, '__before__')
+        self.has_after = hasattr(controller_class, '__after__')
+
+        # Records for any callable passed through inspect(), keyed on
+        # the underlying function
+        self._signatures = {}
+
+        for name in dir(controller_class):
+            if name.startswith('_') or name == 'start_response':
+                continue
+            try:
+                attr = getattr(controller_class, name)
+            except AttributeError:
+                continue
+            if not isinstance(attr, types.MethodType):
+                continue
+            try:
+                record = compile_callable(attr)
+            except TypeError:
+                # Not introspectable, leave it to the slow path
+                continue
+            # Actions are called on instances, so name the record after
+            # the attribute rather than the (possibly decorated)
+            # function
+            record.name = name
+            self.actions[name] = record
+            self._signatures[attr.im_func] = record
+
+    def lookup(self, action):
+        """Return the :class:`ActionRecord` for a Routes ``action``,
+        or None if the action isn't a compiled public method
+
+        Dashes in the action name map to underscores in the method
+        name.
+
+        """
+        record = self.actions.get(action)
+        if record is None and '-' in action:
+            record = self.actions.get(action.replace('-', '_'))
+        return record
+
+    def inspect(self, func):
+        """Return the :class:`ActionRecord` describing how to call
+        ``func``, compiling and caching it on first use"""
+        func_key = getattr(func, 'im_func', None)
+        if func_key is None:
+            if isinstance(func, types.FunctionType):
+                # Most likely created per instance, caching it would
+                # only leak memory
+                return compile_callable(func)
+            func_key = func.__call__
+        try:
+            return self._signatures[func_key]
+        except KeyError:
+            record = self._signatures[func_key] = compile_callable(func)
+            return record
+
+
+def dispatch_table(controller_class):
+    """Return the :class:`DispatchTable` for ``controller_class``,
+    compiling it on first use
+
+    Tables are kept for the life of the process, so they are shared by
+    every application (and, when built before forking, every worker
+    process) that uses the controller.
+
+    """
+    try:
+        return _tables[controller_class]
+    except KeyError:
+        table = _tables[controller_class] = DispatchTable(controller_class)
+        return table
@@ -1,15 +1,21 @@
 """The base WSGI JSONRPCController"""
-import inspect
+import atexit
 import json
 import logging
+import re
+import sys
+import threading
 import types
 import urllib
 
-from paste.response import replace_header
+from webob.exc import HTTPException
+
 from pylons.controllers import WSGIController
+from pylons.controllers.dispatch import dispatch_table
 from pylons.controllers.util import abort, Response
+from pylons.requestlocal import request_local
 
-__all__ = ['JSONRPCController', 'JSONRPCError',
+__all__ = ['JSONCodec', 'JSONRPCController', 'JSONRPCError',
            'JSONRPC_PARSE_ERROR',
            'JSONRPC_INVALID_REQUEST',
            'JSONRPC_METHOD_NOT_FOUND',
@@ -20,6 +26,16 @@ log = logging.getLogger(__name__)
 
 JSONRPC_VERSION = '2.0'
 
+# Code of the errors reporting an HTTP error raised by a method (e.g.
+# with abort), in the range the specification leaves to servers
+JSONRPC_HTTP_ERROR_CODE = -32000
+
+# Python's messages for calls with missing or unexpected arguments
+_bad_arguments = re.compile(r'takes (?:at least|at most|exactly|no) |'
+                            r'got an unexpected keyword argument|'
+                            r'missing \d+ required')
+_perform_call_code = WSGIController._perform_call.im_func.func_code
+
 
 class JSONRPCError(BaseException):
 
@@ -62,7 +78,55 @@ def jsonrpc_error(req_id, error):
         err = _reserved_errors[error]
         return Response(body=json.dumps(dict(jsonrpc=JSONRPC_VERSION,
                                              id=req_id,
-                                             error=err.as_dict())))
+                                             error=err.as_dict())),
+                        content_type='application/json', charset=None)
+
+
+class JSONCodec(object):
+    """Decodes JSON-RPC requests and encodes their responses
+
+    ``loads`` and ``dumps`` default to the standard library's json
+    module, with a decoder and a compact encoder made once and reused.
+    Any JSON library with the same interface can be used instead, by
+    setting a controller's ``json_codec``::
+
+        import ujson
+
+        class ApiController(JSONRPCController):
+            json_codec = JSONCodec(ujson.loads, ujson.dumps)
+
+    ``loads`` is expected to raise ValueError for malformed JSON, and
+    ``dumps`` TypeError, ValueError or OverflowError for values it
+    can't encode.
+
+    """
+    def __init__(self, loads=None, dumps=None):
+        self.loads = loads or json.JSONDecoder().decode
+        self.dumps = dumps or json.JSONEncoder(separators=(',', ':')).encode
+
+    def encode_response(self, response):
+        """Encode the ``response`` dict of a call, or an internal error
+        response in its place when its result can't be encoded"""
+        try:
+            return self.dumps(response)
+        except (TypeError, ValueError, OverflowError), e:
+            log.debug('Error encoding response: %s', e)
+            err = _reserved_errors['internal_error']
+            return self.dumps(dict(jsonrpc=JSONRPC_VERSION,
+                                   id=response.get('id'),
+                                   error=err.as_dict()))
+
+
+# Thread pools running the calls of batches, keyed by size
+# Controller classes with a batch thread pool, closed at exit
+_batch_pool_classes = set()
+_batch_pool_lock = threading.Lock()
+
+
+def _close_batch_pools():
+    for controller in list(_batch_pool_classes):
+        controller.close_batch_pool()
+atexit.register(_close_batch_pools)
 
 
 class JSONRPCController(WSGIController):
@@ -82,10 +146,76 @@ class JSONRPCController(WSGIController):
     errors should be caught and return JSONRPC_INTERNAL_ERROR to the
     client.
 
-    Parts of the specification not supported (yet):
-     - Notifications
-     - Batch
+    Requests without an ``id`` are notifications: the method is
+    called, but nothing is sent back for it. A request made of
+    notifications only gets an empty ``204 No Content`` response.
+
+    A batch, an array of requests, is answered with a single array of
+    the responses to its calls, in the order of the calls. Its calls
+    are made one after the other, unless ``batch_workers`` is set, in
+    which case they're made concurrently on a pool of that many
+    threads. Each controller class has its own pool, started by its
+    first concurrent batch and closed by :meth:`close_batch_pool` or
+    when the process exits. Methods must then be thread safe; the
+    pylons globals still refer to the batch's request in every thread.
+    ``__before__`` and ``__after__`` are called once for the whole
+    batch.
+
+    Request bodies larger than ``max_body_length`` are refused with a
+    ``413 Request Entity Too Large``. JSON is decoded and encoded by
+    the :class:`JSONCodec` in ``json_codec``.
+
+    An HTTP error raised by a method, e.g. with ``abort(404)``, is
+    answered with an error of code ``-32000``, the HTTP status as the
+    message and ``{"status": 404}`` as its data.
+
     """
+    max_body_length = 4194304
+    json_codec = JSONCodec()
+
+    #: Number of threads the calls of a batch are run on, 0 to run them
+    #: one after the other
+    batch_workers = 0
+
+    _batch = None
+    _batch_pool = None
+
+    @classmethod
+    def batch_pool(cls):
+        """Return the pool of ``batch_workers`` threads of this
+        controller class, starting it the first time"""
+        pool = cls.__dict__.get('_batch_pool')
+        if pool is None:
+            _batch_pool_lock.acquire()
+            try:
+                pool = cls.__dict__.get('_batch_pool')
+                if pool is None:
+                    from multiprocessing.pool import ThreadPool
+                    pool = ThreadPool(cls.batch_workers)
+                    cls._batch_pool = pool
+                    _batch_pool_classes.add(cls)
+            finally:
+                _batch_pool_lock.release()
+        return pool
+
+    @classmethod
+    def close_batch_pool(cls):
+        """Close the thread pool of this controller class, waiting for
+        the calls it's running to finish
+
+        The next concurrent batch starts a new pool.
+
+        """
+        _batch_pool_lock.acquire()
+        try:
+            pool = cls.__dict__.get('_batch_pool')
+            cls._batch_pool = None
+            _batch_pool_classes.discard(cls)
+        finally:
+            _batch_pool_lock.release()
+        if pool is not None:
+            pool.close()
+            pool.join()
 
     def _get_method_args(self):
         """Return `self._rpc_args` to dispatched controller method
@@ -108,13 +238,39 @@ class JSONRPCController(WSGIController):
         if length == 0:
             log.debug("Content-Length is 0")
             abort(411)
+        if length > self.max_body_length:
+            log.debug("Content-Length larger than max body length. Max: "
+                      "%s, Sent: %s. Returning 413 error",
+                      self.max_body_length, length)
+            abort(413, "JSON body too large")
 
         raw_body = environ['wsgi.input'].read(length)
-        json_body = json.loads(urllib.unquote_plus(raw_body))
+        if raw_body[:1] in ('%', '+'):
+            # Older clients URL encode the JSON, which can't start with
+            # either character
+            raw_body = urllib.unquote_plus(raw_body)
+        try:
+            json_body = self.json_codec.loads(raw_body)
+        except ValueError, e:
+            log.debug('Error decoding request: %s', e)
+            err = jsonrpc_error(None, 'parse_error')
+            return err(environ, start_response)
+
+        if isinstance(json_body, list):
+            if not json_body:
+                err = jsonrpc_error(None, 'invalid_request')
+                return err(environ, start_response)
+            return self._batch_call(json_body, environ, start_response)
+        if not isinstance(json_body, dict):
+            err = jsonrpc_error(None, 'invalid_request')
+            return err(environ, start_response)
+        if 'id' not in json_body:
+            # A notification, which is answered like a batch of one
+            return self._batch_call([json_body], environ, start_response)
 
         self._req_id = json_body['id']
         self._req_method = json_body['method']
-        self._req_params = json_body['params']
+        self._req_params = json_body.get('params', [])
         log.debug('id: %s, method: %s, params: %s',
                   self._req_id,
                   self._req_method,
@@ -131,7 +287,8 @@ class JSONRPCController(WSGIController):
         # parameters and pass off control to the controller.
         if not isinstance(self._req_params, dict):
             # JSON-RPC version 1 request.
-            arglist = inspect.getargspec(self._func)[0][1:]
+            arglist = dispatch_table(self.__class__).inspect(
+                self._func).argnames
             if len(self._req_params) < len(arglist):
                 err = jsonrpc_error(self._req_id, 'invalid_params')
                 return err(environ, start_response)
@@ -147,37 +304,40 @@ class JSONRPCController(WSGIController):
         kargs['action'], kargs['environ'] = self._req_method, environ
         kargs['start_response'] = start_response
         self._rpc_args = kargs
+        return WSGIController.__call__(self, environ, start_response)
 
-        status = []
-        headers = []
-        exc_info = []
-
-        def change_content(new_status, new_headers, new_exc_info=None):
-            status.append(new_status)
-            headers.extend(new_headers)
-            exc_info.append(new_exc_info)
-
-        output = WSGIController.__call__(self, environ, change_content)
-        output = list(output)
-        headers.append(('Content-Length', str(len(output[0]))))
-        replace_header(headers, 'Content-Type', 'application/json')
-        start_response(status[0], headers, exc_info[0])
-
-        return output
+    def _batch_call(self, calls, environ, start_response):
+        """Answer the requests in ``calls`` with a single response"""
+        log.debug('Batch of %d calls', len(calls))
+        self._batch = calls
+        self._rpc_args = dict(environ=environ, start_response=start_response)
+        return WSGIController.__call__(self, environ, start_response)
 
     def _dispatch_call(self):
         """Implement dispatch interface specified by WSGIController"""
+        if self._batch is not None:
+            body = self._dispatch_batch()
+        else:
+            body = self.json_codec.encode_response(self._dispatch_single())
+
+        response = self._py_object.response
+        if body:
+            response.headers['Content-Type'] = 'application/json'
+            return body
+        # Notifications only, there's nothing to send back
+        response.status_int = 204
+        headers = response.headers
+        headers.pop('Content-Type', None)
+        headers.pop('Content-Length', None)
+        return None
+
+    def _dispatch_single(self):
+        """Call the method of a single request, returning its response
+        dict"""
         try:
             raw_response = self._inspect_call(self._func)
         except JSONRPCError, e:
             self._error = e.as_dict()
-        except TypeError, e:
-            # Insufficient args in an arguments dict v2 call.
-            if 'takes at least' in str(e):
-                err = _reserved_errors['invalid_params']
-                self._error = err.as_dict()
-            else:
-                raise
         except Exception, e:
             log.debug('Encountered unhandled exception: %s', repr(e))
             err = _reserved_errors['internal_error']
@@ -189,25 +349,135 @@ class JSONRPCController(WSGIController):
             response['error'] = self._error
         else:
             response['result'] = raw_response
+        return response
+
+    def _dispatch_batch(self):
+        """Make the calls of the batch, returning the JSON array of
+        their responses, or an empty string when they were all
+        notifications"""
+        calls = self._batch
+        workers = self.batch_workers
+        if workers and len(calls) > 1:
+            py_object = self._py_object
+
+            def call(request):
+                request_local.push(py_object)
+                try:
+                    return self._batch_item(request)
+                finally:
+                    request_local.pop(py_object)
+            responses = self.batch_pool().map(call, calls)
+        else:
+            responses = [self._batch_item(request) for request in calls]
+
+        # Responses are encoded one at a time, so a result that can't
+        # be encoded only fails its own call
+        encode = self.json_codec.encode_response
+        encoded = [encode(response) for response in responses
+                   if response is not None]
+        if not encoded:
+            return ''
+        return '[%s]' % ','.join(encoded)
+
+    def _batch_item(self, request):
+        """Make the call of a single request of a batch
+
+        Returns the response to the call, or None for a notification.
+
+        """
+        if not isinstance(request, dict) or \
+                not isinstance(request.get('method'), basestring):
+            err = _reserved_errors['invalid_request']
+            return dict(jsonrpc=JSONRPC_VERSION, id=None,
+                        error=err.as_dict())
+        req_id = request.get('id')
+        method = request['method']
+        params = request.get('params', [])
+        log.debug('id: %s, method: %s, params: %s', req_id, method, params)
+
+        error = None
+        try:
+            result = self._call_method(method, params)
+        except JSONRPCError, e:
+            error = e.as_dict()
+        except Exception, e:
+            log.debug('Encountered unhandled exception: %s', repr(e))
+            error = _reserved_errors['internal_error'].as_dict()
+
+        if 'id' not in request:
+            return None
+        response = dict(jsonrpc=JSONRPC_VERSION, id=req_id)
+        if error is not None:
+            response['error'] = error
+        else:
+            response['result'] = result
+        return response
+
+    def _call_method(self, method, params):
+        """Call the controller method named ``method`` with ``params``,
+        raising a JSONRPCError when it can't be called"""
+        try:
+            func = self._find_method(method)
+        except AttributeError:
+            raise _reserved_errors['method_not_found']
+        record = dispatch_table(self.__class__).inspect(func)
+
+        if isinstance(params, dict):
+            kargs = dict(params)
+        elif isinstance(params, list):
+            if len(params) < len(record.argnames):
+                raise _reserved_errors['invalid_params']
+            kargs = dict(zip(record.argnames, params))
+        else:
+            raise _reserved_errors['invalid_params']
+        kargs['action'] = method
+        kargs['environ'] = self._rpc_args['environ']
+
+        if not record.varkw:
+            kargs = dict((name, kargs[name]) for name in record.argnames
+                         if name in kargs)
+        return self._perform_call(func, kargs)
+
+    def _perform_call(self, func, args):
+        """Call ``func``, turning the HTTP errors it raises and a call
+        with the wrong arguments into JSON-RPC errors
+
+        Single calls (through :meth:`_inspect_call`) and the calls of
+        batches both go through here.
 
+        """
         try:
-            return json.dumps(response)
+            return WSGIController._perform_call(self, func, args)
+        except HTTPException, httpe:
+            response = httpe.wsgi_response
+            log.debug('%r method raised HTTPException: %s', func.__name__,
+                      response.status)
+            err = JSONRPCError(JSONRPC_HTTP_ERROR_CODE, response.status)
+            err.data = dict(status=response.status_int)
+            raise err
         except TypeError, e:
-            log.debug('Error encoding response: %s', e)
-            err = _reserved_errors['internal_error']
-            return json.dumps(dict(
-                    jsonrpc=JSONRPC_VERSION,
-                    id=self._req_id,
-                    error=err.as_dict()))
-
-    def _find_method(self):
-        """Return method named by `self._req_method` in controller if able"""
-        log.debug('Trying to find JSON-RPC method: %s', self._req_method)
-        if self._req_method.startswith('_'):
+            # Missing or unexpected arguments in a params dict (v2)
+            # call, raised by the call itself rather than from the
+            # method's body
+            tb = sys.exc_info()[2]
+            while tb.tb_next is not None:
+                tb = tb.tb_next
+            if tb.tb_frame.f_code is _perform_call_code and \
+                    _bad_arguments.search(str(e)):
+                raise _reserved_errors['invalid_params']
+            raise
+
+    def _find_method(self, method=None):
+        """Return method named by ``method`` (by default
+        `self._req_method`) in controller if able"""
+        if method is None:
+            method = self._req_method
+        log.debug('Trying to find JSON-RPC method: %s', method)
+        if method.startswith('_'):
             raise AttributeError("Method not allowed")
 
         try:
-            func = getattr(self, self._req_method, None)
+            func = getattr(self, method, None)
         except UnicodeEncodeError:
             # XMLRPCController catches this, not sure why.
             raise AttributeError("Problem decoding unicode in requested "
@@ -216,4 +486,4 @@ class JSONRPCController(WSGIController):
         if isinstance(func, types.MethodType):
             return func
         else:
-            raise AttributeError("No such method: %s" % self._req_method)
+            raise AttributeError("No such method: %s" % method)
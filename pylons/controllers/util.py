@@ -11,13 +11,19 @@ below.
 Functions available:
 
 :func:`abort`, :func:`forward`, :func:`etag_cache`,
-:func:`mimetype` and :func:`redirect`
+:func:`mimetype`, :func:`not_modified` and :func:`redirect`
 """
 import base64
 import binascii
+import calendar
+import codecs
 import hmac
+import json
 import logging
 import re
+import zlib
+from datetime import datetime
+from email.utils import formatdate, mktime_tz, parsedate_tz
 try:
     import cPickle as pickle
 except ImportError:
@@ -33,7 +39,9 @@ from webob.exc import status_map
 
 import pylons
 
-__all__ = ['abort', 'etag_cache', 'redirect', 'Request', 'Response']
+__all__ = ['abort', 'etag_cache', 'not_modified', 'redirect',
+           'CachePolicy', 'EncodedAppIter', 'Request', 'Response',
+           'SignedCookieCodec']
 
 log = logging.getLogger(__name__)
 
@@ -74,39 +82,51 @@ class Request(WebObRequest):
     def match_accept(self, mimetypes):
         return self.accept.first_match(mimetypes)
 
-    def signed_cookie(self, name, secret):
+    def signed_cookie(self, name, secret, codec=None, legacy=False):
         """Extract a signed cookie of ``name`` from the request
 
         The cookie is expected to have been created with
         ``Response.signed_cookie``, and the ``secret`` should be the
-        same as the one used to sign it.
+        same as the one used to sign it. ``secret`` may also be a list
+        of secrets, any of which is accepted, see
+        :class:`SignedCookieCodec`. A ``codec`` can be given instead,
+        for a serializer other than JSON.
+
+        With ``legacy``, cookies in the pickle format used before
+        Pylons 1.0.3 are read too. Only turn it on while those cookies
+        are still around, as loading a pickle can run arbitrary code if
+        the secret leaks.
 
         Any failure in the signature of the data will result in None
         being returned.
 
         """
-        cookie = self.str_cookies.get(name)
+        try:
+            cookies = self.str_cookies
+        except AttributeError:
+            # WebOb 1.2+ only has the decoded cookies
+            cookies = self.cookies
+        cookie = _to_bytes(cookies.get(name))
         if not cookie:
             return None
+        if '.' in cookie:
+            if codec is None:
+                codec = SignedCookieCodec(secret)
+            return codec.loads(cookie, name)
+        if not legacy:
+            return None
         try:
             input_sig, pickled = cookie[:40], base64.standard_b64decode(cookie[40:])
         except binascii.Error:
             # Badly formed data can make base64 die
             return None
-        sig = hmac.new(secret, pickled, sha1).hexdigest()
-
-        # Avoid timing attacks
-        invalid_bits = 0
-        if len(sig) != len(input_sig):
-            return None
-
-        for a, b in zip(sig, input_sig):
-            invalid_bits += a != b
-
-        if invalid_bits:
-            return None
-        else:
-            return pickle.loads(pickled)
+        if isinstance(secret, basestring):
+            secret = [secret]
+        for key in secret:
+            sig = hmac.new(_to_bytes(key), pickled, sha1).hexdigest()
+            if _compare_digest(sig, input_sig):
+                return pickle.loads(pickled)
+        return None
 
 
 class Response(WebObResponse):
@@ -131,21 +151,304 @@ class Response(WebObResponse):
     def wsgi_response(self):
         return self.status, self.headers, self.body
 
-    def signed_cookie(self, name, data, secret=None, **kwargs):
+    def signed_cookie(self, name, data, secret=None, codec=None, **kwargs):
         """Save a signed cookie with ``secret`` signature
 
-        Saves a signed cookie of the pickled data. All other keyword
-        arguments that ``WebOb.set_cookie`` accepts are usable and
-        passed to the WebOb set_cookie method after creating the signed
-        cookie value.
+        Saves a signed cookie of the data, serialized by a
+        :class:`SignedCookieCodec` for ``secret`` (by default, as JSON)
+        or by ``codec``. With the default codec, ``data`` must be JSON
+        serializable, or a TypeError is raised. All other keyword
+        arguments that
+        ``WebOb.set_cookie`` accepts are usable and passed to the WebOb
+        set_cookie method after creating the signed cookie value.
+
+        """
+        if codec is None:
+            codec = SignedCookieCodec(secret)
+        self.set_cookie(name, codec.dumps(data, name), **kwargs)
+
+
+class SignedCookieCodec(object):
+    """Serializes and signs cookie values, for
+    :meth:`Response.signed_cookie` and :meth:`Request.signed_cookie`
+
+    ``secrets``
+        The secret to sign with, or a list of secrets. Values are
+        signed with the first one, but any of them is accepted when
+        they're read, so a new secret can be put in front of the old
+        ones and the old ones removed once their cookies have expired.
+    ``serializer``
+        Module or object with ``dumps`` and ``loads`` functions turning
+        the data into a string and back. Defaults to compact JSON, so
+        the data can hold dicts, lists, strings, numbers, booleans and
+        None (tuples come back as lists and strings as unicode).
+    ``compress_threshold``
+        Serialized data over this many bytes is compressed with zlib,
+        when that makes it smaller. None turns compression off.
+    ``digestmod``
+        The hash used for the HMAC signature.
+
+    Cookie values look like ``<data>.<signature>``, both URL safe
+    base64 without padding, the data starting with a ``.`` when it's
+    compressed. The signature covers the cookie name too, so a value
+    can't be moved to another cookie signed with the same secret.
+
+    """
+    def __init__(self, secrets, serializer=None, compress_threshold=256,
+                 digestmod=sha1):
+        if isinstance(secrets, basestring):
+            secrets = [secrets]
+        self.secrets = [_to_bytes(secret) for secret in secrets]
+        if not self.secrets:
+            raise ValueError('At least one secret is required')
+        self.serializer = serializer or _json_serializer
+        self.compress_threshold = compress_threshold
+        self.digestmod = digestmod
+        # Keyed once, copied for each signature
+        self._hmacs = [hmac.new(secret, digestmod=digestmod)
+                       for secret in self.secrets]
+
+    def _signature(self, keyed, name, value):
+        mac = keyed.copy()
+        mac.update('%s|%s' % (_to_bytes(name), value))
+        return mac.digest()
+
+    def dumps(self, data, name=''):
+        """Return the signed cookie value of ``data``, for the cookie
+        ``name``"""
+        payload = _to_bytes(self.serializer.dumps(data))
+        prefix = ''
+        if self.compress_threshold is not None and \
+                len(payload) > self.compress_threshold:
+            compressed = zlib.compress(payload)
+            if len(compressed) < len(payload):
+                payload = compressed
+                prefix = '.'
+        value = prefix + _b64encode(payload)
+        return '%s.%s' % (value, _b64encode(
+                self._signature(self._hmacs[0], name, value)))
+
+    def loads(self, cookie, name=''):
+        """Return the data of the signed cookie value ``cookie``, or
+        None when it wasn't signed with one of the secrets or can't be
+        read"""
+        value, sep, sig = cookie.rpartition('.')
+        if not value:
+            return None
+        try:
+            sig = _b64decode(sig)
+        except (TypeError, binascii.Error):
+            return None
+        for keyed in self._hmacs:
+            if _compare_digest(self._signature(keyed, name, value), sig):
+                break
+        else:
+            return None
+        try:
+            if value[0] == '.':
+                payload = zlib.decompress(_b64decode(value[1:]))
+            else:
+                payload = _b64decode(value)
+            return self.serializer.loads(payload)
+        except Exception:
+            log.debug("Couldn't load signed cookie %r", name, exc_info=True)
+            return None
+
+
+class _JSONSerializer(object):
+    # json.dumps and loads build a new encoder or decoder when given
+    # any options
+    def __init__(self):
+        self.dumps = json.JSONEncoder(separators=(',', ':')).encode
+        self.loads = json.JSONDecoder().decode
+
+_json_serializer = _JSONSerializer()
+
+
+def _to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _b64encode(value):
+    return base64.urlsafe_b64encode(value).rstrip('=')
+
+
+def _b64decode(value):
+    return base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+
+
+def _slow_compare_digest(a, b):
+    """Compare two strings in a time that doesn't depend on where they
+    differ"""
+    if len(a) != len(b):
+        return False
+    invalid_bits = 0
+    for x, y in zip(a, b):
+        invalid_bits |= ord(x) ^ ord(y)
+    return invalid_bits == 0
+
+# Python 2.7.7 and later compare digests in C
+_compare_digest = getattr(hmac, 'compare_digest', _slow_compare_digest)
+
+
+class EncodedAppIter(object):
+    """WSGI app_iter that encodes the unicode chunks of ``chunks`` as
+    they're sent
+
+    ``chunks`` may yield a mix of unicode and str, str chunks are
+    passed through untouched. The chunks are encoded with an
+    incremental encoder for ``charset``, so only one chunk is held in
+    memory at a time and stateful encodings only emit their preamble
+    once.
+
+    :class:`~pylons.controllers.core.WSGIController` wraps generators
+    returned by actions in an EncodedAppIter, encoding with the
+    response's charset, and sends the EncodedAppIters returned by the
+    render functions with ``stream=True`` as they are.
+
+    """
+    def __init__(self, chunks, charset, errors='strict'):
+        self.chunks = chunks
+        self.charset = charset
+        self.errors = errors
+
+    def __iter__(self):
+        encoder = None
+        for chunk in self.chunks:
+            if isinstance(chunk, unicode):
+                if encoder is None:
+                    if not self.charset:
+                        raise TypeError("Unicode chunks can only be sent if "
+                                        "the response charset has been set")
+                    encoder = codecs.getincrementalencoder(self.charset)(
+                        self.errors)
+                chunk = encoder.encode(chunk)
+            yield chunk
+        if encoder is not None:
+            tail = encoder.encode(u'', True)
+            if tail:
+                yield tail
+
+    def close(self):
+        close = getattr(self.chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+class CachePolicy(object):
+    """HTTP caching policy of a response, replacing the ``Cache-Control:
+    no-cache`` and ``Pragma: no-cache`` headers Pylons sends by default
+
+    ``max_age``
+        Seconds the response may be cached for.
+    ``s_maxage``
+        Seconds shared caches (proxies, CDNs) may cache it for,
+        overriding ``max_age`` for them.
+    ``stale_while_revalidate``
+        Seconds a stale response may be served while the cache
+        revalidates it in the background.
+    ``stale_if_error``
+        Seconds a stale response may be served when revalidating it
+        fails.
+    ``public`` / ``private``
+        Whether shared caches may store the response, or only the
+        browser.
+    ``no_cache`` / ``no_store`` / ``must_revalidate``
+        The directives of the same names.
+    ``vary``
+        Request header names the response depends on, added to its
+        Vary header.
+
+    Policies are usually set with the
+    :func:`~pylons.decorators.cache.cache_control` decorator, or
+    registered by name in the ``pylons.cache_policies`` option (as
+    CachePolicy objects or dicts of their arguments) and named by the
+    ``cache_policy`` of a route, e.g. in ``config/environment.py``::
+
+        config['pylons.cache_policies']['pages'] = dict(
+            public=True, max_age=600, vary='Accept-Language')
+
+    and in ``config/routing.py``::
+
+        map.connect('/about', controller='pages', action='about',
+                    cache_policy='pages')
+
+    A policy is only applied to successful and ``304 Not Modified``
+    responses, and not when the action set the Cache-Control header
+    itself.
+
+    """
+    def __init__(self, max_age=None, s_maxage=None,
+                 stale_while_revalidate=None, stale_if_error=None,
+                 public=False, private=False, no_cache=False,
+                 no_store=False, must_revalidate=False, vary=None):
+        if public and private:
+            raise ValueError("A cache policy can't be both public and "
+                             "private")
+        directives = []
+        for flag, directive in ((public, 'public'), (private, 'private'),
+                                (no_cache, 'no-cache'),
+                                (no_store, 'no-store'),
+                                (must_revalidate, 'must-revalidate')):
+            if flag:
+                directives.append(directive)
+        for value, directive in ((max_age, 'max-age'),
+                                 (s_maxage, 's-maxage'),
+                                 (stale_while_revalidate,
+                                  'stale-while-revalidate'),
+                                 (stale_if_error, 'stale-if-error')):
+            if value is not None:
+                directives.append('%s=%d' % (directive, value))
+        self.cache_control = ', '.join(directives)
+        if isinstance(vary, basestring):
+            vary = [vary]
+        self.vary = tuple(vary or ())
+        self._vary = ', '.join(self.vary)
+
+    def __repr__(self):
+        return '<CachePolicy %r vary=%r>' % (self.cache_control, self.vary)
+
+    def apply(self, response, default=None):
+        """Set the policy's headers on ``response``
+
+        The Cache-Control header is only replaced when it's missing or
+        still ``default``, the value the response started with.
 
         """
-        pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
-        sig = hmac.new(secret, pickled, sha1).hexdigest()
-        self.set_cookie(name, sig + base64.standard_b64encode(pickled), **kwargs)
+        # A single pass over the header list, WebOb's headers object
+        # scans the whole list for every lookup or change
+        headerlist = []
+        vary = None
+        for header in response.headerlist:
+            name = header[0].lower()
+            if name == 'cache-control':
+                if header[1] != default:
+                    return
+            elif name == 'pragma' and header[1] == 'no-cache':
+                pass
+            elif name == 'vary' and self.vary:
+                vary = header[1]
+            else:
+                headerlist.append(header)
+        if self.cache_control:
+            headerlist.append(('Cache-Control', self.cache_control))
+        if self.vary:
+            if vary:
+                values = [value.strip() for value in vary.split(',')
+                          if value.strip()]
+                present = set(value.lower() for value in values)
+                values.extend(name for name in self.vary
+                              if name.lower() not in present)
+                vary = ', '.join(values)
+            else:
+                vary = self._vary
+            headerlist.append(('Vary', vary))
+        response.headerlist = headerlist
 
 
-def etag_cache(key=None):
+def etag_cache(key=None, last_modified=None):
     """Use the HTTP Entity Tag cache for Browser side caching
 
     If a "If-None-Match" header is found, and equivilant to ``key``,
@@ -154,6 +457,11 @@ def etag_cache(key=None):
 
     Otherwise, the ETag header will be added to the response headers.
 
+    ``last_modified``, a :class:`~datetime.datetime` (in UTC) or a
+    timestamp, is sent as the Last-Modified header, and checked against
+    the "If-Modified-Since" header when the request has no
+    "If-None-Match". Either can be left out.
+
     Suggested use is within a Controller Action like so:
 
     .. code-block:: python
@@ -170,12 +478,17 @@ def etag_cache(key=None):
         exception if the ETag received matches the key provided.
 
     """
-    if_none_matches = IF_NONE_MATCH.findall(
-        pylons.request.environ.get('HTTP_IF_NONE_MATCH', ''))
     response = pylons.response._current_obj()
-    response.headers['ETag'] = '"%s"' % key
-    if str(key) in if_none_matches:
-        log.debug("ETag match, returning 304 HTTP Not Modified Response")
+    etag = None
+    if key is not None:
+        etag = response.headers['ETag'] = '"%s"' % key
+    if last_modified is not None:
+        last_modified = _timestamp(last_modified)
+        response.headers['Last-Modified'] = formatdate(last_modified,
+                                                       usegmt=True)
+    if not_modified(pylons.request.environ, etag, last_modified):
+        log.debug("ETag or Last-Modified match, returning 304 HTTP Not "
+                  "Modified Response")
         response.headers.pop('Content-Type', None)
         response.headers.pop('Cache-Control', None)
         response.headers.pop('Pragma', None)
@@ -184,6 +497,41 @@ def etag_cache(key=None):
         log.debug("ETag didn't match, returning response object")
 
 
+def not_modified(environ, etag=None, last_modified=None):
+    """Whether the request's conditional headers show the client
+    already has the representation with ``etag`` (a quoted entity tag,
+    as sent in the ETag header) or ``last_modified`` (a timestamp)
+
+    "If-None-Match" is checked when the request has it, with the weak
+    comparison used for GET requests. "If-Modified-Since" is only
+    checked when it doesn't, as it's less precise.
+
+    """
+    if_none_match = environ.get('HTTP_IF_NONE_MATCH')
+    if if_none_match:
+        if etag is None:
+            return False
+        if if_none_match.strip() == '*':
+            return True
+        etag = etag[2:] if etag.startswith('W/') else etag
+        return etag.strip('"') in IF_NONE_MATCH.findall(if_none_match)
+    if_modified_since = environ.get('HTTP_IF_MODIFIED_SINCE')
+    if if_modified_since and last_modified is not None:
+        since = parsedate_tz(if_modified_since.split(';')[0])
+        if since is None:
+            return False
+        return int(last_modified) <= mktime_tz(since)
+    return False
+
+
+def _timestamp(value):
+    """Seconds since the epoch of a datetime (naive ones are taken to
+    be in UTC) or a timestamp"""
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())
+    return int(value)
+
+
 def forward(wsgi_app):
     """Forward the request to a WSGI application. Returns its response.
 
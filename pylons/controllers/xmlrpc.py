@@ -7,9 +7,10 @@ import xmlrpclib
 from paste.response import replace_header
 
 from pylons.controllers import WSGIController
+from pylons.controllers.dispatch import dispatch_table
 from pylons.controllers.util import abort, Response
 
-__all__ = ['XMLRPCController']
+__all__ = ['XMLRPCController', 'XMLRPCMethod', 'method_registry']
 
 log = logging.getLogger(__name__)
 
@@ -18,16 +19,31 @@ XMLRPC_MAPPING = ((basestring, 'string'), (list, 'array'), (bool, 'boolean'),
                   (xmlrpclib.DateTime, 'dateTime.iso8601'),
                   (xmlrpclib.Binary, 'base64'))
 
+# The XML-RPC names of the exact types xmlrpclib.loads returns, checked
+# before falling back to the isinstance checks of XMLRPC_MAPPING
+_XMLRPC_TYPES = {str: 'string', unicode: 'string', list: 'array',
+                 bool: 'boolean', int: 'int', float: 'double',
+                 dict: 'struct', xmlrpclib.DateTime: 'dateTime.iso8601',
+                 xmlrpclib.Binary: 'base64'}
+
+# Method registries, keyed by controller class
+_registries = {}
+
 
 def xmlrpc_sig(args):
     """Returns a list of the function signature in string format based on a
     tuple provided by xmlrpclib."""
     signature = []
     for param in args:
-        for type, xml_name in XMLRPC_MAPPING:
-            if isinstance(param, type):
-                signature.append(xml_name)
-                break
+        xml_name = _XMLRPC_TYPES.get(type(param))
+        if xml_name is None:
+            for type_, name in XMLRPC_MAPPING:
+                if isinstance(param, type_):
+                    xml_name = name
+                    break
+            else:
+                continue
+        signature.append(xml_name)
     return signature
 
 
@@ -37,6 +53,84 @@ def xmlrpc_fault(code, message):
     return Response(body=xmlrpclib.dumps(fault, methodresponse=True))
 
 
+class XMLRPCMethod(object):
+    """Call information for an XML-RPC method, compiled once
+
+    ``name``
+        Name of the method on the controller.
+    ``public_name``
+        Name the method is published under.
+    ``argnames``
+        Tuple of the argument names of the method, not including
+        ``self``.
+    ``varkw``
+        Whether the method accepts ``**kwargs``.
+    ``signature``
+        The method's ``signature`` attribute, or None.
+    ``signatures``
+        Frozenset of the tuples of parameter types allowed by the
+        signature, or None when any parameters are.
+
+    """
+    __slots__ = ('name', 'public_name', 'argnames', 'varkw', 'signature',
+                 'signatures')
+
+    def __init__(self, name, public_name, func, argnames, varkw):
+        self.name = name
+        self.public_name = public_name
+        self.argnames = argnames
+        self.varkw = varkw
+        self.signature = getattr(func, 'signature', None)
+        if self.signature is None:
+            self.signatures = None
+        else:
+            self.signatures = frozenset(tuple(sig[1:])
+                                        for sig in self.signature)
+
+    def check(self, params):
+        """Return whether ``params`` match the method's signature"""
+        if self.signatures is None:
+            return True
+        sig = xmlrpc_sig(params)
+        return len(sig) == len(params) and tuple(sig) in self.signatures
+
+
+class MethodRegistry(object):
+    """The published XML-RPC methods of a controller class
+
+    ``methods``
+        Dict of method name (on the controller) to
+        :class:`XMLRPCMethod`.
+    ``published``
+        List of the published method names, sorted by their name on
+        the controller.
+
+    """
+    def __init__(self, controller):
+        self.methods = {}
+        self.published = []
+        controller_class = controller.__class__
+        table = dispatch_table(controller_class)
+        for name in sorted(table.actions):
+            record = table.actions[name]
+            method = XMLRPCMethod(name, controller._publish_method_name(name),
+                                  getattr(controller_class, name),
+                                  record.argnames, record.varkw)
+            self.methods[name] = method
+            self.published.append(method.public_name)
+
+
+def method_registry(controller):
+    """Return the :class:`MethodRegistry` of the class of
+    ``controller``, building it on first use"""
+    controller_class = controller.__class__
+    try:
+        return _registries[controller_class]
+    except KeyError:
+        registry = _registries[controller_class] = MethodRegistry(controller)
+        return registry
+
+
 class XMLRPCController(WSGIController):
     """XML-RPC Controller that speaks WSGI
 
@@ -99,6 +193,20 @@ class XMLRPCController(WSGIController):
 
         Requiring a signature is optional.
 
+    The published methods, their arguments and signatures are compiled
+    once per controller class, into its method registry (see
+    :func:`method_registry`).
+
+    ``system.multicall`` makes several calls in a single request,
+    returning an array of their results::
+
+        server.system.multicall([
+            {'methodName': 'userstatus', 'params': []},
+            {'methodName': 'userinfo', 'params': ['bob']}])
+
+    A call that fails gets a fault struct in place of its result,
+    without failing the others.
+
     """
     allow_none = False
     max_body_length = 4194304
@@ -131,8 +239,8 @@ class XMLRPCController(WSGIController):
         rpc_args, orig_method = xmlrpclib.loads(body)
 
         method = self._find_method_name(orig_method)
-        func = self._find_method(method)
-        if not func:
+        record = self._lookup_method(method)
+        if record is None:
             if log_debug:
                 log.debug("Method: %r not found, returning xmlrpc fault",
                           method)
@@ -140,38 +248,20 @@ class XMLRPCController(WSGIController):
                                 method)(environ, start_response)
 
         # Signature checking for params
-        if hasattr(func, 'signature'):
+        if not record.check(rpc_args):
             if log_debug:
-                log.debug("Checking XMLRPC argument signature")
-            valid_args = False
-            params = xmlrpc_sig(rpc_args)
-            for sig in func.signature:
-                # Next sig if we don't have the same amount of args
-                if len(sig) - 1 != len(rpc_args):
-                    continue
-
-                # If the params match, we're valid
-                if params == sig[1:]:
-                    valid_args = True
-                    break
-
-            if not valid_args:
-                if log_debug:
-                    log.debug("Bad argument signature recieved, returning "
-                              "xmlrpc fault")
-                msg = ("Incorrect argument signature. %r recieved does not "
-                       "match %r signature for method %r" % \
-                           (params, func.signature, orig_method))
-                return xmlrpc_fault(0, msg)(environ, start_response)
+                log.debug("Bad argument signature recieved, returning "
+                          "xmlrpc fault")
+            return xmlrpc_fault(0, self._signature_error(
+                    record, rpc_args, orig_method))(environ, start_response)
 
         # Change the arg list into a keyword dict based off the arg
         # names in the functions definition
-        arglist = inspect.getargspec(func)[0][1:]
-        kargs = dict(zip(arglist, rpc_args))
+        kargs = dict(zip(record.argnames, rpc_args))
         kargs['action'], kargs['environ'] = method, environ
         kargs['start_response'] = start_response
         self.rpc_kargs = kargs
-        self._func = func
+        self._func = getattr(self, record.name)
 
         # Now that we know the method is valid, and the args are valid,
         # we can dispatch control to the default WSGIController
@@ -200,6 +290,30 @@ class XMLRPCController(WSGIController):
                                    allow_none=self.allow_none)
         return response
 
+    def _lookup_method(self, name):
+        """Return the :class:`XMLRPCMethod` for the method ``name`` of
+        the controller, or None if there's no such public method
+
+        Methods are looked up in the class's method registry. Those it
+        doesn't have (set on the instance, or resolved through
+        ``__getattr__``) are inspected on every call.
+
+        """
+        record = method_registry(self).methods.get(name)
+        if record is None:
+            func = self._find_method(name)
+            if func is None:
+                return None
+            action = dispatch_table(self.__class__).inspect(func)
+            record = XMLRPCMethod(name, self._publish_method_name(name),
+                                  func, action.argnames, action.varkw)
+        return record
+
+    def _signature_error(self, record, params, orig_method):
+        return ("Incorrect argument signature. %r recieved does not "
+                "match %r signature for method %r" %
+                (xmlrpc_sig(params), record.signature, orig_method))
+
     def _find_method(self, name):
         """Locate a method in the controller by the specified name and
         return it"""
@@ -238,16 +352,69 @@ class XMLRPCController(WSGIController):
 
     def system_listMethods(self):
         """Returns a list of XML-RPC methods for this XML-RPC resource"""
-        methods = []
-        for method in dir(self):
-            meth = getattr(self, method)
-
-            if not method.startswith('_') and isinstance(meth,
-                                                         types.MethodType):
-                methods.append(self._publish_method_name(method))
-        return methods
+        return list(method_registry(self).published)
     system_listMethods.signature = [['array']]
 
+    def system_multicall(self, calls):
+        """Calls several methods, returning an array of their results
+
+        Each call is a struct with the ``methodName`` and the
+        ``params`` of the method to call. The result of a call is an
+        array holding the value returned by the method, or, when the
+        call failed, a struct with the ``faultCode`` and
+        ``faultString`` of its fault.
+
+        """
+        environ = self.rpc_kargs['environ']
+        start_response = self.rpc_kargs['start_response']
+        results = []
+        for call in calls:
+            try:
+                result = self._multicall_call(call, environ, start_response)
+            except xmlrpclib.Fault, fault:
+                result = fault
+            except Exception, e:
+                log.debug("Error calling %r in system.multicall",
+                          call, exc_info=True)
+                result = xmlrpclib.Fault(1, '%s:%s' % (e.__class__.__name__,
+                                                       e))
+            if isinstance(result, xmlrpclib.Fault):
+                results.append(dict(faultCode=result.faultCode,
+                                    faultString=result.faultString))
+            else:
+                results.append([result])
+        return results
+    system_multicall.signature = [['array', 'array']]
+
+    def _multicall_call(self, call, environ, start_response):
+        """Make a single call of a system.multicall"""
+        if not isinstance(call, dict):
+            raise xmlrpclib.Fault(0, "system.multicall expects an array "
+                                     "of structs")
+        orig_method = call.get('methodName')
+        params = call.get('params', [])
+        if not isinstance(orig_method, basestring) or \
+                not isinstance(params, list):
+            raise xmlrpclib.Fault(0, "system.multicall expects structs "
+                                     "with a methodName and params")
+        method = self._find_method_name(orig_method)
+        if method == 'system_multicall':
+            raise xmlrpclib.Fault(0, "Recursive system.multicall forbidden")
+        record = self._lookup_method(method)
+        if record is None:
+            raise xmlrpclib.Fault(0, "No such method name %r" % method)
+        if not record.check(params):
+            raise xmlrpclib.Fault(0, self._signature_error(
+                    record, params, orig_method))
+
+        kargs = dict(zip(record.argnames, params))
+        kargs['action'], kargs['environ'] = method, environ
+        kargs['start_response'] = start_response
+        if not record.varkw:
+            kargs = dict((name, kargs[name]) for name in record.argnames
+                         if name in kargs)
+        return self._perform_call(getattr(self, record.name), kargs)
+
     def system_methodSignature(self, name):
         """Returns an array of array's for the valid signatures for a
         method.
@@ -7,6 +7,7 @@ decorators for use with controllers are in the
 
 """
 import logging
+import types
 import warnings
 
 import formencode
@@ -30,28 +31,161 @@ class JSONEncoder(simplejson.JSONEncoder):
         return super(JSONEncoder, self).default(obj)
 
 
-@decorator
-def jsonify(func, *args, **kwargs):
-    """Action decorator that formats output for JSON
+# Size of the chunks streamed by jsonify(stream=True), and the number of
+# array items it encodes at a time
+JSON_CHUNK_SIZE = 16384
+JSON_BATCH_SIZE = 100
 
-    Given a function that will return content, this decorator will turn
-    the result into JSON, with a content-type of 'application/json' and
-    output it.
 
-    """
-    pylons = get_pylons(args)
-    pylons.response.headers['Content-Type'] = 'application/json; charset=utf-8'
-    data = func(*args, **kwargs)
-    if isinstance(data, (list, tuple)):
+def _warn_array(data):
+    if isinstance(data, (list, tuple, types.GeneratorType)):
         msg = "JSON responses with Array envelopes are susceptible to " \
               "cross-site data leak attacks, see " \
               "http://wiki.pylonshq.com/display/pylonsfaq/Warnings"
-        warnings.warn(msg, Warning, 2)
+        warnings.warn(msg, Warning, 3)
         log.warning(msg)
+
+
+def _jsonify(func, *args, **kwargs):
+    pylons = get_pylons(args)
+    pylons.response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    data = func(*args, **kwargs)
+    _warn_array(data)
     log.debug("Returning JSON wrapped action output")
     return simplejson.dumps(data, cls=JSONEncoder, encoding='utf-8')
 
 
+_CONTAINERS = (dict, list, tuple, types.GeneratorType)
+
+
+def _nested(obj):
+    """Whether ``obj`` is a generator, or a dict, list or tuple holding
+    other containers"""
+    if isinstance(obj, types.GeneratorType):
+        return True
+    if isinstance(obj, dict):
+        values = obj.itervalues()
+    elif isinstance(obj, (list, tuple)) and not hasattr(obj, '_asdict'):
+        values = obj
+    else:
+        return False
+    for value in values:
+        if isinstance(value, _CONTAINERS):
+            return True
+    return False
+
+
+def _iterencode(encoder, obj):
+    """Generate the JSON encoding of ``obj``
+
+    Generators, and the dicts, lists and tuples containing other
+    containers, are walked here, anything else is encoded in one go by
+    ``encoder``. simplejson's own ``iterencode`` builds the whole
+    document in memory when its C speedups are available.
+
+    """
+    if not _nested(obj):
+        yield encoder.encode(obj)
+    elif isinstance(obj, dict):
+        yield '{'
+        separator = ''
+        for key, value in obj.iteritems():
+            # Have the encoder convert the key, to get the same handling
+            # of non-string keys
+            yield separator + encoder.encode({key: None})[1:-5]
+            for piece in _iterencode(encoder, value):
+                yield piece
+            separator = encoder.item_separator
+        yield '}'
+    else:
+        yield '['
+        separator = ''
+        # Items are encoded in batches, each encode call has a fixed
+        # cost that would otherwise dominate for small items
+        batch = []
+        for item in obj:
+            if not _nested(item):
+                batch.append(item)
+                if len(batch) < JSON_BATCH_SIZE:
+                    continue
+            if batch:
+                yield separator + encoder.encode(batch)[1:-1]
+                separator = encoder.item_separator
+                batch = []
+            if _nested(item):
+                yield separator
+                for piece in _iterencode(encoder, item):
+                    yield piece
+                separator = encoder.item_separator
+        if batch:
+            yield separator + encoder.encode(batch)[1:-1]
+        yield ']'
+
+
+def _iter_json(data, chunk_size):
+    """Generate the JSON encoding of ``data`` in chunks of about
+    ``chunk_size`` characters"""
+    try:
+        encoder = JSONEncoder(encoding='utf-8', iterable_as_array=True)
+    except TypeError:
+        # simplejson < 3.8
+        encoder = JSONEncoder(encoding='utf-8')
+    buffered = []
+    size = 0
+    for piece in _iterencode(encoder, data):
+        buffered.append(piece)
+        size += len(piece)
+        if size >= chunk_size:
+            yield ''.join(buffered)
+            buffered = []
+            size = 0
+    if buffered:
+        yield ''.join(buffered)
+
+
+def _jsonify_stream(func, *args, **kwargs):
+    pylons = get_pylons(args)
+    pylons.response.headers['Content-Type'] = 'application/json; charset=utf-8'
+    data = func(*args, **kwargs)
+    _warn_array(data)
+    log.debug("Streaming JSON wrapped action output")
+    return _iter_json(data, JSON_CHUNK_SIZE)
+
+
+def jsonify(func=None, stream=False):
+    """Action decorator that formats output for JSON
+
+    Given a function that will return content, this decorator will turn
+    the result into JSON, with a content-type of 'application/json' and
+    output it.
+
+    ``stream``
+        When True, the JSON is encoded as it's sent, in chunks, rather
+        than built up as a single string first. Any iterables (such as
+        generators) in the data are encoded as arrays, so a large
+        result can be produced lazily and sent without ever being held
+        in memory. As the status and headers have been sent by the
+        time the data is encoded, an error while encoding truncates the
+        response rather than turning it into an error response.
+
+    Use as either of::
+
+        @jsonify
+        def index(self):
+            return dict(items=[1, 2, 3])
+
+        @jsonify(stream=True)
+        def export(self):
+            return dict(rows=(row.to_dict() for row in query))
+
+    """
+    if func is None:
+        if stream:
+            return decorator(_jsonify_stream)
+        return decorator(_jsonify)
+    return decorator(_jsonify, func)
+
+
 def validate(schema=None, validators=None, form=None, variable_decode=False,
              dict_char='.', list_char='-', post_only=True, state=None,
              on_get=False, **htmlfill_kwargs):
@@ -1,21 +1,47 @@
 """Caching decorator"""
 import inspect
 import logging
+import re
+import threading
 import time
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
 
 from decorator import decorator
 from paste.deploy.converters import asbool
 
+import pylons.lrucache # registers the 'lru' Beaker cache type
+from pylons.controllers.util import CachePolicy, etag_cache
 from pylons.decorators.util import get_pylons
 
 log = logging.getLogger(__name__)
 
+# memcached's limit, which includes the namespace
+MAX_KEY_LENGTH = 250
+
+# Keys with anything else (control characters, non-ASCII) are digested,
+# as not every backend can store them
+_unsafe_key = re.compile(r'[^\x20-\x7e]')
+
+# Namespace of the tag index, which maps each tag to the namespaces and
+# keys of the values tagged with it. It's split in TAG_BUCKETS
+# namespaces by the hash of the tag, so the file backend only rewrites
+# a bucket when a value is tagged.
+TAG_NAMESPACE = 'pylons.decorators.cache.tags'
+TAG_BUCKETS = 64
+
+# A lock per bucket, as the memory backend has no write lock of its own
+# (the file and dbm backends' file locks also keep other processes out)
+_tag_locks = [threading.Lock() for i in range(TAG_BUCKETS)]
+
 
 def beaker_cache(key="cache_default", expire="never", type=None,
                  query_args=False,
                  cache_headers=('content-type', 'content-length'),
                  invalidate_on_startup=False,
-                 cache_response=True, **b_kwargs):
+                 cache_response=True, version=None, tags=None, **b_kwargs):
     """Cache decorator utilizing Beaker. Caches action or other
     function that returns a pickle-able object as a result.
 
@@ -30,8 +56,8 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         Time in seconds before cache expires, or the string "never".
         Defaults to "never"
     ``type``
-        Type of cache to use: dbm, memory, file, memcached, or None for
-        Beaker's default
+        Type of cache to use: dbm, memory, file, memcached, lru (see
+        :mod:`pylons.lrucache`), or None for Beaker's default
     ``query_args``
         Uses the query arguments as the key, defaults to False
     ``cache_headers``
@@ -47,6 +73,23 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         .. note::
             When cache_response is set to False, the cache_headers
             argument is ignored as none of the response is cached.
+    ``version``
+        Added to the cache namespace, changing it makes the values
+        cached under the previous version unreachable (e.g. when the
+        format of the cached values changes).
+
+    ``tags``
+        List of tags for the cached values, which can then be removed
+        together with :func:`invalidate_tags`. Tags are interpolated
+        with the function's arguments, e.g. ``'product-%(id)s'``.
+        Instead of a list, a function can be given, which is called
+        with the same arguments as the cached function and returns
+        the tags. A value whose tags are invalidated while it's being
+        created isn't kept.
+
+    Keys are built with :func:`make_cache_key`, so they don't depend
+    on the order of the arguments, and long keys are replaced by a
+    digest.
 
     If cache_enabled is set to False in the .ini file, then cache is
     disabled globally.
@@ -68,9 +111,12 @@ def beaker_cache(key="cache_default", expire="never", type=None,
             log.debug("Caching disabled, skipping cache lookup")
             return func(*args, **kwargs)
 
+        if key or tags:
+            args_dict = kwargs.copy()
+            args_dict.update(_make_dict_from_args(func, args,
+                                                  arg_names[func]))
         if key:
-            key_dict = kwargs.copy()
-            key_dict.update(_make_dict_from_args(func, args))
+            key_dict = args_dict.copy()
             if query_args:
                 key_dict.update(pylons.request.GET.mixed())
 
@@ -85,18 +131,13 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         self = None
         if args:
             self = args[0]
-        namespace, cache_key = create_cache_key(func, key_dict, self)
+        namespace, cache_key = create_cache_key(func, key_dict, self,
+                                                version)
 
         if type:
             b_kwargs['type'] = type
 
-        cache_obj = getattr(pylons.app_globals, 'cache', None)
-        if not cache_obj:
-            cache_obj = getattr(pylons, 'cache', None)
-        if not cache_obj:
-            raise Exception('No CacheMiddleware or cache object on '
-                            ' app_globals was found')
-
+        cache_obj = _get_cache_manager(pylons)
         my_cache = cache_obj.get_cache(namespace, **b_kwargs)
 
         if expire == "never":
@@ -104,9 +145,23 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         else:
             cache_expire = expire
 
+        # The tags of the value created by this call
+        created_tags = []
         def create_func():
             log.debug("Creating new cache copy with key: %s, type: %s",
                       cache_key, type)
+            if tags:
+                # Tagged before the value is made, so invalidating the
+                # tags from then on removes it
+                if callable(tags):
+                    tag_list = tags(*args, **kwargs)
+                elif isinstance(tags, basestring):
+                    tag_list = [tags % args_dict]
+                else:
+                    tag_list = [tag % args_dict for tag in tags]
+                _tag_value(cache_obj, b_kwargs, tag_list, namespace,
+                           cache_key)
+                created_tags.extend(tag_list)
             result = func(*args, **kwargs)
             glob_response = pylons.response
             headers = glob_response.headerlist
@@ -118,6 +173,13 @@ def beaker_cache(key="cache_default", expire="never", type=None,
         response = my_cache.get_value(cache_key, createfunc=create_func,
                                       expiretime=cache_expire,
                                       starttime=starttime)
+        if created_tags and not _is_tagged(cache_obj, b_kwargs, created_tags,
+                                           namespace, cache_key):
+            # The tags were invalidated before the value was stored,
+            # which removed nothing
+            log.debug("Tags %r invalidated while creating %s, removing it",
+                      created_tags, cache_key)
+            my_cache.remove_value(cache_key)
         if cache_response:
             glob_response = pylons.response
             glob_response.headerlist = [header for header in response['headers']
@@ -125,10 +187,242 @@ def beaker_cache(key="cache_default", expire="never", type=None,
             glob_response.status = response['status']
 
         return response['content']
+
+    # The argument names of each decorated function, looked up once
+    arg_names = {}
+    def decorate(func):
+        arg_names[func] = _arg_names(func)
+        return decorator(wrapper, func)
+    return decorate
+
+
+def cache_control(**policy):
+    """Set the HTTP caching policy of an action
+
+    Takes the arguments of
+    :class:`~pylons.controllers.util.CachePolicy`. The policy replaces
+    the default ``Cache-Control: no-cache`` and ``Pragma: no-cache``
+    headers once the action has returned, so it also applies to
+    responses served by :func:`beaker_cache` and to the ``304 Not
+    Modified`` raised by :func:`~pylons.controllers.util.etag_cache`
+    or :func:`conditional`, whatever order the decorators are in.
+
+    Example::
+
+        class PagesController(BaseController):
+            @cache_control(public=True, max_age=60, s_maxage=600,
+                           stale_while_revalidate=30,
+                           vary='Accept-Language')
+            @beaker_cache(expire=600)
+            def about(self):
+                return render('/about.mako')
+
+    The decorator doesn't wrap the action, it only marks it, so it
+    costs nothing when the action is called. A ``cache_policy`` in the
+    route takes precedence over it.
+
+    """
+    policy = CachePolicy(**policy)
+    def decorate(func):
+        func._cache_policy = policy
+        return func
+    return decorate
+
+
+def conditional(etag=None, last_modified=None):
+    """Answer conditional GET requests with ``304 Not Modified`` without
+    running the action, when a cheap validator shows the page hasn't
+    changed
+
+    ``etag``
+        Function returning the entity tag of the page, e.g. a version
+        number or the hash of the rows it shows, or None when it can't
+        tell.
+    ``last_modified``
+        Function returning when the page last changed, as a
+        :class:`~datetime.datetime` (in UTC) or a timestamp, or None.
+
+    The validators are called with the same arguments as the action.
+    Their values are sent as the ETag and Last-Modified headers, and
+    checked against the request's "If-None-Match" and
+    "If-Modified-Since" headers by
+    :func:`~pylons.controllers.util.etag_cache`, which raises the 304
+    when they match. Otherwise the action runs as usual.
+
+    Example::
+
+        def article_version(self, id):
+            return model.Article.version_of(id)
+
+        class ArticleController(BaseController):
+            @conditional(etag=article_version)
+            def view(self, id):
+                c.article = model.Article.get(id)
+                return render('/article.mako')
+
+    Requests other than GET and HEAD always run the action.
+
+    """
+    def wrapper(func, *args, **kwargs):
+        """Decorator wrapper"""
+        pylons = get_pylons(args)
+        if pylons.request.method in ('GET', 'HEAD'):
+            key = modified = None
+            if etag is not None:
+                key = etag(*args, **kwargs)
+            if last_modified is not None:
+                modified = last_modified(*args, **kwargs)
+            if key is not None or modified is not None:
+                etag_cache(key, modified)
+        return func(*args, **kwargs)
     return decorator(wrapper)
 
 
-def create_cache_key(func, key_dict=None, self=None):
+def invalidate_tags(tags, type=None, cache=None, **b_kwargs):
+    """Remove every value cached by :func:`beaker_cache` with any of
+    ``tags``
+
+    ``tags``
+        A tag or list of tags.
+    ``type``
+        Type of cache the values were cached with. Tags are indexed per
+        cache type (and the other Beaker options), so this, and any
+        other options, must match the ``beaker_cache`` arguments.
+    ``cache``
+        Beaker CacheManager to use, by default the one on
+        ``app_globals``, or ``pylons.cache``.
+
+    Only the values with the tags are looked at, through an index kept
+    in the cache (in a memory cache for the ``lru`` type, which would
+    evict it), so the cost depends on the number of values removed
+    rather than on the size of the cache. Invalidating a tag drops its
+    index entry, see :func:`prune_tags` for tags that seldom are.
+
+    Example::
+
+        @beaker_cache(tags=['products', 'product-%(id)s'])
+        def view(self, id):
+            ...
+
+        invalidate_tags('product-%s' % product.id)
+
+    """
+    if isinstance(tags, basestring):
+        tags = [tags]
+    if type:
+        b_kwargs['type'] = type
+    if cache is None:
+        cache = _get_cache_manager(pylons)
+    tagged = {}
+    for tag in tags:
+        index, lock, tag = _tag_index(cache, b_kwargs, tag)
+        lock.acquire()
+        try:
+            index.acquire_write_lock()
+            try:
+                if tag in index:
+                    for namespace, keys in index[tag].iteritems():
+                        tagged.setdefault(namespace, set()).update(keys)
+                    del index[tag]
+            finally:
+                index.release_write_lock()
+        finally:
+            lock.release()
+
+    removed = 0
+    for namespace, keys in tagged.iteritems():
+        manager = cache.get_cache(namespace, **b_kwargs).namespace
+        manager.acquire_write_lock()
+        try:
+            for key in keys:
+                if key in manager:
+                    del manager[key]
+                    removed += 1
+        finally:
+            manager.release_write_lock()
+    log.debug("Invalidated tags %r, removing %d cached values", tags,
+              removed)
+    return removed
+
+
+def prune_tags(tags, type=None, cache=None, **b_kwargs):
+    """Drop the keys of the values that are gone (expired, evicted or
+    removed) from the index of ``tags``, returning how many were dropped
+
+    The arguments are those of :func:`invalidate_tags`. The index of a
+    tag only shrinks when the tag is invalidated, so the index of one
+    that is seldom invalidated, while the values it tags come and go,
+    keeps growing. This is meant to be run now and then for those, from
+    a cron job or a ``paster shell``, rather than on every request.
+    Only the keys of ``tags`` are looked up.
+
+    """
+    if isinstance(tags, basestring):
+        tags = [tags]
+    if type:
+        b_kwargs['type'] = type
+    if cache is None:
+        cache = _get_cache_manager(pylons)
+    pruned = 0
+    for tag in tags:
+        index, lock, tag = _tag_index(cache, b_kwargs, tag)
+        lock.acquire()
+        try:
+            index.acquire_write_lock()
+            try:
+                if tag not in index:
+                    continue
+                tagged = index[tag]
+                for namespace, keys in tagged.items():
+                    alive = _stored_keys(cache.get_cache(
+                            namespace, **b_kwargs).namespace, keys)
+                    pruned += len(keys) - len(alive)
+                    if alive:
+                        tagged[namespace] = alive
+                    else:
+                        del tagged[namespace]
+                if tagged:
+                    index[tag] = tagged
+                else:
+                    del index[tag]
+            finally:
+                index.release_write_lock()
+        finally:
+            lock.release()
+    log.debug("Pruned %d keys from the index of tags %r", pruned, tags)
+    return pruned
+
+
+def invalidate_namespace(namespace, type=None, version=None, cache=None,
+                         **b_kwargs):
+    """Remove every value cached in ``namespace``
+
+    ``namespace``
+        The namespace, or a function or method decorated with
+        :func:`beaker_cache`, whose namespace (its class, or module)
+        is cleared.
+    ``type``, ``version``
+        The ``beaker_cache`` arguments the values were cached with.
+    ``cache``
+        Beaker CacheManager to use, by default the one on
+        ``app_globals``, or ``pylons.cache``.
+
+    The memory, lru, file and dbm backends keep each namespace
+    separately, so this doesn't go through the rest of the cache.
+
+    """
+    if not isinstance(namespace, basestring):
+        namespace = create_cache_key(namespace, version=version)[0]
+    elif version is not None:
+        namespace = '%s@%s' % (namespace, version)
+    if type:
+        b_kwargs['type'] = type
+    if cache is None:
+        cache = _get_cache_manager(pylons)
+    cache.get_cache(namespace, **b_kwargs).clear()
+
+
+def create_cache_key(func, key_dict=None, self=None, version=None):
     """Get a cache namespace and key used by the beaker_cache decorator.
 
     Example::
@@ -142,26 +436,157 @@ def create_cache_key(func, key_dict=None, self=None):
     if hasattr(func, 'im_func'):
         kls = func.im_class
         func = func.im_func
-        cache_key = func.__name__
-    else:
-        cache_key = func.__name__
-    if key_dict:
-        cache_key += " " + " ".join("%s=%s" % (k, v)
-                                    for k, v in key_dict.iteritems())
 
     if not kls and self:
         kls = getattr(self, '__class__', None)
 
     if kls:
-        return '%s.%s' % (kls.__module__, kls.__name__), cache_key
+        namespace = '%s.%s' % (kls.__module__, kls.__name__)
+    else:
+        namespace = func.__module__
+    if version is not None:
+        namespace = '%s@%s' % (namespace, version)
+    return namespace, make_cache_key(func.__name__, key_dict, namespace)
+
+
+def make_cache_key(name, key_dict=None, namespace='',
+                   max_length=MAX_KEY_LENGTH):
+    """Build a canonical cache key
+
+    The key is ``name`` followed by the sorted ``key=value`` pairs of
+    ``key_dict``, so equal dicts always give the same key. When the
+    key would make the namespace and key together longer than
+    ``max_length``, or it contains characters other than printable
+    ASCII, the pairs are replaced by their SHA-1 digest.
+
+    Used by :func:`beaker_cache` and
+    :func:`~pylons.templating.cached_template`.
+
+    """
+    name = _key_value(name)
+    if key_dict:
+        cache_key = ' '.join([name] + [
+                '%s=%s' % (_key_value(k), _key_value(v))
+                for k, v in sorted(key_dict.iteritems())])
     else:
-        return func.__module__, cache_key
+        cache_key = name
+    if len(namespace) + len(cache_key) + 1 > max_length or \
+            _unsafe_key.search(cache_key):
+        digest = sha1(cache_key).hexdigest()
+        cache_key = '%s #%s' % (name, digest)
+        if len(namespace) + len(cache_key) + 1 > max_length or \
+                _unsafe_key.search(cache_key):
+            cache_key = digest
+    return cache_key
+
+
+def _key_value(value):
+    """String of a key value, with dicts in a canonical order"""
+    if isinstance(value, dict):
+        return '{%s}' % ', '.join('%s: %s' % (_key_value(k), _key_value(v))
+                                  for k, v in sorted(value.iteritems()))
+    if isinstance(value, (list, tuple)):
+        return '[%s]' % ', '.join(_key_value(v) for v in value)
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return str(value)
+
+
+def _arg_names(func):
+    """Names of the positional arguments of ``func``"""
+    return inspect.getargspec(func)[0]
 
 
-def _make_dict_from_args(func, args):
+def _make_dict_from_args(func, args, arg_names=None):
     """Inspects function for name of args"""
-    args_keys = {}
-    for i, arg in enumerate(inspect.getargspec(func)[0]):
-        if arg != "self":
-            args_keys[arg] = args[i]
-    return args_keys
+    if arg_names is None:
+        arg_names = _arg_names(func)
+    return dict((arg, value) for arg, value in zip(arg_names, args)
+                if arg != "self")
+
+
+def _get_cache_manager(pylons):
+    cache_obj = getattr(pylons.app_globals, 'cache', None)
+    if not cache_obj:
+        cache_obj = getattr(pylons, 'cache', None)
+    if not cache_obj:
+        raise Exception('No CacheMiddleware or cache object on '
+                        ' app_globals was found')
+    return cache_obj
+
+
+def _tag_index(cache, b_kwargs, tag):
+    """Return the namespace manager of the tag index bucket of ``tag``
+    for the values cached with the Beaker options ``b_kwargs``, its
+    lock, and the key of ``tag`` in it
+
+    The index of values kept in an LRU store is kept in a memory cache
+    of its own, as the store would evict it along with the values.
+
+    """
+    tag = _key_value(tag)
+    bucket = int(sha1(tag).hexdigest()[:8], 16) % TAG_BUCKETS
+    cache_type = b_kwargs.get('type') or \
+        getattr(cache, 'kwargs', {}).get('type')
+    if cache_type != 'lru':
+        index = cache.get_cache('%s.%d' % (TAG_NAMESPACE, bucket),
+                                **b_kwargs).namespace
+    else:
+        kwargs = dict(b_kwargs, type='memory')
+        store = kwargs.get('lru_store') or \
+            getattr(cache, 'kwargs', {}).get('lru_store', 'default')
+        index = cache.get_cache('%s.lru.%s.%d' % (TAG_NAMESPACE, store,
+                                                  bucket), **kwargs).namespace
+    return index, _tag_locks[bucket], tag
+
+
+def _tag_value(cache, b_kwargs, tags, namespace, key):
+    """Record the ``key`` of ``namespace`` under each of ``tags`` in the
+    tag index"""
+    for tag in tags:
+        index, lock, tag = _tag_index(cache, b_kwargs, tag)
+        lock.acquire()
+        try:
+            index.acquire_write_lock()
+            try:
+                if tag in index:
+                    tagged = index[tag]
+                else:
+                    tagged = {}
+                keys = tagged.setdefault(namespace, set())
+                if key not in keys:
+                    keys.add(key)
+                    index[tag] = tagged
+            finally:
+                index.release_write_lock()
+        finally:
+            lock.release()
+
+
+def _is_tagged(cache, b_kwargs, tags, namespace, key):
+    """Whether the ``key`` of ``namespace`` is still recorded under each
+    of ``tags`` in the tag index"""
+    for tag in tags:
+        index, lock, tag = _tag_index(cache, b_kwargs, tag)
+        lock.acquire()
+        try:
+            index.acquire_read_lock()
+            try:
+                if tag not in index or \
+                        key not in index[tag].get(namespace, ()):
+                    return False
+            finally:
+                index.release_read_lock()
+        finally:
+            lock.release()
+    return True
+
+
+def _stored_keys(manager, keys):
+    """Return the set of ``keys`` the namespace ``manager`` stores"""
+    # The file and dbm backends only read their keys once opened
+    manager.acquire_read_lock()
+    try:
+        return set(key for key in keys if key in manager)
+    finally:
+        manager.release_read_lock()
@@ -5,15 +5,24 @@ Provides :mod:`gettext` translation functions via an app's
 translated to.
 
 """
+import copy
+import gettext as _gettext
 import os
+import threading
 from gettext import NullTranslations, translation
 
 import pylons
+from pylons.requestlocal import request_local
 
-__all__ = ['_', 'add_fallback', 'get_lang', 'gettext', 'gettext_noop',
-           'lazy_gettext', 'lazy_ngettext', 'lazy_ugettext', 'lazy_ungettext',
-           'ngettext', 'set_lang', 'ugettext', 'ungettext', 'LanguageError',
-           'N_']
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+__all__ = ['_', 'add_fallback', 'clear_translator_cache', 'get_lang',
+           'gettext', 'gettext_noop', 'lazy_gettext', 'lazy_ngettext',
+           'lazy_ugettext', 'lazy_ungettext', 'ngettext', 'set_lang',
+           'ugettext', 'ungettext', 'LanguageError', 'N_']
 
 
 class LanguageError(Exception):
@@ -147,9 +156,134 @@ def ungettext(singular, plural, n):
 lazy_ungettext = lazify(ungettext)
 
 
+class TranslatorCache(object):
+    """Bounded, process-wide cache of gettext translators
+
+    Translators are keyed by the package, locale directory, the message
+    catalogs (``.mo`` files) found for the languages asked for, and any
+    other :func:`gettext.translation` arguments they were created with.
+    The catalogs found for each list of languages are cached too, so
+    set_lang doesn't search the filesystem on every request. Lists of
+    languages come from the clients' Accept-Language headers, but
+    however many different ones are asked for, only the search results
+    are evicted, not the translators of the catalogs the application
+    has. Failed lookups are cached as well.
+
+    ``size`` is the number of entries of each cache, the
+    ``pylons.translator_cache_size`` option replaces it for the
+    translators of an application.
+
+    The cached translators are never handed out directly, as
+    :func:`add_fallback` modifies the translator it's called on;
+    :meth:`get` returns a copy of the translator and its fallback
+    chain instead. Copying shares the (read-only) message catalogs.
+
+    """
+    def __init__(self, size=100):
+        self.size = size
+        self._lock = threading.Lock()
+        self._translators = _lru_dict()
+        self._catalogs = _lru_dict()
+
+    def get(self, key, create, size=None):
+        """Return a copy of the translator cached under ``key``,
+        calling ``create`` to create it if needed"""
+        translator = self._lookup(self._translators, key)
+        if translator is None:
+            try:
+                translator = create()
+            except IOError, ioe:
+                translator = ioe
+            self._store(self._translators, key, translator, size)
+
+        if isinstance(translator, IOError):
+            raise translator
+        return clone_translator(translator)
+
+    def find(self, domain, localedir, languages):
+        """Return the tuple of the catalog files of ``domain`` in
+        ``localedir`` for ``languages``, as :func:`gettext.find` finds
+        them"""
+        key = (domain, localedir, tuple(languages))
+        catalogs = self._lookup(self._catalogs, key)
+        if catalogs is None:
+            catalogs = tuple(_gettext.find(domain, localedir, languages,
+                                           all=True))
+            self._store(self._catalogs, key, catalogs)
+        return catalogs
+
+    def _lookup(self, entries, key):
+        self._lock.acquire()
+        try:
+            value = entries.pop(key, None)
+            if value is not None:
+                # Most recently used goes last
+                entries[key] = value
+            return value
+        finally:
+            self._lock.release()
+
+    def _store(self, entries, key, value, size=None):
+        size = size or self.size
+        self._lock.acquire()
+        try:
+            entries[key] = value
+            while len(entries) > size:
+                if OrderedDict is not None:
+                    entries.popitem(last=False)
+                else:
+                    entries.popitem()
+        finally:
+            self._lock.release()
+
+    def clear(self):
+        """Empty the cache"""
+        self._lock.acquire()
+        try:
+            self._translators.clear()
+            self._catalogs.clear()
+        finally:
+            self._lock.release()
+
+
+def _lru_dict():
+    if OrderedDict is not None:
+        return OrderedDict()
+    return {}
+
+translator_cache = TranslatorCache()
+
+
+def clone_translator(translator):
+    """Return a copy of ``translator`` and its chain of fallbacks that
+    shares their message catalogs"""
+    clone = copy.copy(translator)
+    fallback = getattr(translator, '_fallback', None)
+    if fallback is not None:
+        clone._fallback = clone_translator(fallback)
+    return clone
+
+
+def clear_translator_cache():
+    """Drop all cached translators, so that the message catalogs are
+    read again from the .mo files
+
+    Useful in development after recompiling the catalogs, e.g. from a
+    ``paster shell`` or a debug-only controller action.
+
+    """
+    translator_cache.clear()
+    # gettext keeps its own cache of the parsed .mo files
+    _gettext._translations.clear()
+
+
 def _get_translator(lang, **kwargs):
     """Utility method to get a valid translator object from a language
-    name"""
+    name
+
+    Translators are cached by :data:`translator_cache`.
+
+    """
     if not lang:
         return NullTranslations()
     if 'pylons_config' in kwargs:
@@ -159,9 +293,14 @@ def _get_translator(lang, **kwargs):
     localedir = os.path.join(conf['pylons.paths']['root'], 'i18n')
     if not isinstance(lang, list):
         lang = [lang]
+    package = conf['pylons.package']
+    catalogs = translator_cache.find(package, localedir, lang)
+    key = (package, localedir, catalogs, tuple(sorted(kwargs.items())))
+    size = conf.get('pylons.translator_cache_size')
     try:
-        translator = translation(conf['pylons.package'], localedir,
-                                 languages=lang, **kwargs)
+        translator = translator_cache.get(
+            key, lambda: translation(package, localedir, languages=lang,
+                                     **kwargs), size and int(size))
     except IOError, ioe:
         raise LanguageError('IOError: %s' % ioe)
     translator.pylons_lang = lang
@@ -180,7 +319,7 @@ def set_lang(lang, set_environ=True, **kwargs):
         return translator
     environ = pylons.request.environ
     environ['pylons.pylons'].translator = translator
-    if 'paste.registry' in environ:
+    if 'paste.registry' in environ and request_local.registry_safe:
         environ['paste.registry'].replace(pylons.translator, translator)
 
 
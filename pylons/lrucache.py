@@ -0,0 +1,343 @@
+"""Memory bounded, in-process LRU cache backend for Beaker
+
+Importing this module registers the ``lru`` cache type with Beaker, so
+it can be used with :func:`~pylons.decorators.cache.beaker_cache`::
+
+    @beaker_cache(expire=60, type='lru')
+    def index(self):
+        ...
+
+or for every cache, with ``cache.type = lru`` in the config file.
+
+Unlike the ``memory`` type, all the namespaces share one
+:class:`LRUStore`, bounded by the number of entries and, optionally,
+their size in bytes. When it's full, the least recently used entries
+are evicted. The bounds are set with the ``lru_max_entries`` and
+``lru_max_bytes`` cache options (``cache.lru_max_entries`` in the
+config file), separate stores can be used by giving them a name with
+``lru_store``.
+
+Expired values are kept until they're evicted. When one is requested,
+Beaker regenerates it in a single thread while other threads asking
+for the same key are served the expired value, rather than all of them
+regenerating it at once.
+
+The hit, miss and eviction counts of a store are available from
+:meth:`LRUStore.stats`::
+
+    from pylons.lrucache import get_store
+    get_store().stats()
+
+"""
+import logging
+import sys
+import threading
+import time
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+try:
+    from collections import OrderedDict
+except ImportError:
+    OrderedDict = None
+
+from beaker.container import NamespaceManager
+from beaker.synchronization import NameLock
+
+__all__ = ['LRUNamespaceManager', 'LRUStore', 'get_store']
+
+log = logging.getLogger(__name__)
+
+DEFAULT_MAX_ENTRIES = 10000
+
+# Stores by name
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def _value_size(value, pickled):
+    """Estimate the memory used by ``value``, a Beaker ``(stored time,
+    expire time, value)`` tuple or a value of its own
+
+    Strings are measured by their length. Other values are measured by
+    the length of their pickle when ``pickled``, for stores with a byte
+    limit to enforce, and by their (shallow) ``sys.getsizeof`` otherwise.
+
+    """
+    if isinstance(value, tuple) and len(value) == 3:
+        value = value[2]
+    if isinstance(value, basestring):
+        return len(value)
+    if pickled:
+        try:
+            return len(pickle.dumps(value, pickle.HIGHEST_PROTOCOL))
+        except Exception:
+            pass
+    return sys.getsizeof(value)
+
+
+class LRUStore(object):
+    """Cache entries of every namespace using the store, in least
+    recently used order
+
+    ``max_entries``
+        Maximum number of entries kept.
+    ``max_bytes``
+        Maximum total size of the entries kept, None for no limit.
+        Strings are measured by their length and other values by the
+        length of their pickles, which costs a pickling of every value
+        stored. Values larger than this on their own aren't stored at
+        all.
+
+    """
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        # (namespace, key) -> (value, size), least recently used first
+        if OrderedDict is not None:
+            self._entries = OrderedDict()
+        else:
+            self._entries = {}
+        # namespace -> set of keys, so a namespace can be listed and
+        # cleared without going through the whole store
+        self._namespaces = {}
+        self._lock = threading.Lock()
+        self.bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, namespace, key):
+        """Return the value of ``key``, raising a KeyError if it isn't
+        stored"""
+        self._lock.acquire()
+        try:
+            entry_key = (namespace, key)
+            try:
+                value, size = self._entries.pop(entry_key)
+            except KeyError:
+                self.misses += 1
+                raise
+            self._entries[entry_key] = (value, size)
+            if _expired(value):
+                self.stale_hits += 1
+            else:
+                self.hits += 1
+        finally:
+            self._lock.release()
+        return value
+
+    def contains(self, namespace, key):
+        # get() moves the entry to the end by removing and adding it
+        # again, which mustn't be seen as a missing entry
+        self._lock.acquire()
+        try:
+            return (namespace, key) in self._entries
+        finally:
+            self._lock.release()
+
+    def count_miss(self):
+        """Count a lookup that didn't find its value, for callers that
+        check with :meth:`contains` rather than :meth:`get`"""
+        self._lock.acquire()
+        try:
+            self.misses += 1
+        finally:
+            self._lock.release()
+
+    def set(self, namespace, key, value):
+        """Store ``value``, evicting the least recently used entries to
+        make room for it"""
+        max_bytes = self.max_bytes
+        size = _value_size(value, max_bytes is not None)
+        self._lock.acquire()
+        try:
+            self._remove(namespace, key)
+            if max_bytes is not None and size > max_bytes:
+                log.debug("Not caching %r in %r, its %d bytes are over the "
+                          "limit", key, namespace, size)
+                return
+            self._entries[(namespace, key)] = (value, size)
+            self._namespaces.setdefault(namespace, set()).add(key)
+            self.bytes += size
+            while len(self._entries) > self.max_entries or \
+                    (max_bytes is not None and self.bytes > max_bytes):
+                (old_namespace, old_key), (old_value, old_size) = \
+                    self._popoldest()
+                self._discard(old_namespace, old_key)
+                self.bytes -= old_size
+                self.evictions += 1
+        finally:
+            self._lock.release()
+
+    def _popoldest(self):
+        if OrderedDict is not None:
+            return self._entries.popitem(last=False)
+        return self._entries.popitem()
+
+    def _remove(self, namespace, key):
+        try:
+            value, size = self._entries.pop((namespace, key))
+        except KeyError:
+            return False
+        self._discard(namespace, key)
+        self.bytes -= size
+        return True
+
+    def _discard(self, namespace, key):
+        # Namespaces come and go (keyed by arguments or versions), so
+        # they're dropped once empty
+        keys = self._namespaces[namespace]
+        keys.discard(key)
+        if not keys:
+            del self._namespaces[namespace]
+
+    def remove(self, namespace, key):
+        """Remove ``key``, raising a KeyError if it isn't stored"""
+        self._lock.acquire()
+        try:
+            if not self._remove(namespace, key):
+                raise KeyError(key)
+        finally:
+            self._lock.release()
+
+    def keys(self, namespace):
+        """Return the keys stored for ``namespace``"""
+        self._lock.acquire()
+        try:
+            return list(self._namespaces.get(namespace, ()))
+        finally:
+            self._lock.release()
+
+    def clear(self, namespace=None):
+        """Remove every entry of ``namespace``, or of all namespaces"""
+        self._lock.acquire()
+        try:
+            if namespace is None:
+                self._entries.clear()
+                self._namespaces.clear()
+                self.bytes = 0
+            else:
+                for key in list(self._namespaces.get(namespace, ())):
+                    self._remove(namespace, key)
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """Return a dict of the store's counters and usage
+
+        ``hits``
+            Reads of values that hadn't expired.
+        ``stale_hits``
+            Reads of expired values, either served while another thread
+            regenerated them, or just before being regenerated.
+        ``misses``
+            Lookups of values that weren't stored.
+        ``evictions``
+            Entries removed to make room for others.
+
+        """
+        return dict(hits=self.hits, stale_hits=self.stale_hits,
+                    misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), bytes=self.bytes,
+                    max_entries=self.max_entries, max_bytes=self.max_bytes)
+
+    def reset_stats(self):
+        """Zero the hit, miss and eviction counters"""
+        self._lock.acquire()
+        try:
+            self.hits = self.stale_hits = self.misses = self.evictions = 0
+        finally:
+            self._lock.release()
+
+
+def _expired(value):
+    """Whether a value stored by Beaker (a ``(stored time, expire time,
+    value)`` tuple) has expired"""
+    try:
+        stored, expiretime, value = value
+        if expiretime is not None:
+            return time.time() >= stored + expiretime
+    except (TypeError, ValueError):
+        pass
+    return False
+
+
+def get_store(name='default', max_entries=None, max_bytes=None):
+    """Return the :class:`LRUStore` called ``name``, creating it if
+    needed
+
+    When ``max_entries`` or ``max_bytes`` are given, they replace the
+    store's current bounds.
+
+    """
+    _stores_lock.acquire()
+    try:
+        store = _stores.get(name)
+        if store is None:
+            store = _stores[name] = LRUStore()
+    finally:
+        _stores_lock.release()
+    if max_entries is not None:
+        store.max_entries = int(max_entries)
+    if max_bytes is not None:
+        store.max_bytes = int(max_bytes)
+    return store
+
+
+class LRUNamespaceManager(NamespaceManager):
+    """Beaker NamespaceManager keeping its values in an
+    :class:`LRUStore`"""
+    def __init__(self, namespace, lru_store='default', lru_max_entries=None,
+                 lru_max_bytes=None, **kwargs):
+        NamespaceManager.__init__(self, namespace)
+        self.store = get_store(lru_store, lru_max_entries, lru_max_bytes)
+        # The key each thread last missed
+        self._missed = threading.local()
+
+    def get_creation_lock(self, key):
+        return NameLock(
+            identifier="lrunamespace/funclock/%s/%s" % (self.namespace, key),
+            reentrant=True)
+
+    def __getitem__(self, key):
+        return self.store.get(self.namespace, key)
+
+    def __contains__(self, key):
+        found = self.store.contains(self.namespace, key)
+        # Beaker looks the key up again once it holds the creation
+        # lock, which is the same miss
+        missed = self._missed
+        if found:
+            missed.key = None
+        elif getattr(missed, 'key', None) != key:
+            missed.key = key
+            self.store.count_miss()
+        return found
+    has_key = __contains__
+
+    def __setitem__(self, key, value):
+        self._missed.key = None
+        self.store.set(self.namespace, key, value)
+
+    def __delitem__(self, key):
+        self.store.remove(self.namespace, key)
+
+    def do_remove(self):
+        self.store.clear(self.namespace)
+
+    def keys(self):
+        return self.store.keys(self.namespace)
+
+
+def _register():
+    from beaker import cache
+    # Beaker 1.6+ wraps the backends in a lazily populated mapping
+    clsmap = getattr(cache.clsmap, '_clsmap', cache.clsmap)
+    clsmap.setdefault('lru', LRUNamespaceManager)
+_register()
@@ -1,6 +1,12 @@
 """Pylons' WSGI middlewares"""
 import logging
 import os.path
+import zlib
+from email.utils import mktime_tz, parsedate_tz
+try:
+    from hashlib import sha1
+except ImportError:
+    from sha import sha as sha1
 
 from paste.deploy.converters import asbool
 from paste.urlparser import StaticURLParser
@@ -9,12 +15,16 @@ from weberror.errormiddleware import ErrorMiddleware
 from webhelpers.html import literal
 
 import pylons
-from pylons.controllers.util import Request, Response
+from pylons.controllers.util import Request, Response, not_modified
 from pylons.error import template_error_formatters
-from pylons.util import call_wsgi_application
+from pylons.templating import template_stats
+from pylons.util import call_wsgi_application, tmpl_context_stats
 
-__all__ = ['ErrorHandler', 'error_document_template',
-           'footer_html', 'head_html', 'media_path']
+__all__ = ['CompressionMiddleware', 'ConditionalGetMiddleware',
+           'ErrorHandler',
+           'TemplateStatsMiddleware',
+           'error_document_template', 'footer_html', 'head_html',
+           'media_path']
 
 log = logging.getLogger(__name__)
 
@@ -170,6 +180,400 @@ class StatusCodeRedirect(object):
         return app_iter
 
 
+class CompressionMiddleware(object):
+    """Compresses responses with gzip or deflate, for the clients that
+    accept them
+
+    The encoding is negotiated from the request's "Accept-Encoding"
+    header, gzip being preferred. Only bodies of ``compressible_types``
+    (text, JSON, XML, JavaScript) are compressed, and not when they:
+
+    * are under ``min_size`` bytes, which only requires reading that
+      much of a streamed body to find out
+    * already have a Content-Encoding
+    * have a ``Cache-Control: no-transform`` header
+    * are the response of an action that set
+      ``request.environ['pylons.compress'] = False``
+
+    Bodies the application returns as a list (as the JSON-RPC and
+    XML-RPC controllers do) are compressed in one go and get the
+    compressed Content-Length. Other app_iters are compressed as they're
+    sent, and lose their Content-Length. The compressed data is flushed
+    out after every 8KB of the body, so streaming isn't held up for
+    long.
+
+    Compressible responses get ``Vary: Accept-Encoding``, and the ETag
+    of compressed ones is made weak, as the compressed bytes differ from
+    those it was computed for. :func:`~pylons.controllers.util.etag_cache`
+    and :class:`ConditionalGetMiddleware` use the weak comparison, so
+    the client's "If-None-Match" still matches.
+
+    HEAD responses get the same headers as the GET would, without a
+    Content-Length, the decision to compress going by the response's
+    Content-Length as there's no body to measure.
+
+    New projects add it when the ``pylons.compress`` option is enabled.
+    Add it outside of :class:`StatusCodeRedirect`, which needs the
+    uncompressed body of the original response, and of
+    :class:`ConditionalGetMiddleware`, so the ETag is computed for the
+    uncompressed body.
+
+    """
+    compressible_types = frozenset([
+            'application/javascript', 'application/json',
+            'application/x-javascript', 'application/xml',
+            'image/svg+xml'])
+
+    def __init__(self, app, min_size=512, level=6):
+        self.app = app
+        self.min_size = int(min_size)
+        self.level = int(level)
+
+    def __call__(self, environ, start_response):
+        status, headers, app_iter, exc_info = call_wsgi_application(
+            self.app, environ, catch_exc_info=True)
+        if exc_info is not None or status[:3] in ('204', '206', '304') or \
+                environ.get('pylons.compress') is False or \
+                not self._compressible(headers):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        _add_vary(headers, 'Accept-Encoding')
+        encoding = _accepted_encoding(environ.get('HTTP_ACCEPT_ENCODING'))
+        if encoding is None:
+            start_response(status, headers)
+            return app_iter
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            # There's no body to read, send the headers the GET would
+            # get, going by its Content-Length
+            start_response(status, self._compressed_headers(headers,
+                                                            encoding))
+            return app_iter
+
+        # Read just enough to know whether the body is worth compressing
+        whole = isinstance(app_iter, (list, tuple))
+        chunks = []
+        size = 0
+        iterator = iter(app_iter)
+        if not whole:
+            try:
+                for chunk in iterator:
+                    chunks.append(chunk)
+                    size += len(chunk)
+                    if size >= self.min_size:
+                        break
+                else:
+                    whole = True
+            except:
+                _close(app_iter)
+                raise
+        else:
+            chunks = app_iter
+            size = sum([len(chunk) for chunk in chunks])
+        if whole:
+            _close(app_iter)
+            if size < self.min_size:
+                start_response(status, headers)
+                return chunks
+
+        if encoding == 'gzip':
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+        else:
+            compressor = zlib.compressobj(self.level)
+        new_headers = self._compressed_headers(headers, encoding)
+        if whole:
+            body = compressor.compress(''.join(chunks)) + compressor.flush()
+            new_headers.append(('Content-Length', str(len(body))))
+            start_response(status, new_headers)
+            return [body]
+        start_response(status, new_headers)
+        return _CompressedAppIter(compressor, chunks, iterator, app_iter)
+
+    def _compressed_headers(self, headers, encoding):
+        """Return ``headers`` for the body compressed with
+        ``encoding``"""
+        new_headers = [('Content-Encoding', encoding)]
+        for name, value in headers:
+            lname = name.lower()
+            if lname == 'content-length' or lname == 'content-md5':
+                continue
+            if lname == 'etag' and not value.startswith('W/'):
+                value = 'W/' + value
+            new_headers.append((name, value))
+        return new_headers
+
+    def _compressible(self, headers):
+        compressible = False
+        for name, value in headers:
+            name = name.lower()
+            if name == 'content-type':
+                mimetype = value.split(';', 1)[0].strip().lower()
+                compressible = mimetype.startswith('text/') or \
+                    mimetype in self.compressible_types or \
+                    mimetype.endswith('+xml') or mimetype.endswith('+json')
+            elif name == 'content-encoding':
+                return False
+            elif name == 'cache-control' and 'no-transform' in value.lower():
+                return False
+            elif name == 'content-length':
+                try:
+                    if int(value) < self.min_size:
+                        return False
+                except ValueError:
+                    pass
+        return compressible
+
+
+class _CompressedAppIter(object):
+    """Compresses the chunks already read from an app_iter, then the
+    rest of it
+
+    The compressor is flushed once the first chunks are compressed,
+    then whenever ``flush_size`` bytes have gone in since the last
+    flush, so small chunks are compressed together.
+
+    """
+    flush_size = 8192
+
+    def __init__(self, compressor, chunks, iterator, app_iter):
+        self.compressor = compressor
+        self.chunks = chunks
+        self.iterator = iterator
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        compress = self.compressor.compress
+        flush = self.compressor.flush
+        flush_size = self.flush_size
+        head = [compress(chunk) for chunk in self.chunks]
+        self.chunks = None
+        head.append(flush(zlib.Z_SYNC_FLUSH))
+        yield ''.join(head)
+        pending = 0
+        for chunk in self.iterator:
+            data = compress(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += flush(zlib.Z_SYNC_FLUSH)
+                pending = 0
+            if data:
+                yield data
+        yield flush()
+
+    def close(self):
+        _close(self.app_iter)
+
+
+def _accepted_encoding(accept_encoding):
+    """Return the encoding, ``gzip`` or ``deflate``, to use for an
+    "Accept-Encoding" header, or None"""
+    if not accept_encoding:
+        return None
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, sep, params = item.partition(';')
+        coding = coding.strip().lower()
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding] = quality
+    default = qualities.get('*', 0.0)
+    best = None
+    best_quality = 0.0
+    for coding in ('gzip', 'deflate'):
+        quality = qualities.get(coding, qualities.get('x-' + coding, default))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+def _add_vary(headers, name):
+    """Add ``name`` to the Vary header of the ``headers`` list"""
+    for index, (header, value) in enumerate(headers):
+        if header.lower() == 'vary':
+            values = [item.strip().lower() for item in value.split(',')]
+            if name.lower() not in values and '*' not in values:
+                headers[index] = (header, '%s, %s' % (value, name))
+            return
+    headers.append(('Vary', name))
+
+
+class ConditionalGetMiddleware(object):
+    """Answers conditional GET and HEAD requests with ``304 Not
+    Modified`` when the client already has the page
+
+    Successful responses without an ETag get a strong one, the SHA-1 of
+    their body. The body is hashed as the application produces it, and
+    is held back until it's complete, so a matching "If-None-Match"
+    gets a 304 without any of the body being sent. Bodies over
+    ``max_size`` bytes aren't held back, they're sent as they come
+    without an ETag.
+
+    Responses that already have an ETag or Last-Modified header (e.g.
+    from :func:`~pylons.controllers.util.etag_cache` or the
+    :func:`~pylons.decorators.cache.conditional` decorator) aren't
+    hashed, they get a 304 as soon as their headers match the request,
+    without reading the body at all. Nor are responses with a
+    ``Cache-Control: no-store`` header, or responses to HEAD requests,
+    whose body is empty: a HEAD request only gets a 304 for the
+    validators the application sets itself.
+
+    Add it around the Pylons application in ``config/middleware.py``::
+
+        app = ConditionalGetMiddleware(app)
+
+    The application still runs for every request, see
+    :func:`~pylons.decorators.cache.conditional` to skip the action when
+    a cheaper check can tell the page hasn't changed.
+
+    """
+    # Headers a 304 response keeps, the others describe the body
+    keep_headers = frozenset(['cache-control', 'content-location', 'date',
+                              'etag', 'expires', 'last-modified',
+                              'set-cookie', 'vary'])
+
+    def __init__(self, app, max_size=1024 * 1024):
+        self.app = app
+        self.max_size = int(max_size)
+
+    def __call__(self, environ, start_response):
+        if environ.get('REQUEST_METHOD') not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+        status, headers, app_iter, exc_info = call_wsgi_application(
+            self.app, environ, catch_exc_info=True)
+        if exc_info is not None or not status.startswith('200'):
+            start_response(status, headers, exc_info)
+            return app_iter
+
+        etag = last_modified = None
+        for name, value in headers:
+            name = name.lower()
+            if name == 'etag':
+                etag = value
+            elif name == 'last-modified':
+                last_modified = parsedate_tz(value)
+                if last_modified is not None:
+                    last_modified = mktime_tz(last_modified)
+            elif name == 'cache-control' and 'no-store' in value.lower():
+                start_response(status, headers)
+                return app_iter
+
+        if etag is None and last_modified is None:
+            if environ['REQUEST_METHOD'] == 'HEAD':
+                # The hash of the empty body wouldn't be the GET's ETag
+                start_response(status, headers)
+                return app_iter
+            digest = sha1()
+            body = []
+            size = 0
+            iterator = iter(app_iter)
+            try:
+                for chunk in iterator:
+                    body.append(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                    if size > self.max_size:
+                        log.debug("Response body is over %d bytes, sending "
+                                  "it without an ETag", self.max_size)
+                        start_response(status, headers)
+                        return _ChainedAppIter(body, iterator, app_iter)
+            except:
+                _close(app_iter)
+                raise
+            _close(app_iter)
+            app_iter = body
+            etag = '"%s"' % digest.hexdigest()
+            headers.append(('ETag', etag))
+
+        if not_modified(environ, etag, last_modified):
+            log.debug("Conditional GET matched, returning 304 Not Modified")
+            _close(app_iter)
+            start_response('304 Not Modified',
+                           [(name, value) for name, value in headers
+                            if name.lower() in self.keep_headers])
+            return []
+        start_response(status, headers)
+        return app_iter
+
+
+class _ChainedAppIter(object):
+    """The chunks already read from an app_iter, followed by the rest
+    of it"""
+    def __init__(self, chunks, iterator, app_iter):
+        self.chunks = chunks
+        self.iterator = iterator
+        self.app_iter = app_iter
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            yield chunk
+        for chunk in self.iterator:
+            yield chunk
+
+    def close(self):
+        _close(self.app_iter)
+
+
+def _close(app_iter):
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+
+
+class TemplateStatsMiddleware(object):
+    """Serves the render times of the templates, as added up by
+    :data:`~pylons.templating.template_stats`, as a text table
+
+    The report is served at ``path``, the slowest templates first. The
+    ``order`` query parameter changes the column it's sorted by (see
+    :meth:`~pylons.templating.TemplateStats.report`) and ``limit`` the
+    number of templates listed, e.g.
+    ``/_template_stats?order=max&limit=20``.
+
+    The times are only recorded with the ``pylons.template_profiling``
+    option enabled. With the ``pylons.tmpl_context_stats`` option, the
+    report is followed by the ``tmpl_context`` attributes each template
+    left unused or read without them being set (see
+    :data:`~pylons.util.tmpl_context_stats`). As anyone can read the
+    report, only add this middleware when ``debug`` is enabled.
+
+    """
+    def __init__(self, app, path='/_template_stats'):
+        self.app = app
+        self.path = path
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != self.path:
+            return self.app(environ, start_response)
+        params = Request(environ).GET
+        order = params.get('order', 'total')
+        if order not in template_stats.orders:
+            start_response('400 Bad Request',
+                           [('Content-Type', 'text/plain')])
+            return ['Unknown order %r, use one of: %s' % (
+                    str(order), ', '.join(sorted(template_stats.orders)))]
+        limit = params.get('limit')
+        if limit is not None:
+            try:
+                limit = int(limit)
+            except ValueError:
+                limit = None
+        body = template_stats.format(order, limit)
+        context_report = tmpl_context_stats.format()
+        if context_report:
+            body += '\ntmpl_context attributes\n\n' + context_report
+        if isinstance(body, unicode):
+            body = body.encode('utf-8')
+        start_response('200 OK', [('Content-Type',
+                                   'text/plain; charset=utf-8'),
+                                  ('Content-Length', str(len(body)))])
+        return [body]
+
+
 error_document_template = literal("""\
 <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.0 Strict//EN" "http://www.w3.org/TR/xhtml1/DTD/xhtml1-strict.dtd">
 <html xmlns="http://www.w3.org/1999/xhtml" xml:lang="en" lang="en">
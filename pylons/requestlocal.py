@@ -0,0 +1,304 @@
+"""Request-local storage for the Pylons globals
+
+While :class:`~pylons.wsgiapp.PylonsApp` handles a request, the
+request's :class:`~pylons.util.PylonsContext` is kept on the
+:data:`request_local` stack. The ``pylons.request``,
+``pylons.response``, ``pylons.tmpl_context`` etc. globals are
+:class:`ContextProxy` objects, which read the object they stand for
+straight off that context.
+
+Objects are only looked up through ``paste.registry`` when there's no
+PylonsApp request in progress, or the context doesn't have the
+attribute, so code that pushes its own objects onto the proxies (unit
+tests, WSGIControllers used without a PylonsApp) keeps working. With
+the ``pylons.use_registry`` option disabled, PylonsApp doesn't register
+anything with ``paste.registry`` at all, and the ``RegistryManager``
+middleware is only needed by legacy code that uses the registry
+directly.
+
+Where the context stack is kept is up to the context backend, chosen
+with the ``pylons.context_backend`` option:
+
+``thread``
+    The default, one stack per thread (:class:`ThreadLocalBackend`).
+``greenlet``
+    One stack per greenlet (:class:`GreenletBackend`), for gevent and
+    eventlet workers, with or without monkeypatching.
+``contextvars``
+    A :mod:`contextvars` variable (:class:`ContextVarBackend`).
+
+Any other value is taken as a ``module:Class`` path to a backend class,
+which needs ``push``, ``pop`` and ``current`` methods and a
+``thread_bound`` attribute. With a backend that isn't bound to threads,
+PylonsApp doesn't use ``paste.registry`` at all, as the registry keeps
+its objects per thread.
+
+The backend is process-wide, it's chosen by the first PylonsApp
+created, and creating another one with a different
+``pylons.context_backend`` raises an error.
+
+"""
+import logging
+import threading
+
+import pkg_resources
+from paste.config import DispatchingConfig
+from paste.registry import StackedObjectProxy
+
+__all__ = ['ContextConfig', 'ContextProxy', 'ContextVarBackend',
+           'GreenletBackend', 'RequestLocal', 'ThreadLocalBackend',
+           'backends', 'request_local']
+
+log = logging.getLogger(__name__)
+
+
+class _ThreadStack(threading.local):
+    def __init__(self):
+        self.stack = []
+
+
+class ThreadLocalBackend(object):
+    """Keeps a context stack per thread
+
+    The default backend. Under gevent or eventlet it's only safe when
+    ``threading`` has been monkeypatched to be greenlet-local.
+
+    """
+    # Whether the contexts are kept per OS thread, the same as
+    # paste.registry keeps its objects
+    thread_bound = True
+
+    def __init__(self):
+        self._local = _ThreadStack()
+
+    def push(self, pylons_obj):
+        self._local.stack.append(pylons_obj)
+
+    def pop(self):
+        return self._local.stack.pop()
+
+    def current(self):
+        stack = self._local.stack
+        if stack:
+            return stack[-1]
+        return None
+
+
+class GreenletBackend(object):
+    """Keeps a context stack per greenlet, for gevent and eventlet
+    workers whether or not ``threading`` has been monkeypatched
+
+    The stack is stored on the greenlet itself, so it goes away with
+    it. Greenlets spawned while handling a request don't inherit its
+    context, pass them the :class:`~pylons.util.PylonsContext` instead.
+
+    Requires the ``greenlet`` package.
+
+    """
+    thread_bound = False
+
+    def __init__(self):
+        from greenlet import getcurrent
+        self._getcurrent = getcurrent
+
+    def push(self, pylons_obj):
+        current = self._getcurrent()
+        try:
+            current._pylons_context_stack.append(pylons_obj)
+        except AttributeError:
+            current._pylons_context_stack = [pylons_obj]
+
+    def pop(self):
+        return self._getcurrent()._pylons_context_stack.pop()
+
+    def current(self):
+        stack = getattr(self._getcurrent(), '_pylons_context_stack', None)
+        if stack:
+            return stack[-1]
+        return None
+
+
+class ContextVarBackend(object):
+    """Keeps the context stack in a :mod:`contextvars` variable, for
+    asyncio style servers
+
+    The stack is stored as a tuple, so a copied context (such as the
+    one a new task starts with) can't change the stack of the context
+    it was copied from.
+
+    Requires the ``contextvars`` module (Python 3.7 or later).
+
+    """
+    thread_bound = False
+
+    def __init__(self):
+        import contextvars
+        self._var = contextvars.ContextVar('pylons_context_stack',
+                                           default=())
+
+    def push(self, pylons_obj):
+        self._var.set(self._var.get() + (pylons_obj,))
+
+    def pop(self):
+        stack = self._var.get()
+        if not stack:
+            raise IndexError('pop from empty context stack')
+        self._var.set(stack[:-1])
+        return stack[-1]
+
+    def current(self):
+        stack = self._var.get()
+        if stack:
+            return stack[-1]
+        return None
+
+
+# Backends that can be chosen by name with the pylons.context_backend
+# option
+backends = {
+    'thread': ThreadLocalBackend,
+    'greenlet': GreenletBackend,
+    'contextvars': ContextVarBackend,
+}
+
+
+class RequestLocal(object):
+    """Stack of the :class:`~pylons.util.PylonsContext` objects of the
+    requests in progress
+
+    It's a stack, rather than a single object, so an application
+    called from within another one (e.g. through
+    :class:`~pylons.controllers.util.forward`) gets its own context and
+    the outer one is restored afterwards.
+
+    Where the stack is kept, per thread, per greenlet etc., is up to
+    the backend, see :meth:`configure`. ``registry_safe`` is False
+    when the backend doesn't keep the stack per thread, in which case
+    nothing should be registered with ``paste.registry`` during a
+    request.
+
+    """
+    def __init__(self, backend=None):
+        self.set_backend(backend or ThreadLocalBackend())
+
+    def configure(self, backend):
+        """Use ``backend``, the ``pylons.context_backend`` option of an
+        application, to keep the context stack
+
+        The first call chooses the backend, later ones must ask for the
+        same one: the backend is shared by every application in the
+        process, so a ValueError is raised rather than switching it
+        under the applications already created.
+
+        """
+        backend_class = _backend_class(backend)
+        if self.configured is None:
+            self.set_backend(backend)
+            self.configured = backend_class
+        elif backend_class is not self.configured:
+            raise ValueError(
+                'pylons.context_backend is %r, but the %s backend is '
+                'already used by another application in this process' %
+                (backend, self.configured.__name__))
+
+    def set_backend(self, backend):
+        """Use ``backend`` to keep the context stack
+
+        ``backend`` may be a backend object, the name of one of the
+        :data:`backends` or a ``module:Class`` path to a backend class.
+        Nothing is changed when the current backend is already of the
+        class asked for.
+
+        Unlike :meth:`configure`, this replaces whatever backend was
+        configured, and lets the next application choose again. Backends
+        should only be changed while no requests are in progress.
+
+        """
+        self.configured = None
+        if isinstance(backend, basestring):
+            backend_class = _backend_class(backend)
+            if isinstance(getattr(self, 'backend', None), backend_class):
+                return
+            backend = backend_class()
+            log.debug("Using %s context backend", backend_class.__name__)
+        self.backend = backend
+        # paste.registry keeps its objects per thread, so with a backend
+        # that isn't bound to threads, requests in different greenlets
+        # of a thread would see each other's objects
+        self.registry_safe = backend.thread_bound
+        # current() is called on every pylons global access, so skip
+        # the extra method call
+        self.current = backend.current
+
+    def push(self, pylons_obj):
+        """Make ``pylons_obj`` the current context"""
+        self.backend.push(pylons_obj)
+
+    def pop(self, pylons_obj=None):
+        """Remove the current context
+
+        If ``pylons_obj`` is given, it is checked against the popped
+        context and an error is raised if they don't match.
+
+        """
+        try:
+            popped = self.backend.pop()
+        except (AttributeError, IndexError):
+            raise AssertionError('No Pylons context has been pushed')
+        if pylons_obj is not None and popped is not pylons_obj:
+            raise AssertionError(
+                'The context popped (%r) is not the same as the context '
+                'expected (%r)' % (popped, pylons_obj))
+
+    def current(self):
+        """Return the current context, or None if there isn't a
+        request in progress"""
+        return self.backend.current()
+
+
+def _backend_class(backend):
+    """Return the backend class named ``backend``"""
+    if backend in backends:
+        return backends[backend]
+    return pkg_resources.EntryPoint.parse('x=%s' % backend).load(False)
+
+request_local = RequestLocal()
+
+
+class ContextProxy(StackedObjectProxy):
+    """StackedObjectProxy that proxies the ``attr`` attribute of the
+    current request's context
+
+    ``paste.registry`` is only consulted when there's no current
+    context, or it doesn't have the attribute and the context backend
+    is :attr:`~RequestLocal.registry_safe`.
+
+    """
+    def __init__(self, attr, name=None):
+        StackedObjectProxy.__init__(self, name=name or attr)
+        self.__dict__['_context_attr'] = attr
+
+    def _current_obj(self):
+        pylons_obj = request_local.current()
+        if pylons_obj is not None:
+            try:
+                return getattr(pylons_obj, self._context_attr)
+            except AttributeError:
+                if not request_local.registry_safe:
+                    raise TypeError('No object (name: %s) has been set up '
+                                    'for this request' % self.____name__)
+        return StackedObjectProxy._current_obj(self)
+
+
+class ContextConfig(DispatchingConfig):
+    """DispatchingConfig that returns the configuration of the
+    current request's application, when there is one"""
+    def _current_obj(self):
+        pylons_obj = request_local.current()
+        if pylons_obj is not None:
+            try:
+                return pylons_obj.config
+            except AttributeError:
+                pass
+        return DispatchingConfig._current_obj(self)
+    current = current_conf = _current_obj
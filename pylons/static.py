@@ -0,0 +1,396 @@
+"""Static file serving
+
+:class:`StaticFiles` serves the files of a directory (a project's
+``public`` directory) in front of the application, replacing the
+``Cascade([StaticURLParser(...), app])`` that tried the filesystem
+before every request.
+
+The directory is indexed once, when the application is created. Only
+requests for paths under one of its top level files or directories
+(``/css/...``, ``/favicon.ico``) are looked up in the index, and
+nothing else touches the filesystem, so dynamic requests go straight to
+the application. Paths that aren't in the index are passed on to the
+application too.
+
+Files are served with Last-Modified and ETag headers, answering
+conditional requests with ``304 Not Modified``. Small files are kept in
+memory once read, larger ones are sent with the server's
+``wsgi.file_wrapper``, which uses ``sendfile`` where it can. When a
+file has a precompressed ``.gz`` sibling (``site.css.gz`` next to
+``site.css``), it's sent instead to the clients that accept gzip.
+Requests for a single byte range (resuming a download, seeking in a
+video) get just that part of the file, with ``206 Partial Content``.
+
+:func:`static_url` returns a fingerprinted URL for a file, with a hash
+of its content in the file name::
+
+    <link rel="stylesheet" href="${h.url(h.static_url('/css/site.css'))}" />
+
+which gives ``/css/site.0123456789ab.css``. Those URLs are served with
+a far-future ``Cache-Control``, as a new version of the file gets a new
+URL.
+
+With ``rescan``, meant for development, the files requested are
+checked for changes, and the directory is indexed again when a file
+that isn't in the index is requested. Otherwise, files added or changed
+after the application started aren't seen until it's restarted.
+
+"""
+import logging
+import mimetypes
+import os
+import re
+import threading
+from email.utils import formatdate
+try:
+    from hashlib import md5
+except ImportError:
+    from md5 import md5
+
+import pylons
+from pylons.controllers.util import not_modified
+from pylons.middleware import _accepted_encoding
+
+__all__ = ['StaticFiles', 'static_url']
+
+log = logging.getLogger(__name__)
+
+# Path of a fingerprinted URL, e.g. /css/site.0123456789ab.css
+FINGERPRINTED = re.compile(r'^(.+)\.([0-9a-f]{12})(\.[^./]+)?$')
+
+# A single byte range, e.g. bytes=0-499, bytes=500- or bytes=-500
+BYTE_RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+# A year, the longest max-age allowed
+FOREVER = 365 * 24 * 60 * 60
+
+
+class _Entry(object):
+    """A file in the index"""
+    __slots__ = ('filename', 'size', 'mtime', 'content_type',
+                 'last_modified', 'etag', 'gzip', 'body', 'fingerprint')
+
+    def __init__(self, filename, stat, content_type):
+        self.filename = filename
+        self.size = stat.st_size
+        self.mtime = int(stat.st_mtime)
+        self.content_type = content_type
+        self.last_modified = formatdate(self.mtime, usegmt=True)
+        self.etag = '"%x-%x"' % (self.mtime, self.size)
+        # The _Entry of the precompressed sibling
+        self.gzip = None
+        self.body = None
+        self.fingerprint = None
+
+
+class StaticFiles(object):
+    """Serves the files of ``directory``, passing other requests on to
+    ``app``
+
+    ``cache_max_age``
+        Seconds browsers may cache files for, when they're requested
+        without a fingerprint. None sends no Cache-Control header.
+    ``memory_size``
+        Files up to this many bytes are kept in memory once read.
+    ``block_size``
+        Size of the blocks larger files are read in.
+    ``rescan``
+        Check files for changes on every request, for development.
+
+    Requests for a fingerprinted URL (see :meth:`url`) are cached for a
+    year, as long as the fingerprint is the file's current one.
+
+    """
+    def __init__(self, app, directory, cache_max_age=3600,
+                 memory_size=64 * 1024, block_size=64 * 1024, rescan=False):
+        self.app = app
+        self.directory = os.path.abspath(directory)
+        self.cache_max_age = cache_max_age
+        self.memory_size = memory_size
+        self.block_size = block_size
+        self.rescan = rescan
+        self._lock = threading.Lock()
+        self.index()
+
+    def index(self):
+        """(Re)build the index of the directory"""
+        files = {}
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            # Skip hidden files and directories (.svn, .DS_Store etc.)
+            dirnames[:] = [name for name in dirnames
+                           if not name.startswith('.')]
+            for name in filenames:
+                if name.startswith('.'):
+                    continue
+                filename = os.path.join(dirpath, name)
+                try:
+                    entry = self._entry(filename)
+                except OSError:
+                    continue
+                path = filename[len(self.directory):]
+                if os.sep != '/':
+                    path = path.replace(os.sep, '/')
+                files[path] = entry
+        for path, entry in files.iteritems():
+            if path.endswith('.gz') and path[:-3] in files:
+                files[path[:-3]].gzip = entry
+        self.files = files
+        # The first segment of every path
+        self.prefixes = frozenset(path.split('/', 2)[1] for path in files)
+        log.debug("Indexed %d static files in %s", len(files),
+                  self.directory)
+
+    def _entry(self, filename):
+        content_type, encoding = mimetypes.guess_type(filename)
+        if encoding == 'gzip':
+            content_type = 'application/x-gzip'
+        elif encoding is not None or content_type is None:
+            content_type = 'application/octet-stream'
+        return _Entry(filename, os.stat(filename), content_type)
+
+    def url(self, path):
+        """Return the fingerprinted URL of the file at ``path``, or
+        ``path`` itself if it isn't a file in the directory"""
+        entry = self.files.get(path)
+        if entry is None:
+            return path
+        fingerprint = self._fingerprint(entry)
+        root, ext = os.path.splitext(path)
+        return '%s.%s%s' % (root, fingerprint, ext)
+
+    def _fingerprint(self, entry):
+        fingerprint = entry.fingerprint
+        if fingerprint is None:
+            digest = md5()
+            f = open(entry.filename, 'rb')
+            try:
+                while True:
+                    block = f.read(self.block_size)
+                    if not block:
+                        break
+                    digest.update(block)
+            finally:
+                f.close()
+            fingerprint = entry.fingerprint = digest.hexdigest()[:12]
+        return fingerprint
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO', '')
+        if not self.rescan and not self._indexed(path):
+            return self.app(environ, start_response)
+        if environ['REQUEST_METHOD'] not in ('GET', 'HEAD'):
+            return self.app(environ, start_response)
+
+        entry = self._lookup(path)
+        immutable = False
+        if entry is None:
+            match = FINGERPRINTED.match(path)
+            if match is not None:
+                entry = self._lookup(match.group(1) + (match.group(3) or ''))
+                immutable = entry is not None and \
+                    self._fingerprint(entry) == match.group(2)
+        if entry is None:
+            return self.app(environ, start_response)
+        return self.serve(entry, environ, start_response, immutable)
+
+    def _indexed(self, path):
+        """Whether ``path`` is under one of the top level files or
+        directories, once stripped of its fingerprint when it's a top
+        level file's (``/favicon.0123456789ab.ico``)"""
+        prefix = path[1:].split('/', 1)[0]
+        if prefix in self.prefixes:
+            return True
+        if '.' not in prefix or len(prefix) + 1 != len(path):
+            return False
+        match = FINGERPRINTED.match(prefix)
+        return match is not None and \
+            match.group(1) + (match.group(3) or '') in self.prefixes
+
+    def _lookup(self, path):
+        entry = self.files.get(path)
+        if not self.rescan:
+            return entry
+        if entry is None:
+            filename = os.path.normpath(os.path.join(self.directory,
+                                                     path.lstrip('/')))
+            if not filename.startswith(self.directory + os.sep) or \
+                    not os.path.isfile(filename):
+                return None
+            # Added since the index was built
+            self._lock.acquire()
+            try:
+                self.index()
+            finally:
+                self._lock.release()
+            return self.files.get(path)
+        try:
+            stat = os.stat(entry.filename)
+        except OSError:
+            return None
+        if stat.st_size != entry.size or int(stat.st_mtime) != entry.mtime:
+            entry = self.files[path] = self._entry(entry.filename)
+        if path + '.gz' in self.files:
+            entry.gzip = self._lookup(path + '.gz')
+        return entry
+
+    def serve(self, entry, environ, start_response, immutable=False):
+        """Send the file of ``entry``"""
+        headers = [('Content-Type', entry.content_type)]
+        if entry.gzip is not None:
+            headers.append(('Vary', 'Accept-Encoding'))
+            if _accepted_encoding(
+                    environ.get('HTTP_ACCEPT_ENCODING')) == 'gzip':
+                entry = entry.gzip
+                headers.append(('Content-Encoding', 'gzip'))
+        if immutable:
+            headers.append(('Cache-Control',
+                            'public, max-age=%d, immutable' % FOREVER))
+        elif self.cache_max_age is not None:
+            headers.append(('Cache-Control',
+                            'max-age=%d' % self.cache_max_age))
+        headers.append(('Last-Modified', entry.last_modified))
+        headers.append(('ETag', entry.etag))
+
+        if not_modified(environ, entry.etag, entry.mtime):
+            start_response('304 Not Modified',
+                           [header for header in headers
+                            if not header[0].startswith('Content-')])
+            return []
+        headers.append(('Accept-Ranges', 'bytes'))
+        byte_range = self._range(entry, environ)
+        if byte_range is not None:
+            return self.serve_range(entry, environ, start_response, headers,
+                                    byte_range)
+        headers.append(('Content-Length', str(entry.size)))
+        start_response('200 OK', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+
+        if entry.size <= self.memory_size:
+            return [self._body(entry)]
+        f = open(entry.filename, 'rb')
+        file_wrapper = environ.get('wsgi.file_wrapper')
+        if file_wrapper is not None:
+            return file_wrapper(f, self.block_size)
+        return _FileIter(f, self.block_size)
+
+    def serve_range(self, entry, environ, start_response, headers,
+                    byte_range):
+        """Send the ``(start, end)`` ``byte_range`` of the file of
+        ``entry``, ``end`` included, or ``416 Requested Range Not
+        Satisfiable`` when ``byte_range`` is False"""
+        if byte_range is False:
+            headers = [header for header in headers
+                       if not header[0].startswith('Content-')]
+            headers.append(('Content-Range', 'bytes */%d' % entry.size))
+            headers.append(('Content-Length', '0'))
+            start_response('416 Requested Range Not Satisfiable', headers)
+            return []
+        start, end = byte_range
+        length = end - start + 1
+        headers.append(('Content-Range',
+                        'bytes %d-%d/%d' % (start, end, entry.size)))
+        headers.append(('Content-Length', str(length)))
+        start_response('206 Partial Content', headers)
+        if environ['REQUEST_METHOD'] == 'HEAD':
+            return []
+
+        if entry.size <= self.memory_size:
+            return [self._body(entry)[start:end + 1]]
+        f = open(entry.filename, 'rb')
+        f.seek(start)
+        return _FileIter(f, self.block_size, length)
+
+    def _range(self, entry, environ):
+        """Return the ``(start, end)`` byte range requested for
+        ``entry``, False if it's not satisfiable, or None to send the
+        whole file
+
+        Only single ranges are supported, requests for several get the
+        whole file, as do those with an "If-Range" the file doesn't
+        match.
+
+        """
+        header = environ.get('HTTP_RANGE')
+        if not header:
+            return None
+        match = BYTE_RANGE.match(header.strip())
+        if match is None:
+            return None
+        if_range = environ.get('HTTP_IF_RANGE')
+        if if_range and if_range not in (entry.etag, entry.last_modified):
+            return None
+        first, last = match.groups()
+        size = entry.size
+        if not first:
+            if not last:
+                return None
+            # The last bytes of the file
+            if int(last) == 0 or size == 0:
+                return False
+            return max(size - int(last), 0), size - 1
+        start = int(first)
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            return False
+        if last:
+            return start, min(int(last), size - 1)
+        return start, size - 1
+
+    def _body(self, entry):
+        body = entry.body
+        if body is None:
+            f = open(entry.filename, 'rb')
+            try:
+                body = entry.body = f.read()
+            finally:
+                f.close()
+        return body
+
+
+class _FileIter(object):
+    """Reads a file in blocks, when the server has no
+    ``wsgi.file_wrapper``, or a byte range of it
+
+    ``length``
+        Bytes to read from the current position, None for the rest of
+        the file.
+
+    """
+    def __init__(self, f, block_size, length=None):
+        self.f = f
+        self.block_size = block_size
+        self.length = length
+
+    def __iter__(self):
+        read = self.f.read
+        block_size = self.block_size
+        remaining = self.length
+        while remaining is None or remaining > 0:
+            if remaining is not None:
+                block_size = min(block_size, remaining)
+            block = read(block_size)
+            if not block:
+                break
+            if remaining is not None:
+                remaining -= len(block)
+            yield block
+
+    def close(self):
+        self.f.close()
+
+
+def static_url(path):
+    """Return the fingerprinted URL of the static file at ``path``, as
+    served by the application's :class:`StaticFiles`
+
+    ``path`` is returned unchanged when there's no StaticFiles in the
+    ``pylons.static`` config option, or the file isn't in its
+    directory.
+
+    """
+    static = pylons.config.get('pylons.static')
+    if static is None:
+        return path
+    return static.url(path)
@@ -100,20 +100,133 @@ template engine, and are used by the render functions.
     functions that :mod:`pylons.templating` comes with. The render_*
     functions look for the template loader to render the template.
 
+Caching fragments
+-----------------
+
+Parts of a page that are expensive to render, such as a sidebar or the
+navigation, can be cached on their own with :func:`cache_fragment`,
+keyed by the values they depend on. A def rendered with
+:func:`render_mako_def` is cached as a fragment when it's given
+``cache_depends``::
+
+    render_mako_def('/layout.mako', 'sidebar', cache_depends=[user.id],
+                    cache_expire=600)
+
+Within a template, the fragment is rendered by a function, here in
+Mako, with ``cache_fragment`` imported into the project's helpers:
+
+.. code-block:: mako
+
+    <%def name="navigation()">...</%def>
+    ${h.cache_fragment('navigation', lambda: capture(navigation),
+                       depends=[c.section], template_file=self.filename)}
+
+or with a Jinja2 macro:
+
+.. code-block:: jinja
+
+    {{ h.cache_fragment('navigation', navigation, depends=[c.section]) }}
+
+Fragments are kept in an in-process memory tier (an
+:class:`~pylons.lrucache.LRUStore`) in front of the Beaker cache, so
+most hits don't reach the cache backend. When a ``template_file`` is
+given, changing the file invalidates its fragments.
+
+Streaming
+---------
+
+Large pages can be sent while they're rendered, rather than built up as
+one string first, by passing ``stream=True`` to :func:`render_mako`,
+:func:`render_genshi` or :func:`render_jinja2`::
+
+    def export(self):
+        c.rows = Session.query(Row)
+        return render('/rows.html', stream=True)
+
+The render function then returns an iterable of chunks of about
+:data:`STREAM_CHUNK_SIZE` characters, encoded with the response's
+charset, which the controller sends as the response's ``app_iter``.
+Jinja2 and Genshi render each chunk as it's sent, with the request's
+pylons globals still available, so an error in the template only shows
+once part of the page has been sent. Mako can't pause a render, so its
+templates are rendered up front, straight into encoded chunks. The
+cache options can't be combined with ``stream``, a cached template is
+returned as a string.
+
+Profiling
+---------
+
+With the ``pylons.template_profiling`` option enabled, every call of a
+render function during a request is timed. Each render is added to
+the ``pylons.template_renders`` list in the request's environ as a dict
+of:
+
+``engine``
+    ``mako``, ``genshi`` or ``jinja2``.
+``template``
+    The template name, followed by ``#`` and the def name for
+    :func:`render_mako_def`.
+``compile``
+    Seconds spent loading (and if needed compiling) the template.
+``render``
+    Seconds spent rendering it.
+``total``
+    Seconds spent in the render function, cache lookups included.
+``size``
+    Characters rendered.
+``cache``
+    ``hit`` or ``miss`` when the render function was given cache
+    options, otherwise None.
+
+``compile``, ``render`` and ``size`` are None when the template came
+out of the cache. Streamed renders are recorded once the whole
+response has been sent.
+
+The renders of all requests are also added up by template in
+:data:`template_stats`, which can be printed from ``paster shell``::
+
+    >>> from pylons.templating import template_stats
+    >>> print template_stats.format(limit=10)
+
+or served at a URL with the
+:class:`~pylons.middleware.TemplateStatsMiddleware`, when ``debug`` is
+enabled.
+
+With the ``pylons.tmpl_context_stats`` option, the render functions
+also record which :data:`tmpl_context` attributes each template reads,
+see :data:`~pylons.util.tmpl_context_stats`.
+
 """
+import codecs
 import logging
+import os
+import threading
+import time
 
+from paste.deploy.converters import asbool
 from webhelpers.html import literal
 
 import pylons
+from pylons.controllers.util import EncodedAppIter
+from pylons.decorators.cache import make_cache_key
+from pylons.lrucache import get_store
+from pylons.requestlocal import request_local
+from pylons.util import TrackingContextObj
 
-__all__ = ['render_genshi', 'render_jinja2', 'render_mako']
+__all__ = ['TemplateStats', 'cache_fragment', 'render_genshi',
+           'render_jinja2', 'render_mako', 'template_stats']
 
 PYLONS_VARS = ['c', 'app_globals', 'config', 'h', 'render', 'request',
                'session', 'translator', 'ungettext', '_', 'N_']
 
 log = logging.getLogger(__name__)
 
+# Name of the LRUStore keeping the memory tier of the fragment cache
+FRAGMENT_STORE = 'pylons.templating.fragments'
+
+# Characters rendered per chunk when streaming
+STREAM_CHUNK_SIZE = 8192
+
 
 def pylons_globals():
     """Create and return a dictionary of global Pylons variables
@@ -129,9 +242,69 @@ def pylons_globals():
     If SessionMiddleware is being used, ``session`` will also be
     available in the template namespace.
 
+    During a PylonsApp request, the dictionary is only built the first
+    time it's asked for and kept on the request's
+    :class:`~pylons.util.PylonsContext`, the caller gets a copy.
+
+    """
+    pylons_obj = request_local.current()
+    if pylons_obj is not None:
+        return _context_globals(pylons_obj).copy()
+    return _build_globals(None)
+
+
+def render_namespace(extra_vars=None):
+    """Return the namespace to render a template with
+
+    The :func:`pylons_globals`, updated with ``extra_vars``, whose
+    names take precedence. ``extra_vars`` is left unchanged. Without
+    ``extra_vars``, the dictionary returned may be the one shared by
+    the request's renders, so it should be treated as read only.
+
     """
-    conf = pylons.config._current_obj()
-    c = pylons.tmpl_context._current_obj()
+    pylons_obj = request_local.current()
+    if pylons_obj is not None:
+        globs = _context_globals(pylons_obj)
+    else:
+        globs = _build_globals(None)
+    if extra_vars:
+        globs = globs.copy()
+        globs.update(extra_vars)
+    return globs
+
+
+def _context_globals(pylons_obj):
+    """Return the pylons globals of the request of ``pylons_obj``,
+    building them the first time"""
+    globs = getattr(pylons_obj, '_pylons_globals', None)
+    # The response and translator can be replaced during the request
+    # (HTTP exceptions, set_lang), and the context by tests
+    if globs is None or globs['response'] is not pylons_obj.response or \
+            globs['translator'] is not pylons_obj.translator or \
+            globs['c'] is not pylons_obj.tmpl_context:
+        globs = pylons_obj._pylons_globals = _build_globals(pylons_obj)
+    return globs
+
+
+def _build_globals(pylons_obj):
+    if pylons_obj is not None:
+        # Read everything off the request's context in one go, rather
+        # than resolving each pylons global on its own
+        conf = pylons_obj.config
+        c = pylons_obj.tmpl_context
+        request = pylons_obj.request
+        response = pylons_obj.response
+        translator = pylons_obj.translator
+        url = getattr(pylons_obj, 'url', None)
+        if url is None:
+            url = pylons.url._current_obj()
+    else:
+        conf = pylons.config._current_obj()
+        c = pylons.tmpl_context._current_obj()
+        request = pylons.request._current_obj()
+        response = pylons.response._current_obj()
+        translator = pylons.translator._current_obj()
+        url = pylons.url._current_obj()
     app_globals = conf.get('pylons.app_globals')
     pylons_vars = dict(
         c=c,
@@ -139,10 +312,10 @@ def pylons_globals():
         config=conf,
         app_globals=app_globals,
         h=conf.get('pylons.h'),
-        request=pylons.request._current_obj(),
-        response=pylons.response._current_obj(),
-        url=pylons.url._current_obj(),
-        translator=pylons.translator._current_obj(),
+        request=request,
+        response=response,
+        url=url,
+        translator=translator,
         ungettext=pylons.i18n.ungettext,
         _=pylons.i18n._,
         N_=pylons.i18n.N_
@@ -150,17 +323,21 @@ def pylons_globals():
 
     # If the session was overriden to be None, don't populate the session
     # var
-    econf = pylons.config['pylons.environ_config']
-    if 'beaker.session' in pylons.request.environ or \
-        ('session' in econf and econf['session'] in pylons.request.environ):
-        pylons_vars['session'] = pylons.session._current_obj()
+    if pylons_obj is not None:
+        if hasattr(pylons_obj, 'session'):
+            pylons_vars['session'] = pylons_obj.session
+    else:
+        econf = conf['pylons.environ_config']
+        if 'beaker.session' in request.environ or \
+            ('session' in econf and econf['session'] in request.environ):
+            pylons_vars['session'] = pylons.session._current_obj()
     log.debug("Created render namespace with pylons vars: %s", pylons_vars)
     return pylons_vars
 
 
 def cached_template(template_name, render_func, ns_options=(),
                     cache_key=None, cache_type=None, cache_expire=None,
-                    **kwargs):
+                    cache_version=None, **kwargs):
     """Cache and render a template
 
     Cache a template to the namespace ``template_name``, along with a
@@ -184,7 +361,11 @@ def cached_template(template_name, render_func, ns_options=(),
     Caching options (uses Beaker caching middleware)
 
     ``cache_key``
-        Key to cache this copy of the template under.
+        Key to cache this copy of the template under, either a string
+        or a dict, which is turned into a key by
+        :func:`~pylons.decorators.cache.make_cache_key` in the same way
+        as the arguments of a
+        :func:`~pylons.decorators.cache.beaker_cache` action.
     ``cache_type``
         Valid options are ``dbm``, ``file``, ``memory``, ``database``,
         or ``memcached``.
@@ -192,6 +373,9 @@ def cached_template(template_name, render_func, ns_options=(),
         Time in seconds to cache this template with this ``cache_key``
         for. Or use 'never' to designate that the cache should never
         expire.
+    ``cache_version``
+        Added to the namespace, changing it makes the copies cached
+        under the previous version unreachable.
 
     The minimum key required to trigger caching is
     ``cache_expire='never'`` which will cache the template forever
@@ -204,13 +388,18 @@ def cached_template(template_name, render_func, ns_options=(),
 
         if not cache_type:
             cache_type = 'dbm'
-        if not cache_key:
-            cache_key = 'default'
         if cache_expire == 'never':
             cache_expire = None
         namespace = template_name
         for name in ns_options:
             namespace += str(kwargs.get(name))
+        if cache_version is not None:
+            namespace = '%s@%s' % (namespace, cache_version)
+        if isinstance(cache_key, dict):
+            cache_key = make_cache_key('default', cache_key, namespace)
+        else:
+            cache_key = make_cache_key(cache_key or 'default',
+                                       namespace=namespace)
         cache = pylons.cache.get_cache(namespace, type=cache_type)
         content = cache.get_value(cache_key, createfunc=render_func,
             expiretime=cache_expire)
@@ -219,33 +408,474 @@ def cached_template(template_name, render_func, ns_options=(),
         return render_func()
 
 
+def cache_fragment(name, render_func, depends=None, template_file=None,
+                   expire=None, type=None):
+    """Cache a rendered template fragment
+
+    ``name``
+        Name of the fragment, used as its cache namespace.
+    ``render_func``
+        Called without arguments to render the fragment when there's no
+        cached copy.
+    ``depends``
+        The values the fragment's content depends on, e.g. a list or a
+        dict. A copy is cached for each distinct value.
+    ``template_file``
+        Path of the template the fragment comes from. Copies cached
+        before the file was last modified aren't used.
+    ``expire``
+        Time in seconds to cache the fragment for, or None or 'never'
+        for no expiry.
+    ``type``
+        Beaker cache type behind the memory tier, by default the cache's
+        configured type.
+
+    Copies are first looked up in the memory tier, shared by the
+    process' requests, then in the Beaker cache. The memory tier's
+    limits can be changed with
+    ``pylons.lrucache.get_store(FRAGMENT_STORE, max_entries,
+    max_bytes)``.
+
+    If cache_enabled is set to False in the .ini file, the fragment is
+    always rendered.
+
+    """
+    if not asbool(pylons.config.get('cache_enabled', 'True')):
+        return literal(render_func())
+    key_dict = {}
+    if depends is not None:
+        key_dict['depends'] = depends
+    if template_file:
+        try:
+            key_dict['mtime'] = os.path.getmtime(template_file)
+        except OSError:
+            pass
+    if expire == 'never':
+        expire = None
+    namespace = 'fragment:%s' % name
+    key = make_cache_key(name, key_dict, namespace)
+
+    store = get_store(FRAGMENT_STORE)
+    try:
+        created, expiretime, content = store.get(namespace, key)
+        if expiretime is None or time.time() < created + expiretime:
+            return content
+    except KeyError:
+        pass
+
+    def create():
+        log.debug("Rendering fragment %s, key: %s", name, key)
+        return time.time(), literal(render_func())
+    b_kwargs = {}
+    if type:
+        b_kwargs['type'] = type
+    cache = pylons.cache.get_cache(namespace, **b_kwargs)
+    # The time the copy was created is cached with it, so it doesn't
+    # live longer in the memory tier than in the cache
+    created, content = cache.get_value(key, createfunc=create,
+                                       expiretime=expire)
+    store.set(namespace, key, (created, expire, content))
+    return content
+
+
+def compile_templates(app_globals, directories, extensions=None):
+    """Compile the templates in ``directories`` with each template
+    engine set up on ``app_globals``
+
+    ``app_globals``
+        The application's globals, with the ``mako_lookup``,
+        ``jinja2_env`` and/or ``genshi_loader`` used by the render
+        functions.
+    ``directories``
+        The template directories, usually
+        ``config['pylons.paths']['templates']``.
+    ``extensions``
+        Only compile the files with these extensions, by default every
+        file other than hidden files and Python modules is compiled.
+
+    Mako writes the compiled modules to the lookup's
+    ``module_directory``, and Jinja2 its bytecode to the environment's
+    ``bytecode_cache``, where they're picked up by the application's
+    processes. Genshi has no such cache, its templates are only
+    checked.
+
+    Yields an ``(engine, name, seconds, error)`` tuple for each
+    template, ``error`` being None when it compiled.
+
+    """
+    names = sorted(_template_names(directories, extensions))
+    lookup = getattr(app_globals, 'mako_lookup', None)
+    if lookup is not None:
+        for name in names:
+            yield _compile_template('mako', name, lookup.get_template,
+                                    '/' + name)
+    env = getattr(app_globals, 'jinja2_env', None)
+    if env is not None:
+        for name in names:
+            yield _compile_template('jinja2', name, env.get_template, name)
+    loader = getattr(app_globals, 'genshi_loader', None)
+    if loader is not None:
+        for name in names:
+            yield _compile_template('genshi', name, loader.load, name)
+
+
+def _template_names(directories, extensions):
+    """Paths of the template files, relative to their directory"""
+    if isinstance(directories, basestring):
+        directories = [directories]
+    seen = set()
+    for directory in directories:
+        for dirpath, dirnames, filenames in os.walk(directory):
+            dirnames[:] = [dirname for dirname in dirnames
+                           if not dirname.startswith('.')]
+            for filename in filenames:
+                ext = os.path.splitext(filename)[1]
+                if filename.startswith('.') or filename.endswith('~') or \
+                        ext in ('.py', '.pyc', '.pyo'):
+                    continue
+                if extensions is not None and ext not in extensions:
+                    continue
+                name = os.path.relpath(os.path.join(dirpath, filename),
+                                       directory).replace(os.sep, '/')
+                # Like the engines, the first directory wins
+                if name not in seen:
+                    seen.add(name)
+                    yield name
+
+
+def _compile_template(engine, name, load, *args):
+    start = time.time()
+    try:
+        load(*args)
+    except Exception, e:
+        log.debug("Couldn't compile %s with %s: %s", name, engine, e)
+        return engine, name, time.time() - start, e
+    return engine, name, time.time() - start, None
+
+
+class TemplateStats(object):
+    """Render times of the templates, added up by template, for the
+    renders recorded with ``pylons.template_profiling`` enabled"""
+    # Orders the report can be sorted by, to the figure sorted on
+    orders = {
+        'total': lambda row: row['total'],
+        'average': lambda row: row['average'],
+        'max': lambda row: row['max'],
+        'compile': lambda row: row['compile'],
+        'render': lambda row: row['render'],
+        'renders': lambda row: row['renders'],
+    }
+
+    def __init__(self):
+        # (engine, template) -> counters
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        """Add a render, a dict as kept in the
+        ``pylons.template_renders`` list of the environ"""
+        key = (record['engine'], record['template'])
+        self._lock.acquire()
+        try:
+            counters = self._templates.get(key)
+            if counters is None:
+                counters = self._templates[key] = dict(
+                    renders=0, hits=0, misses=0, compile=0.0, render=0.0,
+                    total=0.0, max=0.0, size=0, sized=0)
+            counters['renders'] += 1
+            if record['cache'] == 'hit':
+                counters['hits'] += 1
+            elif record['cache'] == 'miss':
+                counters['misses'] += 1
+            if record['compile'] is not None:
+                counters['compile'] += record['compile']
+            if record['render'] is not None:
+                counters['render'] += record['render']
+            counters['total'] += record['total']
+            counters['max'] = max(counters['max'], record['total'])
+            if record['size'] is not None:
+                counters['size'] += record['size']
+                counters['sized'] += 1
+        finally:
+            self._lock.release()
+
+    def report(self, order='total', limit=None):
+        """Return a list of dicts of the figures of each template,
+        sorted by ``order``, highest first
+
+        ``order`` is one of ``total`` (the default, the time spent in
+        the template over all its renders), ``average``, ``max``,
+        ``compile``, ``render`` or ``renders``. The times are in
+        seconds, ``size`` is the average number of characters
+        rendered.
+
+        """
+        self._lock.acquire()
+        try:
+            templates = [(key, counters.copy()) for key, counters
+                         in self._templates.iteritems()]
+        finally:
+            self._lock.release()
+        rows = []
+        for (engine, template), counters in templates:
+            sized = counters.pop('sized')
+            if sized:
+                counters['size'] = counters['size'] / sized
+            else:
+                counters['size'] = None
+            counters['average'] = counters['total'] / counters['renders']
+            counters.update(engine=engine, template=template)
+            rows.append(counters)
+        rows.sort(key=self.orders[order], reverse=True)
+        if limit is not None:
+            rows = rows[:limit]
+        return rows
+
+    def format(self, order='total', limit=None):
+        """Return the :meth:`report` as a text table, with the times
+        in milliseconds"""
+        lines = ['%-40s %-6s %7s %9s %8s %8s %9s %9s %5s %6s %8s' % (
+                'template', 'engine', 'renders', 'total', 'average', 'max',
+                'compile', 'render', 'hits', 'misses', 'size')]
+        for row in self.report(order, limit):
+            size = row['size']
+            lines.append(
+                '%-40s %-6s %7d %9.1f %8.2f %8.2f %9.1f %9.1f %5d %6d %8s' % (
+                    row['template'], row['engine'], row['renders'],
+                    row['total'] * 1000, row['average'] * 1000,
+                    row['max'] * 1000, row['compile'] * 1000,
+                    row['render'] * 1000, row['hits'], row['misses'],
+                    size is None and '-' or size))
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Forget every render recorded so far"""
+        self._lock.acquire()
+        try:
+            self._templates.clear()
+        finally:
+            self._lock.release()
+
+template_stats = TemplateStats()
+
+
+class _RenderProfile(object):
+    """Times a call of a render function, when ``renders`` (the list
+    to add it to) is given, and tracks the attributes the template
+    reads off the ``tmpl_context`` when it's a
+    :class:`~pylons.util.TrackingContextObj`"""
+    def __init__(self, renders, tmpl_context, engine, template):
+        self.renders = renders
+        self.tmpl_context = tmpl_context
+        self.record = dict(engine=engine, template=template, compile=None,
+                           render=None, total=None, size=None, cache=None)
+        self.start = self.mark = time.time()
+
+    def compiled(self):
+        """The template has been loaded"""
+        now = time.time()
+        self.record['compile'] = now - self.mark
+        self.mark = now
+        if self.tmpl_context is not None:
+            self.tmpl_context._begin_render(self.record['template'])
+
+    def rendered(self, size):
+        """The template has been rendered into ``size`` characters"""
+        now = time.time()
+        self.record['render'] = now - self.mark
+        self.record['size'] = size
+        self.mark = now
+        if self.tmpl_context is not None:
+            self.tmpl_context._end_render()
+
+    def finish(self, caching=False):
+        """The render function is returning"""
+        record = self.record
+        record['total'] = time.time() - self.start
+        if caching:
+            if record['render'] is None:
+                record['cache'] = 'hit'
+            else:
+                record['cache'] = 'miss'
+        self._add()
+
+    def streamed(self, seconds, size):
+        """The stream returned by the render function has been sent,
+        after ``seconds`` spent rendering ``size`` characters"""
+        record = self.record
+        record['render'] = seconds
+        record['size'] = size
+        record['total'] = self.mark - self.start + seconds
+        if self.tmpl_context is not None:
+            self.tmpl_context._end_render()
+        self._add()
+
+    def _add(self):
+        if self.renders is not None:
+            self.renders.append(self.record)
+            template_stats.add(self.record)
+
+
+class _NullProfile(object):
+    """Stands in for a _RenderProfile when profiling is disabled"""
+    def compiled(self):
+        pass
+
+    def rendered(self, size):
+        pass
+
+    def finish(self, caching=False):
+        pass
+
+    def streamed(self, seconds, size):
+        pass
+
+_null_profile = _NullProfile()
+
+
+def _profile(engine, template_name):
+    """Return the profile to time a render with, a no-op one unless
+    the application has ``pylons.template_profiling`` or
+    ``pylons.tmpl_context_stats`` enabled"""
+    pylons_obj = request_local.current()
+    if pylons_obj is None:
+        return _null_profile
+    renders = None
+    if asbool(pylons_obj.config.get('pylons.template_profiling', False)):
+        renders = pylons_obj.request.environ.setdefault(
+            'pylons.template_renders', [])
+    tmpl_context = getattr(pylons_obj, 'tmpl_context', None)
+    if not isinstance(tmpl_context, TrackingContextObj):
+        if renders is None:
+            return _null_profile
+        tmpl_context = None
+    return _RenderProfile(renders, tmpl_context, engine, template_name)
+
+
+def _caching(cache_key, cache_type, cache_expire):
+    """Whether a render function was given cache options"""
+    return cache_key is not None or cache_type is not None or \
+        cache_expire is not None
+
+
+class _EncodingWriter(object):
+    """Buffer to render a Mako template into, keeping the output
+    encoded, in chunks of about ``size`` characters"""
+    def __init__(self, charset, size=STREAM_CHUNK_SIZE):
+        self.encoder = codecs.getincrementalencoder(charset)()
+        self.size = size
+        self.chunks = []
+        self.written = 0
+        self._pending = []
+        self._length = 0
+
+    def write(self, text):
+        self._pending.append(text)
+        self._length += len(text)
+        if self._length >= self.size:
+            self.flush()
+
+    def flush(self, final=False):
+        chunk = self.encoder.encode(u''.join(self._pending), final)
+        if chunk:
+            self.chunks.append(chunk)
+        self.written += self._length
+        self._pending = []
+        self._length = 0
+
+
+def _render_stream(chunks, response, profile=_null_profile):
+    """Return an app_iter sending the unicode ``chunks`` encoded with
+    ``response``'s charset, in chunks of about
+    :data:`STREAM_CHUNK_SIZE` characters
+
+    ``chunks`` is consumed while the app_iter is sent, after the
+    request's context has been removed, so it's put back around each
+    chunk.
+
+    """
+    pylons_obj = request_local.current()
+    def joined():
+        pending = []
+        length = 0
+        for chunk in chunks:
+            pending.append(chunk)
+            length += len(chunk)
+            if length >= STREAM_CHUNK_SIZE:
+                yield u''.join(pending)
+                pending = []
+                length = 0
+        if pending:
+            yield u''.join(pending)
+    def in_context(chunks):
+        seconds = 0.0
+        size = 0
+        while True:
+            if pylons_obj is not None:
+                request_local.push(pylons_obj)
+            start = time.time()
+            try:
+                try:
+                    chunk = chunks.next()
+                except StopIteration:
+                    profile.streamed(seconds + time.time() - start, size)
+                    return
+            finally:
+                if pylons_obj is not None:
+                    request_local.pop(pylons_obj)
+            seconds += time.time() - start
+            size += len(chunk)
+            yield chunk
+    return EncodedAppIter(in_context(joined()), response.charset)
+
+
 def render_mako(template_name, extra_vars=None, cache_key=None,
-                cache_type=None, cache_expire=None):
+                cache_type=None, cache_expire=None, stream=False):
     """Render a template with Mako
 
     Accepts the cache options ``cache_key``, ``cache_type``, and
-    ``cache_expire``.
+    ``cache_expire``. With ``stream``, the template is rendered into
+    encoded chunks, returned as an iterable to send as the response.
 
     """
+    profile = _profile('mako', template_name)
+    caching = _caching(cache_key, cache_type, cache_expire)
+    if stream and not caching:
+        from mako.runtime import Context
+        globs = render_namespace(extra_vars)
+        template = globs['app_globals'].mako_lookup.get_template(template_name)
+        profile.compiled()
+        charset = globs['response'].charset
+        writer = _EncodingWriter(charset)
+        template.render_context(Context(writer, **globs))
+        writer.flush(True)
+        profile.rendered(writer.written)
+        profile.finish()
+        return EncodedAppIter(writer.chunks, charset)
+
     # Create a render callable for the cache function
     def render_template():
-        # Pull in extra vars if needed
-        globs = extra_vars or {}
-
-        # Second, get the globals
-        globs.update(pylons_globals())
+        # The pylons globals, on top of the extra vars
+        globs = render_namespace(extra_vars)
 
         # Grab a template reference
         template = globs['app_globals'].mako_lookup.get_template(template_name)
+        profile.compiled()
 
-        return literal(template.render_unicode(**globs))
+        content = literal(template.render_unicode(**globs))
+        profile.rendered(len(content))
+        return content
 
-    return cached_template(template_name, render_template, cache_key=cache_key,
-                           cache_type=cache_type, cache_expire=cache_expire)
+    content = cached_template(template_name, render_template,
+                              cache_key=cache_key, cache_type=cache_type,
+                              cache_expire=cache_expire)
+    profile.finish(caching)
+    return content
 
 
 def render_mako_def(template_name, def_name, cache_key=None,
-                    cache_type=None, cache_expire=None, **kwargs):
+                    cache_type=None, cache_expire=None, cache_depends=None,
+                    **kwargs):
     """Render a def block within a Mako template
 
     Takes the template name, and the name of the def within it to call.
@@ -259,76 +889,126 @@ def render_mako_def(template_name, def_name, cache_key=None,
         render_mako_def('layout.mako', 'header', title='Testing')
 
     Also accepts the cache options ``cache_key``, ``cache_type``, and
-    ``cache_expire``.
+    ``cache_expire``. When ``cache_depends`` is given, the def is
+    cached as a fragment by :func:`cache_fragment`, keyed by
+    ``cache_depends``, ``cache_key`` and the def's arguments, and
+    invalidated when the template file changes.
 
     """
+    profile = _profile('mako', '%s#%s' % (template_name, def_name))
+
     # Create a render callable for the cache function
     def render_template():
-        # Pull in extra vars if needed
-        globs = kwargs or {}
-
-        # Second, get the globals
-        globs.update(pylons_globals())
+        # The pylons globals, on top of the extra vars
+        globs = render_namespace(kwargs)
 
         # Grab a template reference
         template = globs['app_globals'].mako_lookup.get_template(
             template_name).get_def(def_name)
+        profile.compiled()
 
-        return literal(template.render_unicode(**globs))
+        content = literal(template.render_unicode(**globs))
+        profile.rendered(len(content))
+        return content
+
+    if cache_depends is not None:
+        template = render_namespace()['app_globals'].mako_lookup.get_template(
+            template_name)
+        depends = dict(depends=cache_depends, args=kwargs)
+        if cache_key is not None:
+            depends['key'] = cache_key
+        content = cache_fragment('%s#%s' % (template_name, def_name),
+                                 render_template, depends=depends,
+                                 template_file=template.filename,
+                                 expire=cache_expire, type=cache_type)
+        profile.finish(True)
+        return content
 
-    return cached_template(template_name, render_template, cache_key=cache_key,
-                           cache_type=cache_type, cache_expire=cache_expire)
+    content = cached_template(template_name, render_template,
+                              cache_key=cache_key, cache_type=cache_type,
+                              cache_expire=cache_expire)
+    profile.finish(_caching(cache_key, cache_type, cache_expire))
+    return content
 
 
 def render_genshi(template_name, extra_vars=None, cache_key=None,
-                  cache_type=None, cache_expire=None, method='xhtml'):
+                  cache_type=None, cache_expire=None, method='xhtml',
+                  stream=False):
     """Render a template with Genshi
 
     Accepts the cache options ``cache_key``, ``cache_type``, and
     ``cache_expire`` in addition to method which are passed to Genshi's
-    render function.
+    render function. With ``stream``, an iterable of encoded chunks is
+    returned, serialized as it's sent as the response.
 
     """
+    profile = _profile('genshi', template_name)
+    caching = _caching(cache_key, cache_type, cache_expire)
+    if stream and not caching:
+        globs = render_namespace(extra_vars)
+        template = globs['app_globals'].genshi_loader.load(template_name)
+        profile.compiled()
+        return _render_stream(
+            template.generate(**globs).serialize(method=method),
+            globs['response'], profile)
+
     # Create a render callable for the cache function
     def render_template():
-        # Pull in extra vars if needed
-        globs = extra_vars or {}
-
-        # Second, get the globals
-        globs.update(pylons_globals())
+        # The pylons globals, on top of the extra vars
+        globs = render_namespace(extra_vars)
 
         # Grab a template reference
         template = globs['app_globals'].genshi_loader.load(template_name)
+        profile.compiled()
 
-        return literal(template.generate(**globs).render(method=method,
-                                                         encoding=None))
+        content = literal(template.generate(**globs).render(method=method,
+                                                            encoding=None))
+        profile.rendered(len(content))
+        return content
 
-    return cached_template(template_name, render_template, cache_key=cache_key,
-                           cache_type=cache_type, cache_expire=cache_expire,
-                           ns_options=('method'), method=method)
+    content = cached_template(template_name, render_template,
+                              cache_key=cache_key, cache_type=cache_type,
+                              cache_expire=cache_expire,
+                              ns_options=('method'), method=method)
+    profile.finish(caching)
+    return content
 
 
 def render_jinja2(template_name, extra_vars=None, cache_key=None,
-                 cache_type=None, cache_expire=None):
+                 cache_type=None, cache_expire=None, stream=False):
     """Render a template with Jinja2
 
     Accepts the cache options ``cache_key``, ``cache_type``, and
-    ``cache_expire``.
+    ``cache_expire``. With ``stream``, an iterable of encoded chunks is
+    returned, rendered as it's sent as the response.
 
     """
+    profile = _profile('jinja2', template_name)
+    caching = _caching(cache_key, cache_type, cache_expire)
+    if stream and not caching:
+        globs = render_namespace(extra_vars)
+        template = \
+            globs['app_globals'].jinja2_env.get_template(template_name)
+        profile.compiled()
+        return _render_stream(template.generate(**globs), globs['response'],
+                              profile)
+
     # Create a render callable for the cache function
     def render_template():
-        # Pull in extra vars if needed
-        globs = extra_vars or {}
-
-        # Second, get the globals
-        globs.update(pylons_globals())
+        # The pylons globals, on top of the extra vars
+        globs = render_namespace(extra_vars)
 
         # Grab a template reference
         template = \
             globs['app_globals'].jinja2_env.get_template(template_name)
+        profile.compiled()
 
-        return literal(template.render(**globs))
+        content = literal(template.render(**globs))
+        profile.rendered(len(content))
+        return content
 
-    return cached_template(template_name, render_template, cache_key=cache_key,
-                           cache_type=cache_type, cache_expire=cache_expire)
+    content = cached_template(template_name, render_template,
+                              cache_key=cache_key, cache_type=cache_type,
+                              cache_expire=cache_expire)
+    profile.finish(caching)
+    return content
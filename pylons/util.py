@@ -8,6 +8,7 @@ layout.
 """
 import logging
 import sys
+import threading
 
 import pkg_resources
 from paste.deploy.converters import asbool
@@ -19,8 +20,10 @@ import pylons
 import pylons.configuration
 import pylons.i18n
 
-__all__ = ['AttribSafeContextObj', 'ContextObj', 'PylonsContext',
-           'class_name_from_module_name', 'call_wsgi_application']
+__all__ = ['AttribSafeContextObj', 'ContextObj', 'ContextStats',
+           'LeanPylonsContext', 'PylonsContext', 'TrackingAttribSafeContextObj',
+           'TrackingContextObj', 'class_name_from_module_name',
+           'call_wsgi_application', 'tmpl_context_stats']
 
 log = logging.getLogger(__name__)
 
@@ -102,36 +105,272 @@ class PylonsContext(object):
     pass
 
 
+class LeanPylonsContext(object):
+    """Pylons context object with a fixed set of attributes
+
+    Used by :class:`~pylons.wsgiapp.PylonsApp` in place of
+    :class:`PylonsContext` when the ``pylons.lean_context`` option is
+    enabled. The attributes are stored in ``__slots__``, so no other
+    attributes may be set on it.
+
+    The ``response`` and ``translator`` objects are only created, by
+    calling the factories passed in, the first time they're accessed.
+
+    """
+    __slots__ = ('config', 'request', 'app_globals', 'h', 'url',
+                 'tmpl_context', 'session', 'cache', '_response',
+                 '_response_factory', '_translator', '_translator_factory',
+                 '_pylons_globals')
+
+    def __init__(self, response_factory, translator_factory):
+        self._response_factory = response_factory
+        self._translator_factory = translator_factory
+
+    def _get_response(self):
+        try:
+            return self._response
+        except AttributeError:
+            response = self._response = self._response_factory()
+            return response
+
+    def _set_response(self, response):
+        self._response = response
+    response = property(_get_response, _set_response)
+
+    def _get_translator(self):
+        try:
+            return self._translator
+        except AttributeError:
+            translator = self._translator = self._translator_factory()
+            return translator
+
+    def _set_translator(self, translator):
+        self._translator = translator
+    translator = property(_get_translator, _set_translator)
+
+    def is_loaded(self, name):
+        """Whether the lazily created ``response`` or ``translator``
+        has been created yet"""
+        return hasattr(self, '_' + name)
+
+
+# Returned by ContextObj._load when there's no lazy value to load
+_missing = object()
+
+
 class ContextObj(object):
     """The :term:`tmpl_context` object, with strict attribute access
-    (raises an Exception when the attribute does not exist)"""
+    (raises an Exception when the attribute does not exist)
+
+    The attributes are kept in the instance's ``__dict__``, which is
+    the quickest lookup Python has for them. Its repr only lists the
+    attributes' names, without formatting their values.
+
+    Attributes can also be given a value that's only computed when
+    it's first read, see :meth:`set_lazy`.
+
+    """
+    def set_lazy(self, name, func, *args, **kwargs):
+        """Set the ``name`` attribute to the value returned by
+        ``func``, called with ``args`` and ``kwargs`` only when the
+        attribute is first read, usually while a template is rendered
+
+        The result is then kept as the attribute's value for the rest
+        of the request, so a value only shown in some cases isn't
+        computed when the template doesn't show it::
+
+            c.set_lazy('related', Session.query(Article).all)
+            c.set_lazy('stats', compute_stats, user, period='month')
+
+        Assigning the attribute a value replaces the lazy one.
+
+        """
+        # Assignments aren't intercepted (a __setattr__ would slow
+        # down all of them), so the value's only kept aside until the
+        # attribute lookup misses
+        self.__dict__.pop(name, None)
+        self.__dict__.setdefault('_lazy_attrs', {})[name] = (func, args,
+                                                              kwargs)
+
+    def __getattr__(self, name):
+        # Only called once the attribute hasn't been found
+        value = self._load(name)
+        if value is _missing:
+            raise AttributeError("'%s' object has no attribute '%s'" % (
+                    self.__class__.__name__, name))
+        return value
+
+    def _load(self, name):
+        """Compute the Lazy value of ``name``, if there's one, and
+        keep the result as the attribute's value"""
+        lazy_attrs = self.__dict__.get('_lazy_attrs')
+        if not lazy_attrs or name not in lazy_attrs:
+            return _missing
+        func, args, kwargs = lazy_attrs.pop(name)
+        try:
+            value = func(*args, **kwargs)
+        except:
+            # Keep it for the next read, which raises the error again
+            # rather than finding no attribute at all
+            lazy_attrs[name] = (func, args, kwargs)
+            raise
+        setattr(self, name, value)
+        return value
+
     def __repr__(self):
-        attrs = sorted((name, value)
-                       for name, value in self.__dict__.iteritems()
-                       if not name.startswith('_'))
-        parts = []
-        for name, value in attrs:
-            value_repr = repr(value)
-            if len(value_repr) > 70:
-                value_repr = value_repr[:60] + '...' + value_repr[-5:]
-            parts.append(' %s=%s' % (name, value_repr))
-        return '<%s.%s at %s%s>' % (
+        names = set(name for name in self.__dict__
+                    if not name.startswith('_'))
+        names.update(self.__dict__.get('_lazy_attrs', ()))
+        return '<%s.%s at %s %s>' % (
             self.__class__.__module__,
             self.__class__.__name__,
             hex(id(self)),
-            ','.join(parts))
+            ', '.join(sorted(names)))
 
 
 class AttribSafeContextObj(ContextObj):
     """The :term:`tmpl_context` object, with lax attribute access (
-    returns '' when the attribute does not exist)"""
+    returns '' when the attribute does not exist)
+
+    Use :class:`TrackingAttribSafeContextObj` (the
+    ``pylons.tmpl_context_stats`` option) to find out which attributes
+    the templates read without them being set.
+
+    """
     def __getattr__(self, name):
+        # Only called once the attribute hasn't been found
+        if '_lazy_attrs' in self.__dict__:
+            value = self._load(name)
+            if value is not _missing:
+                return value
+        return ''
+
+
+class TrackingContextObj(ContextObj):
+    """:class:`ContextObj` that records, for each template rendered,
+    the attributes read and the ones missing, into
+    :data:`tmpl_context_stats`
+
+    Used by :class:`~pylons.wsgiapp.PylonsApp` when the
+    ``pylons.tmpl_context_stats`` option is enabled. Every attribute
+    access goes through Python code, so it's much slower than
+    :class:`ContextObj`, meant for development only.
+
+    """
+    _strict = True
+
+    def __init__(self):
+        # (template, names read, names missing) of each render in
+        # progress, innermost last
+        self._tracked_renders = []
+
+    def __getattribute__(self, name):
+        if name[:1] != '_':
+            renders = object.__getattribute__(self, '_tracked_renders')
+            if renders:
+                renders[-1][1].add(name)
+        return object.__getattribute__(self, name)
+
+    def __getattr__(self, name):
+        value = self._load(name)
+        if value is not _missing:
+            return value
+        if name[:1] != '_':
+            renders = self._tracked_renders
+            if renders:
+                renders[-1][2].add(name)
+        if self._strict:
+            raise AttributeError("'%s' object has no attribute '%s'" % (
+                    self.__class__.__name__, name))
+        return ''
+
+    def _begin_render(self, template):
+        """Attribute the reads to ``template`` until
+        :meth:`_end_render`"""
+        self._tracked_renders.append((template, set(), set()))
+
+    def _end_render(self):
+        template, reads, misses = self._tracked_renders.pop()
+        present = [name for name in self.__dict__ if not name.startswith('_')]
+        # Lazy values the template didn't read are set but unused too
+        present.extend(self.__dict__.get('_lazy_attrs', ()))
+        tmpl_context_stats.add(template, present, reads, misses)
+
+
+class TrackingAttribSafeContextObj(TrackingContextObj):
+    """:class:`TrackingContextObj` with the lax attribute access of
+    :class:`AttribSafeContextObj`"""
+    _strict = False
+
+
+class ContextStats(object):
+    """The :term:`tmpl_context` attributes used by each template,
+    recorded by :class:`TrackingContextObj`"""
+    def __init__(self):
+        # template -> [renders, names set, names read, names missing]
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def add(self, template, present, reads, misses):
+        """Add a render of ``template``, with the ``present``
+        attributes set on the tmpl_context, of which ``reads`` were
+        read, and the ``misses`` read without being set"""
+        self._lock.acquire()
         try:
-            return object.__getattribute__(self, name)
-        except AttributeError:
-            log.debug("No attribute called %s found on c object, returning "
-                      "empty string", name)
-            return ''
+            counters = self._templates.get(template)
+            if counters is None:
+                counters = self._templates[template] = [0, set(), set(),
+                                                        set()]
+            counters[0] += 1
+            counters[1].update(present)
+            counters[2].update(reads)
+            counters[3].update(misses)
+        finally:
+            self._lock.release()
+
+    def report(self):
+        """Return a dict of template name to a dict of:
+
+        ``renders``
+            Number of renders recorded.
+        ``unused``
+            Sorted list of the attributes that were set when the
+            template was rendered, but that it never read.
+        ``missing``
+            Sorted list of the attributes the template read that
+            weren't set (which are typos, or rely on
+            :class:`AttribSafeContextObj` returning '').
+
+        """
+        self._lock.acquire()
+        try:
+            return dict((template, dict(
+                        renders=renders,
+                        unused=sorted(present - reads),
+                        missing=sorted(misses)))
+                        for template, (renders, present, reads, misses)
+                        in self._templates.iteritems())
+        finally:
+            self._lock.release()
+
+    def format(self):
+        """Return the :meth:`report` as text"""
+        lines = []
+        for template, stats in sorted(self.report().iteritems()):
+            lines.append('%s (%d renders)' % (template, stats['renders']))
+            lines.append('    unused:  %s' % ', '.join(stats['unused']))
+            lines.append('    missing: %s' % ', '.join(stats['missing']))
+        return ''.join(line + '\n' for line in lines)
+
+    def clear(self):
+        """Forget every render recorded so far"""
+        self._lock.acquire()
+        try:
+            self._templates.clear()
+        finally:
+            self._lock.release()
+
+tmpl_context_stats = ContextStats()
 
 
 class PylonsTemplate(Template):
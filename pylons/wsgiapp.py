@@ -7,17 +7,26 @@ well.
 
 """
 import logging
+import pkgutil
 import sys
+import time
 
 import paste.registry
 import pkg_resources
+from paste.deploy.converters import asbool
 from webob.exc import HTTPNotFound
 
 import pylons
+import pylons.lrucache # registers the 'lru' Beaker cache type
 import pylons.templating
+from pylons.controllers.core import WSGIController
+from pylons.controllers.dispatch import dispatch_table
 from pylons.controllers.util import Request, Response
 from pylons.i18n.translation import _get_translator
-from pylons.util import (AttribSafeContextObj, ContextObj, PylonsContext,
+from pylons.requestlocal import request_local
+from pylons.util import (AttribSafeContextObj, ContextObj,
+                         LeanPylonsContext, PylonsContext,
+                         TrackingAttribSafeContextObj, TrackingContextObj,
                          class_name_from_module_name)
 
 __all__ = ['PylonsApp']
@@ -25,6 +34,55 @@ __all__ = ['PylonsApp']
 log = logging.getLogger(__name__)
 
 
+class LazyRegistration(object):
+    """Stand-in registered with ``paste.registry`` for a
+    :class:`~pylons.util.LeanPylonsContext` attribute that hasn't been
+    created yet
+
+    The first time it's used the real object is created, and replaces
+    it in the registry so later accesses go straight to the object.
+
+    """
+    __slots__ = ('_pylons_obj', '_name', '_proxy', '_registry')
+
+    def __init__(self, pylons_obj, name, proxy, registry):
+        object.__setattr__(self, '_pylons_obj', pylons_obj)
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_proxy', proxy)
+        object.__setattr__(self, '_registry', registry)
+
+    def _materialize(self):
+        obj = getattr(self._pylons_obj, self._name)
+        try:
+            registered = self._proxy._current_obj()
+        except TypeError:
+            # The request is over, nothing's registered anymore
+            registered = None
+        if registered is self:
+            self._registry.replace(self._proxy, obj)
+        return obj
+
+    def __getattr__(self, attr):
+        return getattr(self._materialize(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._materialize(), attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._materialize(), attr)
+
+    def __call__(self, *args, **kwargs):
+        return self._materialize()(*args, **kwargs)
+
+    def __nonzero__(self):
+        # paste.registry truth tests registered objects when cleaning
+        # up, which mustn't create them
+        return True
+
+    def __repr__(self):
+        return repr(self._materialize())
+
+
 class PylonsApp(object):
     """Pylons WSGI Application
 
@@ -68,6 +126,31 @@ class PylonsApp(object):
         self._session_key = self.environ_config.get('session', 'beaker.session')
         self._cache_key = self.environ_config.get('cache', 'beaker.cache')
 
+        self.use_registry = asbool(config.get('pylons.use_registry', True))
+        request_local.configure(config.get('pylons.context_backend',
+                                           'thread'))
+        self.lean_context = asbool(config.get('pylons.lean_context', False))
+        if self.lean_context:
+            # Build the default response headers once, each request's
+            # Response gets a copy
+            response = Response(
+                content_type=self.response_options['content_type'],
+                charset=self.response_options['charset'])
+            response.headers.update(self.response_options['headers'])
+            self._response_headerlist = response.headerlist
+        if asbool(config.get('pylons.tmpl_context_stats', False)):
+            if config['pylons.strict_tmpl_context']:
+                self._tmpl_context_class = TrackingContextObj
+            else:
+                self._tmpl_context_class = TrackingAttribSafeContextObj
+        elif config['pylons.strict_tmpl_context']:
+            self._tmpl_context_class = ContextObj
+        else:
+            self._tmpl_context_class = AttribSafeContextObj
+
+        if asbool(config.get('pylons.preload_controllers', False)):
+            self.preload_controllers()
+
     def __call__(self, environ, start_response):
         """Setup and handle a web request
 
@@ -92,6 +175,15 @@ class PylonsApp(object):
         environ['pylons.log_debug'] = log_debug
 
         self.setup_app_env(environ, start_response)
+        pylons_obj = environ['pylons.pylons']
+        request_local.push(pylons_obj)
+        try:
+            return self._handle_request(environ, start_response)
+        finally:
+            request_local.pop(pylons_obj)
+
+    def _handle_request(self, environ, start_response):
+        """Resolve and dispatch a request, with its context set up"""
         if 'paste.testing_variables' in environ:
             self.load_test_env(environ)
             if environ['PATH_INFO'] == '/_test_vars':
@@ -133,23 +225,48 @@ class PylonsApp(object):
         pylons_obj = environ['pylons.pylons']
 
         registry = environ['paste.registry']
-        registry.register(pylons.response, pylons_obj.response)
-        registry.register(pylons.request, pylons_obj.request)
-
-        registry.register(pylons.app_globals, self.globals)
-        registry.register(pylons.config, self.config)
-        registry.register(pylons.tmpl_context, pylons_obj.tmpl_context)
-        registry.register(pylons.translator, pylons_obj.translator)
+        if self.lean_context:
+            response = self._registry_object(pylons_obj, 'response',
+                                             pylons.response, registry)
+            translator = self._registry_object(pylons_obj, 'translator',
+                                               pylons.translator, registry)
+        else:
+            response = pylons_obj.response
+            translator = pylons_obj.translator
+        stacklist = [(pylons.response, response),
+                     (pylons.request, pylons_obj.request),
+                     (pylons.app_globals, self.globals),
+                     (pylons.config, self.config),
+                     (pylons.tmpl_context, pylons_obj.tmpl_context),
+                     (pylons.translator, translator)]
 
-        if 'session' in pylons_obj.__dict__:
-            registry.register(pylons.session, pylons_obj.session)
-        if 'cache' in pylons_obj.__dict__:
-            registry.register(pylons.cache, pylons_obj.cache)
-        elif 'cache' in pylons_obj.app_globals.__dict__:
-            registry.register(pylons.cache, pylons_obj.app_globals.cache)
+        if hasattr(pylons_obj, 'session'):
+            stacklist.append((pylons.session, pylons_obj.session))
+        if hasattr(pylons_obj, 'cache'):
+            stacklist.append((pylons.cache, pylons_obj.cache))
+        elif 'cache' in getattr(pylons_obj.app_globals, '__dict__', ()):
+            stacklist.append((pylons.cache, pylons_obj.app_globals.cache))
 
         if 'routes.url' in environ:
-            registry.register(pylons.url, environ['routes.url'])
+            stacklist.append((pylons.url, environ['routes.url']))
+        registry.multiregister(stacklist)
+
+    def _registry_object(self, pylons_obj, name, proxy, registry):
+        """Return the object to register for a lazily created
+        :class:`~pylons.util.LeanPylonsContext` attribute"""
+        if pylons_obj.is_loaded(name):
+            return getattr(pylons_obj, name)
+        return LazyRegistration(pylons_obj, name, proxy, registry)
+
+    def _create_response(self):
+        """Create the Response for a request, used as the
+        :class:`~pylons.util.LeanPylonsContext` response factory"""
+        return Response(headerlist=list(self._response_headerlist))
+
+    def _create_translator(self):
+        """Create the translator for a request, used as the
+        :class:`~pylons.util.LeanPylonsContext` translator factory"""
+        return _get_translator(self.config['lang'], pylons_config=self.config)
 
     def setup_app_env(self, environ, start_response):
         """Setup and register all the Pylons objects with the registry
@@ -171,16 +288,21 @@ class PylonsApp(object):
         req.config = self.config
         req.link, req.route_dict = environ['wsgiorg.routing_args']
 
-        response = Response(
-            content_type=self.response_options['content_type'],
-            charset=self.response_options['charset'])
-        response.headers.update(self.response_options['headers'])
+        if self.lean_context:
+            # The response and translator are created on first use
+            pylons_obj = LeanPylonsContext(self._create_response,
+                                           self._create_translator)
+        else:
+            response = Response(
+                content_type=self.response_options['content_type'],
+                charset=self.response_options['charset'])
+            response.headers.update(self.response_options['headers'])
+            pylons_obj = PylonsContext()
+            pylons_obj.response = response
 
         # Store a copy of the request/response in environ for faster access
-        pylons_obj = PylonsContext()
         pylons_obj.config = self.config
         pylons_obj.request = req
-        pylons_obj.response = response
         pylons_obj.app_globals = self.globals
         pylons_obj.h = self.helpers
 
@@ -191,23 +313,26 @@ class PylonsApp(object):
 
         environ['pylons.environ_config'] = self.environ_config
 
-        # Setup the translator object
-        lang = self.config['lang']
-        pylons_obj.translator = _get_translator(lang, pylons_config=self.config)
-
-        if self.config['pylons.strict_tmpl_context']:
-            tmpl_context = ContextObj()
-        else:
-            tmpl_context = AttribSafeContextObj()
+        if not self.lean_context:
+            # Setup the translator object
+            lang = self.config['lang']
+            pylons_obj.translator = _get_translator(lang,
+                                                    pylons_config=self.config)
+        tmpl_context = self._tmpl_context_class()
         pylons_obj.tmpl_context = req.tmpl_context = tmpl_context
 
         if self._session_key in environ:
             pylons_obj.session = req.session = environ[self._session_key]
         if self._cache_key in environ:
             pylons_obj.cache = environ[self._cache_key]
-
-        # Load the globals with the registry if around
-        if 'paste.registry' in environ:
+        elif 'cache' in getattr(self.globals, '__dict__', ()):
+            pylons_obj.cache = self.globals.cache
+
+        # Load the globals with the registry if around, for code that
+        # still uses it directly. The pylons globals themselves read
+        # the objects from the request-local context
+        if self.use_registry and request_local.registry_safe and \
+                'paste.registry' in environ:
             self.register_globals(environ)
 
     def resolve(self, environ, start_response):
@@ -256,6 +381,7 @@ class PylonsApp(object):
         if '.' in controller or ':' in controller:
             mycontroller = pkg_resources.EntryPoint.parse(
                 'x=%s' % controller).load(False)
+            self._compile_controller(mycontroller)
             self.controller_classes[controller] = mycontroller
             return mycontroller
 
@@ -277,9 +403,79 @@ class PylonsApp(object):
                 log.debug("Found controller, module: '%s', class: '%s'",
                           full_module_name, class_name)
             mycontroller = getattr(sys.modules[full_module_name], class_name)
+        self._compile_controller(mycontroller)
         self.controller_classes[controller] = mycontroller
         return mycontroller
 
+    def _compile_controller(self, controller):
+        """Build the dispatch table of a WSGIController class so its
+        first request doesn't have to"""
+        if isinstance(controller, type) and \
+                issubclass(controller, WSGIController):
+            dispatch_table(controller)
+
+    def preload_controllers(self):
+        """Import every controller and compile its dispatch table up
+        front, instead of on the first request that resolves to it
+
+        Every module in the project's ``controllers`` package is
+        imported, along with the dotted controllers (``module:object``)
+        named in the ``routes.map``. Called from ``__init__`` when the
+        ``pylons.preload_controllers`` option is enabled, so that a
+        forking server loads the controllers once, before forking.
+
+        A controller that fails to import (an ``ImportError``) is
+        logged and skipped.
+
+        Returns a list of ``(controller, seconds)`` tuples, the time
+        taken to import each controller, slowest first.
+
+        """
+        names = []
+        package = self.package_name + '.controllers'
+        __import__(package)
+        package_path = getattr(sys.modules[package], '__path__', None)
+        if package_path:
+            for loader, module_name, is_pkg in pkgutil.walk_packages(
+                package_path, package + '.'):
+                names.append(module_name[len(package) + 1:].replace('.', '/'))
+
+        mapper = self.config.get('routes.map')
+        for route in getattr(mapper, 'matchlist', ()):
+            controller = route.defaults.get('controller')
+            if isinstance(controller, basestring) and \
+                    ('.' in controller or ':' in controller):
+                names.append(controller)
+
+        timings = []
+        start = time.time()
+        for name in names:
+            if name in self.controller_classes:
+                continue
+            controller_start = time.time()
+            try:
+                self.find_controller(name)
+            except AttributeError:
+                # A module in the controllers package that doesn't
+                # define a controller
+                log.debug("No controller found in %r, skipping", name)
+                continue
+            except ImportError:
+                # Left for the requests to it to fail, as they do
+                # without preloading
+                log.exception("Unable to import controller %r, skipping",
+                              name)
+                continue
+            timings.append((name, time.time() - controller_start))
+
+        timings.sort(key=lambda timing: timing[1], reverse=True)
+        for name, seconds in timings:
+            log.info("Preloaded controller %r in %.1fms", name,
+                     seconds * 1000)
+        log.info("Preloaded %d controllers in %.1fms", len(timings),
+                 (time.time() - start) * 1000)
+        return timings
+
     def dispatch(self, controller, environ, start_response):
         """Dispatches to a controller, will instantiate the controller
         if necessary.
@@ -146,6 +146,7 @@ http://docs.pylonsproject.org/projects/pylons-webframework/en/latest/
     restcontroller = pylons.commands:RestControllerCommand
     routes = pylons.commands:RoutesCommand
     shell = pylons.commands:ShellCommand
+    compile-templates = pylons.commands:CompileTemplatesCommand
 
     [paste.paster_create_template]
     pylons = pylons.util:PylonsTemplate
@@ -0,0 +1,10 @@
+import logging
+
+from pylons.controllers import WSGIController
+from sample_controllers.lib.missing import helper
+
+log = logging.getLogger(__name__)
+
+class UnimportableController(WSGIController):
+    def index(self):
+        return helper()
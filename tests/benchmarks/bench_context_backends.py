@@ -0,0 +1,107 @@
+"""Throughput of each request-local context backend
+
+For every available backend (``pylons.context_backend``), measures the
+requests per second of a controller that reads the pylons globals a
+few dozen times, and the cost of a single ``pylons.request`` access
+within a request. With the greenlet backend the requests are also run
+interleaved, each in its own greenlet.
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_context_backends.py [requests]
+
+"""
+import os
+import sys
+import time
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons
+import pylons.configuration as configuration
+from pylons import tmpl_context as c
+from pylons.controllers import WSGIController
+from pylons.requestlocal import backends, request_local
+from pylons.wsgiapp import PylonsApp
+
+
+class GlobalsController(WSGIController):
+    def index(self):
+        c.name = 'bench'
+        for i in xrange(10):
+            pylons.request.environ
+            pylons.response.headers
+            pylons.tmpl_context.name
+        return 'Hello %s' % c.name
+
+    def access(self):
+        timer = timeit.Timer(lambda: pylons.request.environ)
+        return str(min(timer.repeat(3, 100000)) / 100000)
+
+
+def make_app(backend):
+    # Each backend in turn, rather than the one the first app chose
+    request_local.set_backend('thread')
+    config = configuration.PylonsConfig()
+    config.init_app({}, {'pylons.context_backend': backend}, package='bench',
+                    paths=dict(root=here))
+    mapper = Mapper()
+    mapper.connect('/{action}', controller=GlobalsController)
+    app = PylonsApp(config=config)
+    return RoutesMiddleware(app, mapper, singleton=False)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def request(app, action='index'):
+    environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'PATH_INFO': '/' + action, 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http', 'wsgi.input': None}
+    return ''.join(app(environ, start_response))
+
+
+def run(app, requests):
+    start = time.time()
+    for i in xrange(requests):
+        request(app)
+    return requests / (time.time() - start)
+
+
+def run_greenlets(app, requests):
+    from greenlet import greenlet
+    start = time.time()
+    for i in xrange(requests):
+        greenlet(request).switch(app)
+    return requests / (time.time() - start)
+
+
+def main(requests=10000):
+    print 'Requests/sec by context backend (%d requests, best of 3)' % (
+        requests)
+    for name in sorted(backends):
+        try:
+            app = make_app(name)
+        except ImportError, e:
+            print '  %-12s unavailable (%s)' % (name, e)
+            continue
+        run(app, 100)
+        best = max(run(app, requests) for i in range(3))
+        access = float(request(app, 'access')) * 1e6
+        print '  %-12s %8.0f requests/sec, %.3fus per pylons.request' % (
+            name, best, access)
+        if name == 'greenlet':
+            best = max(run_greenlets(app, requests) for i in range(3))
+            print '  %-12s %8.0f requests/sec, a greenlet per request' % (
+                '', best)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,172 @@
+"""Micro-benchmark of WSGIController action dispatch
+
+Compares the per-request ``getattr``/``callable``/argspec lookup
+WSGIController used to do against the precompiled dispatch table.
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_dispatch.py [iterations]
+
+"""
+import inspect
+import logging
+import os
+import sys
+import timeit
+import types
+
+from webob.exc import HTTPException, HTTPNotFound
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__)))))
+
+import pylons
+from pylons.controllers import WSGIController
+from pylons.controllers.dispatch import dispatch_table
+from pylons.util import ContextObj, PylonsContext
+
+log = logging.getLogger(__name__)
+
+
+class BenchController(WSGIController):
+    def __before__(self):
+        pass
+
+    def index(self):
+        return 'index'
+
+    def show(self, id, format='html'):
+        return id
+
+    def search(self, **kwargs):
+        return 'search'
+
+    def show_item(self, id):
+        return id
+
+
+class LegacyController(BenchController):
+    """The dispatch path as it was before dispatch tables"""
+    def _inspect_call(self, func):
+        try:
+            cached_argspecs = self.__class__._cached_argspecs
+        except AttributeError:
+            self.__class__._cached_argspecs = cached_argspecs = {}
+
+        func_key = getattr(func, 'im_func', func.__call__)
+        try:
+            argspec = cached_argspecs[func_key]
+        except KeyError:
+            argspec = cached_argspecs[func_key] = inspect.getargspec(func_key)
+        kargs = self._get_method_args()
+
+        log_debug = self._pylons_log_debug
+        c = self._py_object.tmpl_context
+        environ = self._py_object.request.environ
+        args = None
+
+        if argspec[2]:
+            if self._py_object.config['pylons.tmpl_context_attach_args']:
+                for k, val in kargs.iteritems():
+                    setattr(c, k, val)
+            args = kargs
+        else:
+            args = {}
+            argnames = argspec[0][isinstance(func, types.MethodType)
+                                  and 1 or 0:]
+            for name in argnames:
+                if name in kargs:
+                    if self._py_object.config[
+                            'pylons.tmpl_context_attach_args']:
+                        setattr(c, name, kargs[name])
+                    args[name] = kargs[name]
+        if log_debug:
+            log.debug("Calling %r method with keyword args: **%r",
+                      func.__name__, args)
+        try:
+            result = self._perform_call(func, args)
+        except HTTPException, httpe:
+            result = httpe
+            environ['pylons.controller.exception'] = httpe
+            result._exception = True
+        return result
+
+    def _dispatch_call(self):
+        log_debug = self._pylons_log_debug
+        req = self._py_object.request
+        try:
+            action = req.environ['pylons.routes_dict']['action']
+        except KeyError:
+            raise Exception("No action matched from Routes, unable to"
+                            "determine action dispatch.")
+        action_method = action.replace('-', '_')
+        if log_debug:
+            log.debug("Looking for %r method to handle the request",
+                      action_method)
+        try:
+            func = getattr(self, action_method, None)
+        except UnicodeEncodeError:
+            func = None
+        if action_method != 'start_response' and callable(func):
+            req.environ['pylons.action_method'] = func
+            response = self._inspect_call(func)
+        else:
+            if log_debug:
+                log.debug("Couldn't find %r method to handle response", action)
+            if pylons.config['debug']:
+                raise NotImplementedError('Action %r is not implemented' %
+                                          action)
+            else:
+                response = HTTPNotFound()
+        return response
+
+    def _call_filters(self):
+        if hasattr(self, '__before__'):
+            self._inspect_call(self.__before__)
+        return self._dispatch_call()
+
+
+class CurrentController(BenchController):
+    def _call_filters(self):
+        if dispatch_table(self.__class__).has_before:
+            self._inspect_call(self.__before__)
+        return self._dispatch_call()
+
+
+class FakeRequest(object):
+    def __init__(self, environ):
+        self.environ = environ
+
+
+def make_controller(controller_class, action, attach_args=False):
+    environ = {'pylons.routes_dict': dict(action=action, id='1',
+                                          controller='bench')}
+    py_obj = PylonsContext()
+    py_obj.config = {'pylons.tmpl_context_attach_args': attach_args}
+    py_obj.request = FakeRequest(environ)
+    py_obj.tmpl_context = ContextObj()
+    controller = controller_class()
+    controller._py_object = py_obj
+    controller.start_response = None
+    return controller
+
+
+def main(iterations=200000):
+    # Missing actions raise in debug mode
+    pylons.config['debug'] = False
+    print 'Dispatch cost per call (%d iterations)' % iterations
+    for attach_args in (False, True):
+        print 'pylons.tmpl_context_attach_args = %s' % attach_args
+        for action in ('index', 'show', 'search', 'show-item', 'missing'):
+            results = []
+            for controller_class in (LegacyController, CurrentController):
+                controller = make_controller(controller_class, action,
+                                             attach_args)
+                timer = timeit.Timer(controller._call_filters)
+                best = min(timer.repeat(5, iterations)) / iterations
+                results.append(best * 1e6)
+            print '  %-10s legacy: %6.2fus  table: %6.2fus  (%.2fx)' % (
+                action, results[0], results[1], results[0] / results[1])
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
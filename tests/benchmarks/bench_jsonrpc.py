@@ -0,0 +1,101 @@
+"""JSONRPCController request parsing and response encoding
+
+Time per call for a small request and response, and for a large
+request (a thousand records sent to the server) and a large response
+(a thousand records sent back), with the default
+:class:`~pylons.controllers.jsonrpc.JSONCodec` and with one using
+simplejson.
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_jsonrpc.py [requests]
+
+"""
+import json
+import os
+import sys
+import time
+from StringIO import StringIO
+
+import simplejson
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons.configuration as configuration
+from pylons.controllers import JSONRPCController
+from pylons.controllers.jsonrpc import JSONCodec
+from pylons.wsgiapp import PylonsApp
+
+RECORDS = [dict(id=i, name=u'item %d' % i, price=i % 1000 / 10.0,
+                tags=['tag%d' % (i % 7), 'tag%d' % (i % 11)],
+                available=bool(i % 3))
+           for i in range(1000)]
+
+
+class RPCController(JSONRPCController):
+    def add(self, x, y):
+        return x + y
+
+    def save(self, records):
+        return len(records)
+
+    def search(self, query):
+        return RECORDS
+
+
+class SimplejsonRPCController(RPCController):
+    json_codec = JSONCodec(simplejson.loads, simplejson.dumps)
+
+
+def make_app():
+    config = configuration.PylonsConfig()
+    config.init_app({}, {}, package='bench', paths=dict(root=here))
+    mapper = Mapper()
+    mapper.connect('/json', controller=RPCController, action='index')
+    mapper.connect('/simplejson', controller=SimplejsonRPCController,
+                   action='index')
+    app = PylonsApp(config=config)
+    return RoutesMiddleware(app, mapper, singleton=False)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def run(app, path, body, requests):
+    environ = {'REQUEST_METHOD': 'POST', 'SCRIPT_NAME': '',
+               'PATH_INFO': path, 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'CONTENT_TYPE': 'application/json',
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.url_scheme': 'http'}
+    start = time.time()
+    for i in xrange(requests):
+        environ['wsgi.input'] = StringIO(body)
+        response = ''.join(app(environ.copy(), start_response))
+    assert '"result"' in response
+    return (time.time() - start) / requests
+
+
+def main(requests=2000):
+    app = make_app()
+    calls = [('small', dict(method='add', params=[1, 2]), requests),
+             ('large request', dict(method='save', params=[RECORDS]),
+              requests / 20),
+             ('large response', dict(method='search', params=['item']),
+              requests / 20)]
+    print 'Time per call (best of 3)'
+    for name, call, count in calls:
+        call.update(jsonrpc='2.0', id=1)
+        body = json.dumps(call)
+        for path in ('/json', '/simplejson'):
+            seconds = min(run(app, path, body, count) for i in range(3))
+            print '  %-15s %-11s %9.1fus' % (name, path[1:], seconds * 1e6)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,101 @@
+"""JSON-RPC calls made one request at a time, compared to a single batch
+
+A page's worth of calls is sent to a ``JSONRPCController`` as separate
+requests, as one batch, and as one batch run on a pool of
+``batch_workers`` threads, both for a cheap method and for one waiting
+a millisecond on I/O (as a database or backend call would).
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_jsonrpc_batch.py [calls]
+
+"""
+import json
+import os
+import sys
+import time
+from StringIO import StringIO
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons.configuration as configuration
+from pylons.controllers import JSONRPCController
+from pylons.wsgiapp import PylonsApp
+
+
+class RPCController(JSONRPCController):
+    def add(self, x, y):
+        return x + y
+
+    def fetch(self, item_id):
+        time.sleep(0.001)
+        return dict(id=item_id, name='item %d' % item_id)
+
+
+class ConcurrentRPCController(RPCController):
+    batch_workers = 8
+
+
+def make_app():
+    config = configuration.PylonsConfig()
+    config.init_app({}, {}, package='bench', paths=dict(root=here))
+    mapper = Mapper()
+    mapper.connect('/rpc', controller=RPCController, action='index')
+    mapper.connect('/concurrent', controller=ConcurrentRPCController,
+                   action='index')
+    app = PylonsApp(config=config)
+    return RoutesMiddleware(app, mapper, singleton=False)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def post(app, path, data):
+    body = json.dumps(data)
+    environ = {'REQUEST_METHOD': 'POST', 'SCRIPT_NAME': '',
+               'PATH_INFO': path, 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'CONTENT_TYPE': 'application/json',
+               'CONTENT_LENGTH': str(len(body)),
+               'wsgi.url_scheme': 'http', 'wsgi.input': StringIO(body)}
+    return ''.join(app(environ, start_response))
+
+
+def single(app, calls):
+    for call in calls:
+        post(app, '/rpc', call)
+
+
+def batch(app, calls):
+    post(app, '/rpc', calls)
+
+
+def concurrent(app, calls):
+    post(app, '/concurrent', calls)
+
+
+def main(calls=40):
+    app = make_app()
+    print 'Time for %d calls (best of 3)' % calls
+    for method, params in (('add', lambda i: [i, 1]),
+                           ('fetch', lambda i: [i])):
+        requests = [dict(jsonrpc='2.0', id=i, method=method,
+                         params=params(i)) for i in range(calls)]
+        for name, run in (('single', single), ('batch', batch),
+                          ('batch x8', concurrent)):
+            run(app, requests)
+            times = []
+            for i in range(3):
+                start = time.time()
+                run(app, requests)
+                times.append(time.time() - start)
+            print '  %-6s %-9s %8.2fms' % (method, name, min(times) * 1000)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
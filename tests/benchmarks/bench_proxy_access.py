@@ -0,0 +1,168 @@
+"""Cost of the pylons globals on a template heavy page
+
+Renders a page made of a Mako layout and 50 partials, each of which
+goes through ``pylons_globals()`` and reads ``request``, ``url`` and
+``tmpl_context`` from its namespace, while a helper reads
+``pylons.request`` and ``pylons.tmpl_context`` directly. Three setups
+are compared:
+
+``registry``
+    The globals resolve through ``paste.registry`` only, as they did
+    before the request-local context (emulated by hiding the current
+    context from the proxies).
+``request-local``
+    The default, the globals are read from the request's context and
+    are also registered with ``paste.registry``.
+``no registry``
+    No ``RegistryManager`` middleware at all.
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_proxy_access.py [requests]
+
+"""
+import os
+import sys
+import time
+import timeit
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+
+from mako.lookup import TemplateLookup
+from paste.registry import RegistryManager
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons
+import pylons.configuration as configuration
+from pylons import tmpl_context as c
+from pylons.controllers import WSGIController
+from pylons.requestlocal import request_local
+from pylons.templating import render_mako
+from pylons.wsgiapp import PylonsApp
+
+PARTIALS = 50
+
+LAYOUT = """<html><head><title>${c.title}</title></head><body>
+<p>${request.path_info} - ${c.user}</p>
+${body}
+</body></html>"""
+
+ROW = """<div class="row"><a href="${url('/item/%d' % i)}">${c.title} \
+${i}</a> ${h.css_class(i)} ${request.method}</div>"""
+
+
+class Helpers(object):
+    def css_class(self, i):
+        if pylons.request.environ.get('HTTP_X_COMPACT'):
+            return 'compact'
+        return getattr(pylons.tmpl_context, 'row_class', 'row-%d' % i)
+
+
+class PageController(WSGIController):
+    def index(self):
+        c.title = 'Items'
+        c.user = 'bench'
+        rows = [render_mako('/row.mako', extra_vars={'i': i})
+                for i in xrange(PARTIALS)]
+        return render_mako('/layout.mako', extra_vars={'body': ''.join(rows)})
+
+
+def make_config():
+    lookup = TemplateLookup()
+    lookup.put_string('/layout.mako', LAYOUT)
+    lookup.put_string('/row.mako', ROW)
+    globals_ = type('Globals', (object,), {})()
+    globals_.mako_lookup = lookup
+
+    config = configuration.PylonsConfig()
+    config.init_app({}, {}, package='bench', paths=dict(root=here))
+    config['pylons.app_globals'] = globals_
+    config['pylons.h'] = Helpers()
+    mapper = Mapper()
+    mapper.connect('/page', controller=PageController, action='index')
+    config['routes.map'] = mapper
+    return config
+
+
+def make_app(registry_manager=True):
+    config = make_config()
+    app = PylonsApp(config=config)
+    app = RoutesMiddleware(app, config['routes.map'], singleton=False)
+    if registry_manager:
+        app = RegistryManager(app)
+    return app
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+           'PATH_INFO': '/page', 'QUERY_STRING': '',
+           'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+           'wsgi.url_scheme': 'http', 'wsgi.input': None}
+
+
+def run(app, requests):
+    start = time.time()
+    for i in xrange(requests):
+        ''.join(app(environ.copy(), start_response))
+    return requests / (time.time() - start)
+
+
+def hide_context():
+    """Make the proxies fall back to paste.registry"""
+    request_local.current = lambda: None
+
+
+def show_context():
+    del request_local.current
+
+
+class AccessController(WSGIController):
+    def index(self):
+        timer = timeit.Timer(lambda: pylons.request.environ)
+        return str(min(timer.repeat(3, 100000)) / 100000)
+
+
+def access_cost(app):
+    """Time a ``pylons.request.environ`` access within a request"""
+    return float(''.join(app(dict(environ, **{
+        'wsgiorg.routing_args': ((), {'controller': AccessController,
+                                      'action': 'index'})}),
+        start_response)))
+
+
+def main(requests=2000):
+    setups = [('registry', make_app(), True),
+              ('request-local', make_app(), False),
+              ('no registry', make_app(registry_manager=False), False)]
+    print 'Template heavy page, %d partials (%d requests, best of 3)' % (
+        PARTIALS, requests)
+    for name, app, hidden in setups:
+        if hidden:
+            hide_context()
+        try:
+            run(app, 20)
+            best = max(run(app, requests) for i in range(3))
+        finally:
+            if hidden:
+                show_context()
+        print '  %-14s %7.0f requests/sec' % (name, best)
+
+    print 'pylons.request.environ access within a request'
+    app = RegistryManager(PylonsApp(config=make_config()))
+    for name, hidden in (('registry', True), ('request-local', False)):
+        if hidden:
+            hide_context()
+        try:
+            print '  %-14s %7.3fus' % (name, access_cost(app) * 1e6)
+        finally:
+            if hidden:
+                show_context()
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,73 @@
+"""Requests per second of a hello-world controller, with and without
+the ``pylons.lean_context`` option
+
+Requests are made by calling the WSGI stack directly, so this measures
+the Pylons per-request setup rather than any server.
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_request_setup.py [requests]
+
+"""
+import os
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(here)),
+                                'test_files'))
+
+from paste.registry import RegistryManager
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons.configuration as configuration
+from pylons.wsgiapp import PylonsApp
+
+
+def make_app(**app_conf):
+    root = os.path.join(os.path.dirname(os.path.dirname(here)), 'test_files',
+                        'sample_controllers')
+    paths = dict(root=root, controllers=os.path.join(root, 'controllers'))
+    config = configuration.PylonsConfig()
+    config.init_app({}, app_conf, package='sample_controllers', paths=paths)
+    config['pylons.app_globals'] = type('Globals', (object,), {})()
+    mapper = Mapper(directory=paths['controllers'])
+    mapper.connect('/{controller}/{action}')
+    config['routes.map'] = mapper
+    app = PylonsApp(config=config)
+    app = RoutesMiddleware(app, mapper, singleton=False)
+    return RegistryManager(app)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def run(app, requests):
+    environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'PATH_INFO': '/hello/index', 'QUERY_STRING': '',
+               'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+               'wsgi.url_scheme': 'http', 'wsgi.input': None}
+    start = time.time()
+    for i in xrange(requests):
+        ''.join(app(environ.copy(), start_response))
+    return requests / (time.time() - start)
+
+
+def main(requests=20000):
+    apps = [('default', make_app()),
+            ('lean', make_app(**{'pylons.lean_context': 'true'})),
+            ('default, lang=ja', make_app(lang='ja')),
+            ('lean, lang=ja', make_app(**{'pylons.lean_context': 'true',
+                                          'lang': 'ja'}))]
+    print 'Hello world requests/sec (%d requests, best of 3)' % requests
+    for name, app in apps:
+        run(app, 100)
+        best = max(run(app, requests) for i in range(3))
+        print '  %-18s %8.0f' % (name, best)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,76 @@
+"""Signed cookie encode/decode throughput and cookie size
+
+Compares the pickle format ``Response.signed_cookie`` used before
+Pylons 1.0.3 (read through ``Request.signed_cookie`` with ``legacy``)
+to :class:`~pylons.controllers.util.SignedCookieCodec`, with and
+without compression, for a small and a larger session-like value.
+
+Run from the repository root::
+
+    python tests/benchmarks/bench_signed_cookie.py [iterations]
+
+"""
+import base64
+import hmac
+import os
+import sys
+import timeit
+try:
+    import cPickle as pickle
+except ImportError:
+    import pickle
+from hashlib import sha1
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+
+from pylons.controllers.util import Request, SignedCookieCodec
+
+SECRET = 'bench secret'
+
+VALUES = [
+    ('small', {'user_id': 1234, 'name': u'caf\xe9', 'admin': False}),
+    ('large', {'user_id': 1234, 'flash': [u'Saved item %d' % i
+                                          for i in range(20)],
+               'recent': range(1000, 1100), 'locale': 'en-us'}),
+]
+
+
+def legacy_dumps(data):
+    pickled = pickle.dumps(data, pickle.HIGHEST_PROTOCOL)
+    sig = hmac.new(SECRET, pickled, sha1).hexdigest()
+    return sig + base64.standard_b64encode(pickled)
+
+
+def request_for(cookie):
+    return Request.blank('/', headers={'Cookie': 'session=' + cookie})
+
+
+def main(iterations=20000):
+    codecs = [('json', SignedCookieCodec(SECRET, compress_threshold=None)),
+              ('json+zlib', SignedCookieCodec(SECRET))]
+    print 'Signed cookies (%d iterations, best of 3)' % iterations
+    print '  %-6s %-10s %7s %11s %11s' % ('value', 'format', 'bytes',
+                                          'encode/sec', 'decode/sec')
+    for value_name, data in VALUES:
+        formats = [('pickle', lambda: legacy_dumps(data), None)]
+        for name, codec in codecs:
+            formats.append((name, lambda codec=codec: codec.dumps(
+                        data, 'session'), codec))
+        for name, dumps, codec in formats:
+            cookie = dumps()
+            request = request_for(cookie)
+            decode = lambda: request.signed_cookie('session', SECRET,
+                                                   codec=codec, legacy=True)
+            assert decode() is not None
+            encode_time = min(timeit.repeat(dumps, number=iterations,
+                                            repeat=3))
+            decode_time = min(timeit.repeat(decode, number=iterations,
+                                            repeat=3))
+            print '  %-6s %-10s %7d %11.0f %11.0f' % (
+                value_name, name, len(cookie), iterations / encode_time,
+                iterations / decode_time)
+
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,154 @@
+"""Peak memory and time to first byte of a large export
+
+Each scenario sends roughly 50MB through a PylonsApp, either built up
+as a single string or streamed:
+
+``string``
+    The action joins the rows into one unicode string.
+``generator``
+    The action returns a generator of unicode rows, which the
+    controller encodes a chunk at a time.
+``jsonify``
+    ``@jsonify`` over a list of dicts.
+``jsonify stream``
+    ``@jsonify(stream=True)`` over a generator of dicts.
+``jinja2``
+    ``render_jinja2`` of a template looping over the rows.
+``jinja2 stream``
+    The same template rendered with ``stream=True``.
+
+Every scenario runs in a fresh interpreter so its peak RSS isn't
+hidden by an earlier one. Run from the repository root::
+
+    python tests/benchmarks/bench_streaming.py [megabytes]
+
+"""
+import os
+import resource
+import subprocess
+import sys
+import time
+
+here = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(os.path.dirname(here)))
+
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons.configuration as configuration
+from pylons.controllers import WSGIController
+from pylons.decorators import jsonify
+from pylons.templating import render_jinja2
+from pylons.wsgiapp import PylonsApp
+
+SCENARIOS = [('string', 'string'), ('generator', 'generator'),
+             ('jsonify', 'json'), ('jsonify stream', 'json_stream'),
+             ('jinja2', 'jinja2'), ('jinja2 stream', 'jinja2_stream')]
+
+# Bytes per row, roughly, in both the CSV and JSON exports
+ROW_SIZE = 48
+ROWS = 0
+
+
+def csv_rows():
+    for i in xrange(ROWS):
+        yield u'%08d,caf\xe9 item %08d,%05d.%02d,%08d\n' % (
+            i, i, i % 1000, i % 100, i)
+
+
+def json_rows():
+    for i in xrange(ROWS):
+        yield dict(id=i, name=u'caf\xe9 %d' % i)
+
+
+class ExportController(WSGIController):
+    def string(self):
+        return u''.join(csv_rows())
+
+    def generator(self):
+        return csv_rows()
+
+    @jsonify
+    def json(self):
+        return dict(rows=list(json_rows()))
+
+    @jsonify(stream=True)
+    def json_stream(self):
+        return dict(rows=json_rows())
+
+    def jinja2(self):
+        return render_jinja2('rows.html', dict(rows=csv_rows()))
+
+    def jinja2_stream(self):
+        return render_jinja2('rows.html', dict(rows=csv_rows()), stream=True)
+
+
+class AppGlobals(object):
+    def __init__(self):
+        from jinja2 import DictLoader, Environment
+        self.jinja2_env = Environment(loader=DictLoader(
+                {'rows.html': '{% for row in rows %}{{ row }}{% endfor %}'}))
+
+
+def make_app():
+    config = configuration.PylonsConfig()
+    config.init_app({}, {}, package='bench', paths=dict(root=here))
+    config['pylons.app_globals'] = AppGlobals()
+    mapper = Mapper()
+    mapper.connect('/{action}', controller=ExportController)
+    app = PylonsApp(config=config)
+    return RoutesMiddleware(app, mapper, singleton=False)
+
+
+def start_response(status, headers, exc_info=None):
+    pass
+
+
+def max_rss():
+    """Peak resident set size of this process, in MB"""
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def measure(action):
+    app = make_app()
+    environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'PATH_INFO': '/' + action,
+               'QUERY_STRING': '', 'SERVER_NAME': 'localhost',
+               'SERVER_PORT': '80', 'wsgi.url_scheme': 'http',
+               'wsgi.input': None}
+    baseline = max_rss()
+    start = time.time()
+    app_iter = app(environ, start_response)
+    size = 0
+    ttfb = None
+    for chunk in app_iter:
+        if ttfb is None:
+            ttfb = time.time() - start
+        size += len(chunk)
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+    total = time.time() - start
+    print '%d %f %f %f' % (size, ttfb, total, max_rss() - baseline)
+
+
+def main(megabytes=50):
+    print 'Exporting ~%dMB (peak RSS is the growth over the baseline)' % (
+        megabytes)
+    print '  %-16s %8s %10s %10s %12s' % ('', 'MB sent', 'TTFB', 'total',
+                                         'peak RSS')
+    for name, action in SCENARIOS:
+        output = subprocess.Popen(
+            [sys.executable, __file__, '--measure', action, str(megabytes)],
+            stdout=subprocess.PIPE).communicate()[0]
+        size, ttfb, total, rss = output.split()
+        print '  %-16s %8.1f %9.3fs %9.3fs %10.1fMB' % (
+            name, int(size) / 1048576.0, float(ttfb), float(total),
+            float(rss))
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--measure']:
+        ROWS = int(sys.argv[3]) * 1048576 / ROW_SIZE
+        measure(sys.argv[2])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:2]])
@@ -8,7 +8,7 @@ from nose.tools import raises
 from __init__ import test_root
 
 
-def make_app(global_conf, full_stack=True, static_files=True, include_cache_middleware=False, attribsafe=False, **app_conf):
+def make_app(global_conf, full_stack=True, static_files=True, include_cache_middleware=False, attribsafe=False, registry_manager=True, **app_conf):
     import pylons
     import pylons.configuration as configuration
     from beaker.cache import CacheManager
@@ -53,7 +53,8 @@ def make_app(global_conf, full_stack=True, static_files=True, include_cache_midd
             app = StatusCodeRedirect(app)
         else:
             app = StatusCodeRedirect(app, [401, 403, 404, 500])
-    app = RegistryManager(app)
+    if registry_manager:
+        app = RegistryManager(app)
 
     app.config = config
     return app
@@ -101,6 +102,103 @@ class TestWsgiApp(object):
         assert 'Hello World' in resp
 
 
+class TestContextObj(object):
+    def test_strict(self):
+        from pylons.util import ContextObj
+        c = ContextObj()
+        c.name = 'value'
+        assert c.name == 'value'
+        assert not hasattr(c, 'missing')
+
+    def test_attribsafe(self):
+        from pylons.util import AttribSafeContextObj
+        c = AttribSafeContextObj()
+        c.name = 'value'
+        assert c.name == 'value'
+        assert c.missing == ''
+
+    def test_repr(self):
+        from pylons.util import ContextObj
+        c = ContextObj()
+        c.title = 'x' * 1000
+        c.name = 'value'
+        c._private = True
+        assert repr(c).endswith(' name, title>')
+
+    def test_lazy(self):
+        from pylons.util import AttribSafeContextObj, ContextObj
+        calls = []
+        def compute(*args, **kwargs):
+            calls.append((args, kwargs))
+            return len(calls)
+        for cls in (ContextObj, AttribSafeContextObj):
+            del calls[:]
+            c = cls()
+            c.set_lazy('value', compute, 1, key=2)
+            c.set_lazy('replaced', compute)
+            assert calls == []
+            assert 'value' in repr(c)
+            assert c.value == 1
+            assert c.value == 1
+            assert calls == [((1,), {'key': 2})]
+            c.replaced = 'set'
+            assert c.replaced == 'set'
+            assert len(calls) == 1
+
+    def test_lazy_error(self):
+        from pylons.util import AttribSafeContextObj, ContextObj
+        calls = []
+        def compute():
+            calls.append(None)
+            if len(calls) < 3:
+                raise IOError('db down')
+            return 'loaded'
+        for cls in (ContextObj, AttribSafeContextObj):
+            del calls[:]
+            c = cls()
+            c.set_lazy('value', compute)
+            for i in range(2):
+                try:
+                    c.value
+                except IOError, e:
+                    assert str(e) == 'db down'
+                else:
+                    assert False, 'IOError not raised'
+            assert c.value == 'loaded'
+            assert len(calls) == 3
+
+    def test_tracking(self):
+        from pylons.util import TrackingAttribSafeContextObj, \
+            TrackingContextObj, tmpl_context_stats
+        tmpl_context_stats.clear()
+        c = TrackingContextObj()
+        c.title = 'Title'
+        c.items = [1, 2]
+        c.name = 'name'
+        # Reads outside of a render aren't recorded
+        c.name
+        c._begin_render('page.html')
+        c.items
+        c._begin_render('item.html')
+        c.name
+        assert not hasattr(c, 'typo')
+        c._end_render()
+        c._end_render()
+        report = tmpl_context_stats.report()
+        assert report['page.html'] == dict(renders=1, unused=['name', 'title'],
+                                           missing=[])
+        assert report['item.html'] == dict(renders=1,
+                                           unused=['items', 'title'],
+                                           missing=['typo'])
+        c = TrackingAttribSafeContextObj()
+        c._begin_render('item.html')
+        assert c.typo == ''
+        c._end_render()
+        assert tmpl_context_stats.report()['item.html']['renders'] == 2
+        assert 'missing: typo' in tmpl_context_stats.format()
+        tmpl_context_stats.clear()
+
+
 class TestJsonifyDecorator(object):
     def setUp(self):
         from paste.fixture import TestApp
@@ -152,3 +250,163 @@ class TestJsonifyDecorator(object):
         response = self.app.get(self.url(controller='i18nc', action='langs'), headers={
                 'Accept-Language':'fr;q=0.6, en;q=0.1, ja;q=0.3'})
         assert "['fr', 'ja', 'en-us']" in response
+
+
+class TestPreloadControllers(object):
+    def _pylons_app(self, **app_conf):
+        from pylons.wsgiapp import PylonsApp
+        app = make_app({}, **app_conf)
+        return PylonsApp(config=app.config)
+
+    def test_preload_disabled(self):
+        pylons_app = self._pylons_app()
+        assert pylons_app.controller_classes == {}
+
+    def test_preload_controllers(self):
+        from pylons.controllers.dispatch import _tables
+        pylons_app = self._pylons_app(**{'pylons.preload_controllers': 'true'})
+        classes = pylons_app.controller_classes
+        for name in ('hello', 'goodbye', 'i18nc',
+                     'sample_controllers.controllers.hello:special_controller'):
+            assert name in classes, name
+        assert classes['hello'] in _tables
+        assert classes['goodbye'].__name__ == 'Smithy'
+
+    def test_preload_timings(self):
+        pylons_app = self._pylons_app()
+        timings = pylons_app.preload_controllers()
+        names = [name for name, seconds in timings]
+        assert 'hello' in names
+        assert 'sample_controllers.controllers.hello:empty_wsgi' in names
+        assert timings == sorted(timings, key=lambda t: t[1], reverse=True)
+
+    def test_preload_import_error(self):
+        pylons_app = self._pylons_app(**{'pylons.preload_controllers': 'true'})
+        assert 'hello' in pylons_app.controller_classes
+        assert 'unimportable' not in pylons_app.controller_classes
+        names = [name for name, seconds in pylons_app.preload_controllers()]
+        assert 'unimportable' not in names
+
+
+class TestLeanContext(object):
+    def setUp(self):
+        from paste.fixture import TestApp
+        from routes.util import URLGenerator
+        app = make_app({}, **{'pylons.lean_context': 'true'})
+        self.app = TestApp(app)
+        self.url = URLGenerator(app.config['routes.map'], {})
+
+    def test_basic_response(self):
+        response = self.app.get('/hello/index')
+        assert 'Hello World' in response
+        assert response.header('Cache-Control') == 'no-cache'
+        assert response.header('Pragma') == 'no-cache'
+        assert response.header('Content-Type') == 'text/html; charset=utf-8'
+
+    def test_default_headers_not_shared(self):
+        first = self.app.get('/hello/index', extra_environ={
+                'paste.testing_variables': True})
+        first.response.headers['X-Test'] = 'one'
+        second = self.app.get('/hello/index')
+        assert 'X-Test' not in second.headers
+
+    def test_set_lang(self):
+        response = self.app.get(self.url(controller='i18nc', action='set_lang',
+                                         lang='ja'))
+        assert u'\u8a00\u8a9e\u8a2d\u5b9a\u3092\u300cja\u300d\u306b\u5909\u66f4\u3057\u307e\u3057\u305f'.encode('utf-8') in response
+
+    def test_no_lang(self):
+        response = self.app.get(self.url(controller='i18nc', action='no_lang'))
+        assert 'No language' in response
+        assert 'No languages' in response
+
+    def test_lazy_objects(self):
+        from pylons.util import LeanPylonsContext
+        created = []
+        pylons_obj = LeanPylonsContext(lambda: created.append('r') or 'resp',
+                                       lambda: created.append('t') or 'trans')
+        assert not pylons_obj.is_loaded('response')
+        assert created == []
+        assert pylons_obj.response == 'resp'
+        assert pylons_obj.response == 'resp'
+        assert pylons_obj.is_loaded('response')
+        assert not pylons_obj.is_loaded('translator')
+        pylons_obj.translator = 'other'
+        assert pylons_obj.translator == 'other'
+        assert created == ['r']
+
+    @raises(AttributeError)
+    def test_fixed_attributes(self):
+        from pylons.util import LeanPylonsContext
+        pylons_obj = LeanPylonsContext(None, None)
+        pylons_obj.something_else = True
+
+
+class TestRequestLocal(object):
+    def _test_app(self, **kwargs):
+        from paste.fixture import TestApp
+        from routes.util import URLGenerator
+        app = make_app({}, **kwargs)
+        self.url = URLGenerator(app.config['routes.map'], {})
+        return TestApp(app)
+
+    def _test_set_lang(self, app):
+        response = app.get(self.url(controller='i18nc', action='set_lang',
+                                    lang='ja'))
+        assert u'\u8a00\u8a9e\u8a2d\u5b9a\u3092\u300cja\u300d\u306b\u5909\u66f4\u3057\u307e\u3057\u305f'.encode('utf-8') in response
+
+    def test_without_registry_manager(self):
+        app = self._test_app(full_stack=False, registry_manager=False)
+        response = app.get('/hello/index')
+        assert 'Hello World' in response
+        self._test_set_lang(app)
+
+    def test_use_registry_disabled(self):
+        app = self._test_app(**{'pylons.use_registry': 'false'})
+        self._test_set_lang(app)
+
+    def test_lean_without_registry_manager(self):
+        app = self._test_app(full_stack=False, registry_manager=False,
+                             **{'pylons.lean_context': 'true'})
+        self._test_set_lang(app)
+
+    def test_popped_after_error(self):
+        from pylons.requestlocal import request_local
+        app = self._test_app(full_stack=False)
+        try:
+            app.get('/hello/oops')
+        except Exception, e:
+            assert 'oops' in str(e)
+        else:
+            assert False, 'Exception not raised'
+        assert request_local.current() is None
+
+    def test_context_proxy(self):
+        from pylons.requestlocal import ContextProxy, request_local
+        from pylons.util import PylonsContext
+        proxy = ContextProxy('request')
+        proxy._push_object('registered')
+        try:
+            assert proxy._current_obj() == 'registered'
+            pylons_obj = PylonsContext()
+            pylons_obj.request = 'local'
+            request_local.push(pylons_obj)
+            try:
+                assert proxy._current_obj() == 'local'
+                del pylons_obj.request
+                assert proxy._current_obj() == 'registered'
+            finally:
+                request_local.pop(pylons_obj)
+            assert request_local.current() is None
+        finally:
+            proxy._pop_object('registered')
+
+    @raises(AssertionError)
+    def test_pop_mismatch(self):
+        from pylons.requestlocal import request_local
+        from pylons.util import PylonsContext
+        request_local.push(PylonsContext())
+        try:
+            request_local.pop(PylonsContext())
+        finally:
+            assert request_local.current() is None
@@ -0,0 +1,208 @@
+"""Concurrency harness for the request-local context backends
+
+Thousands of requests, spread over two applications, are interleaved
+across threads or greenlets. Each request checks, every time it gets
+control back, that the pylons globals still hold its own objects.
+"""
+import random
+import threading
+import time
+from collections import deque
+
+from nose.plugins.skip import SkipTest
+from paste.registry import RegistryManager
+from routes import Mapper
+from routes.middleware import RoutesMiddleware
+
+import pylons
+from pylons import tmpl_context as c
+from pylons.controllers import WSGIController
+from pylons.requestlocal import ThreadLocalBackend, request_local
+from pylons.templating import pylons_globals
+
+# Set by the harness, gives the other requests a chance to run
+switch = None
+
+
+class LeakController(WSGIController):
+    def check(self):
+        req_id = pylons.request.params['id']
+        app_name = pylons.request.params['app']
+        c.req_id = req_id
+        pylons.response.headers['X-Id'] = req_id
+        for i in range(3):
+            switch()
+            if pylons.request.params['id'] != req_id or \
+                    c.req_id != req_id or \
+                    pylons.response.headers['X-Id'] != req_id or \
+                    pylons.config['harness.app'] != app_name or \
+                    pylons_globals()['c'].req_id != req_id:
+                return 'leaked'
+        return req_id
+
+
+def make_app(name, registry_manager=False, **app_conf):
+    import pylons.configuration as configuration
+    from pylons.wsgiapp import PylonsApp
+    config = configuration.PylonsConfig()
+    config.init_app({}, app_conf, package='harness', paths=dict(root=None))
+    config['harness.app'] = name
+    mapper = Mapper()
+    mapper.connect('/check', controller=LeakController, action='check')
+    app = PylonsApp(config=config)
+    app = RoutesMiddleware(app, mapper, singleton=False)
+    if registry_manager:
+        app = RegistryManager(app)
+    return app
+
+
+def make_request(apps, req_id, results):
+    name = ('one', 'two')[req_id % 2]
+    environ = {'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+               'PATH_INFO': '/check', 'SERVER_NAME': 'localhost',
+               'QUERY_STRING': 'id=%d&app=%s' % (req_id, name),
+               'SERVER_PORT': '80', 'wsgi.url_scheme': 'http',
+               'wsgi.input': None}
+    def start_response(status, headers, exc_info=None):
+        pass
+    def request():
+        try:
+            body = ''.join(apps[name](environ, start_response))
+        except AssertionError, e:
+            # The context stack was popped out of order
+            body = 'error: %s' % e
+        results[req_id] = body
+    return request
+
+
+def run_threads(calls, threads=20):
+    global switch
+    switch = lambda: time.sleep(0)
+    calls = deque(calls)
+    def worker():
+        while True:
+            try:
+                call = calls.popleft()
+            except IndexError:
+                return
+            call()
+    workers = [threading.Thread(target=worker) for i in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+
+def run_greenlets(calls):
+    """Run each call in its own greenlet, switching between them at
+    random"""
+    global switch
+    try:
+        from greenlet import greenlet, getcurrent
+    except ImportError:
+        raise SkipTest('greenlet is not installed')
+    hub = getcurrent()
+    ready = [greenlet(call, parent=hub) for call in calls]
+    def greenlet_switch():
+        ready.append(getcurrent())
+        hub.switch()
+    switch = greenlet_switch
+    rand = random.Random(1)
+    while ready:
+        index = rand.randrange(len(ready))
+        ready[index], ready[-1] = ready[-1], ready[index]
+        ready.pop().switch()
+
+
+class TestContextBackends(object):
+    requests = 2000
+
+    def setUp(self):
+        request_local.set_backend('thread')
+
+    def tearDown(self):
+        request_local.set_backend('thread')
+
+    def _run(self, runner, registry_manager=False, **app_conf):
+        apps = dict(one=make_app('one', registry_manager, **app_conf),
+                    two=make_app('two', registry_manager, **app_conf))
+        results = {}
+        runner([make_request(apps, req_id, results)
+                for req_id in range(self.requests)])
+        assert request_local.current() is None
+        return [results.get(req_id) != str(req_id)
+                for req_id in range(self.requests)].count(True)
+
+    def test_thread_backend(self):
+        assert self._run(run_threads, registry_manager=True) == 0
+
+    def test_greenlet_backend(self):
+        assert self._run(run_greenlets, **{
+                'pylons.context_backend': 'greenlet'}) == 0
+
+    def test_greenlet_backend_with_registry(self):
+        assert self._run(run_greenlets, registry_manager=True, **{
+                'pylons.context_backend': 'greenlet'}) == 0
+        assert not request_local.registry_safe
+
+    def test_greenlet_backend_threads(self):
+        assert self._run(run_threads, **{
+                'pylons.context_backend': 'greenlet'}) == 0
+
+    def test_thread_backend_leaks_between_greenlets(self):
+        # Without monkeypatching, greenlets share the thread's stack.
+        # Making sure the harness notices
+        assert self._run(run_greenlets) > 0
+
+    def test_contextvars_backend(self):
+        try:
+            import contextvars
+        except ImportError:
+            raise SkipTest('contextvars is not available')
+        assert self._run(run_threads, **{
+                'pylons.context_backend': 'contextvars'}) == 0
+
+    def test_backend_path(self):
+        from pylons.requestlocal import GreenletBackend
+        try:
+            import greenlet
+        except ImportError:
+            raise SkipTest('greenlet is not installed')
+        make_app('one', **{'pylons.context_backend':
+                           'pylons.requestlocal:GreenletBackend'})
+        assert isinstance(request_local.backend, GreenletBackend)
+        backend = request_local.backend
+        request_local.set_backend('greenlet')
+        assert request_local.backend is backend
+
+    def test_conflicting_backends(self):
+        make_app('one')
+        make_app('two', **{'pylons.context_backend':
+                           'pylons.requestlocal:ThreadLocalBackend'})
+        try:
+            make_app('three', **{'pylons.context_backend': 'contextvars'})
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
+        assert isinstance(request_local.backend, ThreadLocalBackend)
+
+    def test_missing_attribute(self):
+        from pylons.util import PylonsContext
+        try:
+            import greenlet
+        except ImportError:
+            raise SkipTest('greenlet is not installed')
+        request_local.set_backend('greenlet')
+        pylons.session._push_object('registered')
+        pylons_obj = PylonsContext()
+        request_local.push(pylons_obj)
+        try:
+            pylons.session._current_obj()
+        except TypeError:
+            pass
+        else:
+            assert False, 'TypeError not raised'
+        finally:
+            request_local.pop(pylons_obj)
+            pylons.session._pop_object('registered')
@@ -5,6 +5,7 @@ from webob.exc import status_map
 
 import pylons
 from pylons.controllers import WSGIController
+from pylons.controllers.dispatch import dispatch_table
 
 from pylons.testutil import SetupCacheGlobal, ControllerWrap
 from __init__ import TestWSGIController, TestMiddleware
@@ -57,6 +58,30 @@ class BasicWSGIController(WSGIController):
     def list(self):
         return ['from', ' a ', 'list']
 
+    def with_dashes(self):
+        return 'dashed action'
+
+    def with_args(self, id, environ):
+        return 'id is %s' % id
+
+    def yield_unicode(self):
+        def its():
+            yield u'caf\xe9 '
+            yield 'bytes '
+            yield u'\u2603'
+        return its()
+
+    def unicode_list(self):
+        return [u'caf\xe9', ' ', 'list']
+
+    def written_string(self):
+        pylons.response.write('written ')
+        return 'more'
+
+    def written_unicode(self):
+        pylons.response.write('written ')
+        return u'caf\xe9'
+
 class FilteredWSGIController(WSGIController):
     def __init__(self):
         self.before = 0
@@ -170,6 +195,129 @@ class TestBasicWSGI(TestWSGIController):
         self.baseenviron['pylons.routes_dict']['action'] = 'list'
         assert 'from a list' in self.app.get('/')
 
+    def test_yield_unicode(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'yield_unicode'
+        resp = self.app.get('/')
+        assert resp.body == u'caf\xe9 bytes \u2603'.encode('utf-8')
+
+    def test_unicode_list(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'unicode_list'
+        resp = self.app.get('/')
+        assert resp.body == u'caf\xe9 list'.encode('utf-8')
+
+    def test_written_unicode(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'written_unicode'
+        resp = self.app.get('/')
+        assert resp.body == u'written caf\xe9'.encode('utf-8')
+        assert resp.header('Content-Length') == str(len(resp.body))
+
+    def test_written_string(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'written_string'
+        resp = self.app.get('/')
+        assert resp.body == 'written more'
+        assert resp.header('Content-Length') == '12'
+
+    def test_dashed_action(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'with-dashes'
+        assert 'dashed action' in self.app.get('/')
+
+    def test_action_args(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'with_args'
+        self.baseenviron['pylons.routes_dict']['id'] = '42'
+        try:
+            assert 'id is 42' in self.app.get('/')
+        finally:
+            del self.baseenviron['pylons.routes_dict']['id']
+
+    def test_instance_action(self):
+        class InstanceActionController(BasicWSGIController):
+            def __init__(self):
+                self.dynamic = lambda: 'dynamic action'
+        app = SetupCacheGlobal(ControllerWrap(InstanceActionController),
+                               self.baseenviron)
+        app = TestApp(RegistryManager(app))
+        self.baseenviron['pylons.routes_dict']['action'] = 'dynamic'
+        assert 'dynamic action' in app.get('/')
+
+
+class TestDispatchTable(object):
+    def test_compiled_actions(self):
+        table = dispatch_table(BasicWSGIController)
+        assert 'index' in table.actions
+        assert 'start_response' not in table.actions
+        assert '__before__' not in table.actions
+        assert table.has_before and table.has_after
+        record = table.lookup('with-args')
+        assert record.name == 'with_args'
+        assert record.argnames == ('id', 'environ')
+        assert not record.varkw
+        assert table.lookup('notthere') is None
+
+    def test_subclass_table(self):
+        class SubController(FilteredWSGIController):
+            def extra(self, **kwargs):
+                pass
+        parent = dispatch_table(FilteredWSGIController)
+        table = dispatch_table(SubController)
+        assert table is not parent
+        assert table is dispatch_table(SubController)
+        assert 'extra' in table.actions and 'extra' not in parent.actions
+        assert table.actions['extra'].varkw
+
+
+class TestAppendBody(object):
+    def test_append(self):
+        from webob import Response
+        from pylons.controllers.core import _append_body
+        response = Response()
+        _append_body(response, 'first')
+        app_iter = response.app_iter
+        _append_body(response, u' caf\xe9')
+        assert response.app_iter is app_iter
+        assert app_iter == ['first', ' caf\xc3\xa9']
+        assert response.content_length == 11
+
+    def test_iterator(self):
+        from webob import Response
+        from pylons.controllers.core import _append_body
+        response = Response(app_iter=iter(['streamed']))
+        _append_body(response, ' more')
+        assert response.body == 'streamed more'
+
+
+class TestEncodedAppIter(object):
+    def test_stateful_encoding(self):
+        from pylons.controllers.util import EncodedAppIter
+        chunks = list(EncodedAppIter([u'one', u'two'], 'utf-16'))
+        assert ''.join(chunks).decode('utf-16') == u'onetwo'
+        # Only the first chunk has a byte order mark
+        assert len(chunks[1]) == 6
+
+    def test_close(self):
+        from pylons.controllers.util import EncodedAppIter
+        closed = []
+        def chunks():
+            try:
+                yield u'one'
+                yield u'two'
+            finally:
+                closed.append(True)
+        app_iter = EncodedAppIter(chunks(), 'utf-8')
+        assert iter(app_iter).next() == 'one'
+        app_iter.close()
+        assert closed == [True]
+
+    def test_no_charset(self):
+        from pylons.controllers.util import EncodedAppIter
+        assert list(EncodedAppIter(['bytes'], None)) == ['bytes']
+        try:
+            list(EncodedAppIter([u'text'], None))
+        except TypeError:
+            pass
+        else:
+            assert False, 'TypeError not raised'
+
+
 class TestFilteredWSGI(TestWSGIController):
     def __init__(self, *args, **kargs):
         TestWSGIController.__init__(self, *args, **kargs)
@@ -1,6 +1,7 @@
 import os
 import shutil
 import time
+from datetime import datetime
 
 from webtest import TestApp
 from paste.registry import RegistryManager
@@ -15,7 +16,9 @@ sap = None
 def make_cache_controller():
     global sap
     import pylons
-    from pylons.decorators.cache import beaker_cache, create_cache_key
+    from pylons.controllers.util import abort
+    from pylons.decorators.cache import beaker_cache, cache_control, \
+        conditional, create_cache_key
 
     from pylons.controllers import WSGIController, XMLRPCController
     from pylons.testutil import SetupCacheGlobal, ControllerWrap
@@ -104,6 +107,81 @@ def make_cache_controller():
         @beaker_cache(query_args=True)
         def test_cache_key_dupe(self):
             return "Hello folks, time is %s" % time.time()
+
+        @beaker_cache(query_args=True, type='memory', version=2)
+        def test_long_key_cache_decorator(self):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s' % pylons.app_globals.counter
+
+        @beaker_cache(key="id", tags=['products', 'product-%(id)s'])
+        def test_tagged_cache_decorator(self, id):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s, id=%s' % (pylons.app_globals.counter, id)
+
+        @beaker_cache(key="id", type='dbm',
+                      tags=lambda self, id: ['product-%s' % id])
+        def test_tagged_dbm_cache_decorator(self, id):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s, id=%s' % (pylons.app_globals.counter, id)
+
+        @beaker_cache(key="id", tags=['product-%(id)s'])
+        def test_tagged_invalidated_while_cached(self, id):
+            from pylons.decorators.cache import invalidate_tags
+            pylons.app_globals.counter += 1
+            # The product changes while its page is made
+            invalidate_tags('product-%s' % id)
+            return 'Counter=%s, id=%s' % (pylons.app_globals.counter, id)
+
+        def test_invalidate_tags(self, tag, type=None):
+            from pylons.decorators.cache import invalidate_tags
+            return str(invalidate_tags(tag, type=type))
+
+        @beaker_cache(key="id", type='lru', lru_store='test_decorator')
+        def test_lru_cache_decorator(self, id):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s, id=%s' % (pylons.app_globals.counter, id)
+
+        @conditional(etag=lambda self, id: 'v%s' % id)
+        def test_conditional_decorator(self, id):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s, id=%s' % (pylons.app_globals.counter, id)
+
+        @conditional(last_modified=lambda self: datetime(2015, 7, 21, 12))
+        def test_conditional_last_modified(self):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s' % pylons.app_globals.counter
+
+        @cache_control(public=True, max_age=60, vary='Accept-Language')
+        def test_cache_control(self, status=None):
+            if status:
+                abort(int(status))
+            return 'Hello'
+
+        @cache_control(public=True, s_maxage=300, stale_while_revalidate=30)
+        @beaker_cache(key=None)
+        def test_cache_control_beaker(self):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s' % pylons.app_globals.counter
+
+        @beaker_cache(key=None)
+        @cache_control(private=True, max_age=10)
+        def test_cache_control_beaker_inner(self):
+            pylons.app_globals.counter += 1
+            return 'Counter=%s' % pylons.app_globals.counter
+
+        @conditional(etag=lambda self: 'v1')
+        @cache_control(public=True, max_age=60)
+        def test_cache_control_conditional(self):
+            return 'Hello'
+
+        @cache_control(public=True, max_age=60)
+        def test_cache_control_manual(self):
+            pylons.response.headers['Cache-Control'] = 'max-age=5'
+            pylons.response.headers['Vary'] = 'Cookie'
+            return 'Hello'
+
+        def test_cache_control_route(self):
+            return 'Hello'
     
     app = ControllerWrap(CacheController)
     app = sap = SetupCacheGlobal(app, environ, setup_cache=True)
@@ -282,3 +360,547 @@ class TestCacheDecorator(TestWSGIController):
         response = self.get_response(action='test_default_cache_decorator')
         assert 'Counter=2' in response
         pylons.config['cache_enabled'] = 'True'
+
+    def test_lru_cache_decorator(self):
+        from pylons.lrucache import get_store
+        sap.g.counter = 0
+        store = get_store('test_decorator')
+        store.clear()
+        response = self.get_response(action='test_lru_cache_decorator', id=1)
+        assert 'Counter=1, id=1' in response
+        response = self.get_response(action='test_lru_cache_decorator', id=1)
+        assert 'Counter=1, id=1' in response
+        response = self.get_response(action='test_lru_cache_decorator', id=2)
+        assert 'Counter=2, id=2' in response
+        assert store.stats()['entries'] == 2
+
+
+    def test_long_key_cache_decorator(self):
+        from pylons.decorators.cache import MAX_KEY_LENGTH, make_cache_key
+        sap.g.counter = 0
+        url = '/?q=%s&a=1' % ('x' * 300)
+        response = self.get_response(action='test_long_key_cache_decorator',
+                                     _url=url)
+        assert 'Counter=1' in response
+        response = self.get_response(action='test_long_key_cache_decorator',
+                                     _url='/?a=1&q=%s' % ('x' * 300))
+        assert 'Counter=1' in response
+        namespace = '%s.CacheController@2' % self.__module__
+        key = make_cache_key('test_long_key_cache_decorator',
+                             dict(q='x' * 300, a='1'), namespace)
+        assert len(namespace) + len(key) < MAX_KEY_LENGTH
+        assert key.startswith('test_long_key_cache_decorator #')
+
+
+    def test_tagged_cache_decorator(self):
+        sap.g.counter = 0
+        self.get_response(action='test_invalidate_tags', tag='products')
+        for id in (1, 2, 1, 2):
+            response = self.get_response(action='test_tagged_cache_decorator',
+                                         id=id)
+        assert 'Counter=2, id=2' in response
+        response = self.get_response(action='test_invalidate_tags',
+                                     tag='product-1')
+        assert response.body == '1'
+        response = self.get_response(action='test_tagged_cache_decorator',
+                                     id=1)
+        assert 'Counter=3, id=1' in response
+        response = self.get_response(action='test_tagged_cache_decorator',
+                                     id=2)
+        assert 'Counter=2, id=2' in response
+        response = self.get_response(action='test_invalidate_tags',
+                                     tag='products')
+        assert response.body == '2'
+        response = self.get_response(action='test_tagged_cache_decorator',
+                                     id=2)
+        assert 'Counter=4, id=2' in response
+
+    def test_tagged_invalidated_while_cached(self):
+        sap.g.counter = 0
+        for counter in (1, 2):
+            response = self.get_response(
+                action='test_tagged_invalidated_while_cached', id=7)
+            assert 'Counter=%s, id=7' % counter in response
+
+    def test_tagged_dbm_cache_decorator(self):
+        sap.g.counter = 0
+        self.get_response(action='test_invalidate_tags', tag='product-5',
+                          type='dbm')
+        response = self.get_response(action='test_tagged_dbm_cache_decorator',
+                                     id=5)
+        assert 'Counter=1, id=5' in response
+        response = self.get_response(action='test_tagged_dbm_cache_decorator',
+                                     id=5)
+        assert 'Counter=1, id=5' in response
+        # The index is kept per cache type
+        response = self.get_response(action='test_invalidate_tags',
+                                     tag='product-5', type=None)
+        assert response.body == '0'
+        response = self.get_response(action='test_invalidate_tags',
+                                     tag='product-5', type='dbm')
+        assert response.body == '1'
+        response = self.get_response(action='test_tagged_dbm_cache_decorator',
+                                     id=5)
+        assert 'Counter=2, id=5' in response
+
+
+    def test_conditional_decorator(self):
+        sap.g.counter = 0
+        response = self.get_response(action='test_conditional_decorator',
+                                     id=1)
+        assert 'Counter=1, id=1' in response
+        assert response.headers['ETag'] == '"v1"'
+        response = self.get_response(
+            action='test_conditional_decorator', id=1,
+            test_args=dict(headers={'If-None-Match': '"v1"'}, status=304))
+        assert response.body == ''
+        assert response.headers['ETag'] == '"v1"'
+        assert 'Content-Type' not in response.headers
+        assert sap.g.counter == 1
+        response = self.get_response(
+            action='test_conditional_decorator', id=2,
+            test_args=dict(headers={'If-None-Match': '"v1"'}))
+        assert 'Counter=2, id=2' in response
+
+    def test_conditional_last_modified(self):
+        sap.g.counter = 0
+        response = self.get_response(action='test_conditional_last_modified')
+        assert 'Counter=1' in response
+        last_modified = response.headers['Last-Modified']
+        assert last_modified == 'Tue, 21 Jul 2015 12:00:00 GMT'
+        self.get_response(
+            action='test_conditional_last_modified',
+            test_args=dict(headers={'If-Modified-Since': last_modified},
+                           status=304))
+        assert sap.g.counter == 1
+        response = self.get_response(
+            action='test_conditional_last_modified',
+            test_args=dict(headers={
+                    'If-Modified-Since': 'Tue, 21 Jul 2015 11:59:59 GMT'}))
+        assert 'Counter=2' in response
+        # POSTs always run the action
+        response = self.post_response(action='test_conditional_last_modified')
+        assert 'Counter=3' in response
+
+    def test_cache_control(self):
+        response = self.get_response(action='test_cache_control')
+        assert response.headers['Cache-Control'] == 'public, max-age=60'
+        assert response.headers['Vary'] == 'Accept-Language'
+        assert 'Pragma' not in response.headers
+        # Errors keep the default headers
+        response = self.get_response(action='test_cache_control', status=404,
+                                     test_args=dict(status=404))
+        assert response.headers['Cache-Control'] == 'no-cache'
+
+    def test_cache_control_beaker(self):
+        sap.g.counter = 0
+        self.get_response(action='test_invalidate_cache')
+        for action in ('test_cache_control_beaker',
+                       'test_cache_control_beaker_inner'):
+            for i in range(2):
+                response = self.get_response(action=action)
+                assert 'Pragma' not in response.headers
+        assert 'Counter=2' in response
+        assert response.headers['Cache-Control'] == 'private, max-age=10'
+        response = self.get_response(action='test_cache_control_beaker')
+        assert response.headers['Cache-Control'] == \
+            'public, s-maxage=300, stale-while-revalidate=30'
+
+    def test_cache_control_not_modified(self):
+        response = self.get_response(
+            action='test_cache_control_conditional',
+            test_args=dict(headers={'If-None-Match': '"v1"'}, status=304))
+        assert response.headers['Cache-Control'] == 'public, max-age=60'
+        assert 'Pragma' not in response.headers
+
+    def test_cache_control_manual(self):
+        response = self.get_response(action='test_cache_control_manual')
+        assert response.headers['Cache-Control'] == 'max-age=5'
+        assert response.headers['Vary'] == 'Cookie'
+
+    def test_cache_control_route(self):
+        import pylons
+        policies = pylons.config['pylons.cache_policies']
+        policies['test'] = dict(public=True, max_age=5, vary=['Cookie'])
+        try:
+            response = self.get_response(action='test_cache_control_route')
+            assert response.headers['Cache-Control'] == 'no-cache'
+            response = self.get_response(action='test_cache_control_route',
+                                         cache_policy=u'test')
+            assert response.headers['Cache-Control'] == 'public, max-age=5'
+            assert response.headers['Vary'] == 'Cookie'
+            # The route's policy takes precedence
+            response = self.get_response(action='test_cache_control')
+            assert response.headers['Cache-Control'] == 'public, max-age=5'
+            self.assertRaises(KeyError, self.get_response,
+                              action='test_cache_control', cache_policy='x')
+        finally:
+            del policies['test']
+
+
+class TestCachePolicy(object):
+    def test_directives(self):
+        from pylons.controllers.util import CachePolicy
+        policy = CachePolicy(max_age=0, no_store=True, must_revalidate=True,
+                             stale_if_error=600)
+        assert policy.cache_control == \
+            'no-store, must-revalidate, max-age=0, stale-if-error=600'
+
+    def test_public_and_private(self):
+        from pylons.controllers.util import CachePolicy
+        try:
+            CachePolicy(public=True, private=True)
+        except ValueError:
+            pass
+        else:
+            assert False, 'ValueError not raised'
+
+    def test_vary_merged(self):
+        from webob import Response
+        from pylons.controllers.util import CachePolicy
+        response = Response()
+        response.headers['Vary'] = 'Cookie, accept-language'
+        CachePolicy(private=True, vary=('Accept-Language', 'Accept')).apply(
+            response)
+        assert response.headers['Vary'] == 'Cookie, accept-language, Accept'
+        assert response.headers['Cache-Control'] == 'private'
+
+class TestMakeCacheKey(object):
+    def test_sorted(self):
+        from pylons.decorators.cache import make_cache_key
+        assert make_cache_key('f', dict(b=2, a=1)) == 'f a=1 b=2'
+        assert make_cache_key('f', dict(a=1, b=2)) == 'f a=1 b=2'
+        assert make_cache_key('f', dict(a=dict(y=[1, 2], x=None))) == \
+            'f a={x: None, y: [1, 2]}'
+        assert make_cache_key('f') == 'f'
+
+    def test_digest(self):
+        from pylons.decorators.cache import make_cache_key
+        key = make_cache_key('f', dict(q='x' * 300), 'namespace')
+        assert key == make_cache_key('f', dict(q='x' * 300), 'namespace')
+        assert key != make_cache_key('f', dict(q='x' * 301), 'namespace')
+        assert key.startswith('f #') and len(key) == 43
+        assert make_cache_key('f', dict(q='x' * 230)) == \
+            'f q=' + 'x' * 230
+        assert make_cache_key('f', dict(q='x' * 230), 'n' * 30) != \
+            'f q=' + 'x' * 230
+
+    def test_unsafe_characters(self):
+        from pylons.decorators.cache import make_cache_key
+        assert make_cache_key('f', dict(q=u'caf\xe9')).startswith('f #')
+        assert make_cache_key('f', dict(q='a\nb')).startswith('f #')
+        assert len(make_cache_key(u'caf\xe9')) == 40
+
+    def test_create_cache_key_version(self):
+        from pylons.decorators.cache import create_cache_key
+        def func():
+            pass
+        assert create_cache_key(func, dict(a=1), version='v2') == \
+            ('%s@v2' % __name__, 'func a=1')
+
+    def test_argspec_computed_once(self):
+        import inspect
+        from pylons.decorators.cache import beaker_cache
+        from pylons.decorators import cache as cache_module
+        calls = []
+        def getargspec(func):
+            calls.append(func)
+            return inspect.getargspec(func)
+        cache_module.inspect = type('inspect', (), dict(
+                getargspec=staticmethod(getargspec)))
+        try:
+            @beaker_cache()
+            def func(a, b=1):
+                return a + b
+        finally:
+            cache_module.inspect = inspect
+        assert len(calls) == 1
+
+
+class TestInvalidation(object):
+    """invalidate_tags and invalidate_namespace on each backend"""
+    def _manager(self, type):
+        from beaker.cache import CacheManager
+        return CacheManager(type=type, data_dir=cache_dir,
+                            lru_store='test_invalidation')
+
+    def _populate(self, cache):
+        from pylons.decorators.cache import _tag_value
+        for namespace in ('one', 'two'):
+            ns_cache = cache.get_cache(namespace)
+            for i in range(10):
+                key = 'key %d' % i
+                ns_cache.put(key, i)
+                tags = ['all', 'even' if i % 2 == 0 else 'odd']
+                _tag_value(cache, {}, tags, namespace, key)
+
+    def _clear(self, cache):
+        from pylons.decorators.cache import invalidate_tags
+        for namespace in ('one', 'two'):
+            cache.get_cache(namespace).clear()
+        invalidate_tags(['all', 'even', 'odd'], cache=cache)
+
+    def _check_backend(self, type):
+        from pylons.decorators.cache import invalidate_namespace, \
+            invalidate_tags
+        cache = self._manager(type)
+        self._clear(cache)
+        self._populate(cache)
+        assert invalidate_tags('even', cache=cache) == 10
+        one = cache.get_cache('one')
+        assert 'key 0' not in one and 'key 1' in one
+        assert invalidate_tags('even', cache=cache) == 0
+        assert invalidate_tags(['odd', 'missing'], cache=cache) == 10
+        assert 'key 1' not in one
+
+        self._populate(cache)
+        invalidate_namespace('one', cache=cache)
+        assert 'key 1' not in cache.get_cache('one')
+        assert 'key 1' in cache.get_cache('two')
+        # Values that are already gone are skipped
+        assert invalidate_tags('all', cache=cache) == 10
+
+    def test_lru_eviction(self):
+        from pylons.decorators.cache import invalidate_tags
+        from pylons.lrucache import get_store
+        store = get_store('test_invalidation_small', max_entries=5)
+        store.clear()
+        cache = self._manager('lru')
+        cache.kwargs['lru_store'] = 'test_invalidation_small'
+        self._clear(cache)
+        self._populate(cache)
+        # Only the last 5 values are left, the index wasn't evicted
+        assert len(store) == 5
+        one, two = cache.get_cache('one'), cache.get_cache('two')
+        assert 'key 9' in two and 'key 4' not in two
+        assert invalidate_tags('even', cache=cache) == 2
+        assert 'key 8' not in two and 'key 9' in two
+        assert invalidate_tags('all', cache=cache) == 3
+        assert len(store) == 0
+
+    def test_tag_buckets(self):
+        from pylons.decorators.cache import TAG_BUCKETS, _tag_index
+        cache = self._manager('file')
+        self._clear(cache)
+        self._populate(cache)
+        tags = ['product-%d' % i for i in range(20)] + ['all', 'even']
+        namespaces = set(_tag_index(cache, {}, tag)[0].namespace
+                         for tag in tags)
+        assert 1 < len(namespaces) <= TAG_BUCKETS
+        index, lock, tag = _tag_index(cache, {}, 'even')
+        assert _tag_index(cache, {}, 'even')[1] is lock
+        index.acquire_read_lock()
+        try:
+            assert sorted(index['even']) == ['one', 'two']
+            assert 'odd' not in index or \
+                _tag_index(cache, {}, 'odd')[0].namespace == index.namespace
+        finally:
+            index.release_read_lock()
+
+    def _check_prune(self, type):
+        from pylons.decorators.cache import invalidate_tags, prune_tags
+        cache = self._manager(type)
+        self._clear(cache)
+        self._populate(cache)
+        assert len(self._tagged(cache, 'all')['one']) == 10
+        one = cache.get_cache('one')
+        for i in range(10):
+            one.remove_value('key %d' % i)
+        for i in range(5):
+            cache.get_cache('two').remove_value('key %d' % i)
+        assert prune_tags(['all', 'missing'], cache=cache) == 15
+        tagged = self._tagged(cache, 'all')
+        assert 'one' not in tagged
+        assert sorted(tagged['two']) == ['key %d' % i for i in range(5, 10)]
+        assert prune_tags('all', cache=cache) == 0
+        assert prune_tags('even', cache=cache) == 8
+        assert sorted(self._tagged(cache, 'even')['two']) == ['key 6',
+                                                              'key 8']
+        assert invalidate_tags('all', cache=cache) == 5
+        # Tags left without keys are dropped
+        assert prune_tags('odd', cache=cache) == 10
+        assert self._tagged(cache, 'odd') is None
+
+    def _tagged(self, cache, tag):
+        from pylons.decorators.cache import _tag_index
+        index, lock, tag = _tag_index(cache, {}, tag)
+        index.acquire_read_lock()
+        try:
+            if tag in index:
+                return index[tag]
+        finally:
+            index.release_read_lock()
+
+    def test_prune(self):
+        self._check_prune('memory')
+
+    def test_prune_file(self):
+        self._check_prune('file')
+
+    def test_prune_dbm(self):
+        self._check_prune('dbm')
+
+    def test_memory(self):
+        self._check_backend('memory')
+
+    def test_lru(self):
+        self._check_backend('lru')
+
+    def test_file(self):
+        self._check_backend('file')
+
+    def test_dbm(self):
+        self._check_backend('dbm')
+
+    def test_invalidate_namespace_version(self):
+        from pylons.decorators.cache import create_cache_key, \
+            invalidate_namespace
+        cache = self._manager('memory')
+        def func():
+            pass
+        namespace, key = create_cache_key(func, version=3)
+        cache.get_cache(namespace).put(key, 'value')
+        invalidate_namespace(func, version=2, cache=cache)
+        assert key in cache.get_cache(namespace)
+        invalidate_namespace(func, version=3, cache=cache)
+        assert key not in cache.get_cache(namespace)
+
+
+class TestLRUCache(object):
+    def setUp(self):
+        from pylons.lrucache import get_store
+        self.store = get_store('test_lru', max_entries=3, max_bytes=10000)
+        self.store.clear()
+        self.store.reset_stats()
+
+    def _cache(self, namespace='ns'):
+        from beaker.cache import Cache
+        return Cache(namespace, type='lru', lru_store='test_lru')
+
+    def test_max_entries(self):
+        cache = self._cache()
+        for key in 'abcd':
+            cache.put(key, key.upper())
+        assert len(self.store) == 3
+        assert 'a' not in cache
+        assert cache.get('d') == 'D'
+        assert self.store.stats()['evictions'] == 1
+
+    def test_least_recently_used_evicted(self):
+        cache = self._cache()
+        for key in 'abc':
+            cache.put(key, key.upper())
+        cache.get('a')
+        cache.put('d', 'D')
+        assert 'a' in cache
+        assert 'b' not in cache
+
+    def test_max_bytes(self):
+        cache = self._cache()
+        cache.put('big', 'x' * 9000)
+        cache.put('small', 'x' * 100)
+        cache.put('other', 'x' * 2000)
+        assert 'big' not in cache
+        assert 'small' in cache
+        assert self.store.bytes <= 10000
+        # Too big to be cached at all
+        cache.put('huge', 'x' * 20000)
+        assert 'huge' not in cache
+        assert 'other' in cache
+
+    def test_value_size(self):
+        from pylons.lrucache import LRUStore
+        store = LRUStore(max_entries=10)
+        value = dict(content='x' * 1000)
+        store.set('ns', 'str', (0, None, 'x' * 1000))
+        store.set('ns', 'unicode', u'\xe9' * 10)
+        assert store.bytes == 1010
+        # Only pickled with a byte limit
+        store.set('ns', 'dict', value)
+        assert store.bytes < 2000
+        store = LRUStore(max_entries=10, max_bytes=10000)
+        store.set('ns', 'dict', value)
+        assert store.bytes > 1000
+
+    def test_namespaces(self):
+        one, two = self._cache('one'), self._cache('two')
+        one.put('key', 1)
+        two.put('key', 2)
+        assert one.get('key') == 1 and two.get('key') == 2
+        one.clear()
+        assert 'key' not in one
+        assert two.get('key') == 2
+        assert self._cache('two').namespace.keys() == ['key']
+        assert 'one' not in self.store._namespaces
+        # Or evicted
+        for key in 'abc':
+            self._cache('three').put(key, key)
+        assert self.store._namespaces.keys() == ['three']
+
+    def test_stats(self):
+        cache = self._cache()
+        calls = []
+        def create():
+            calls.append(1)
+            return 'value'
+        for i in range(3):
+            assert cache.get('key', createfunc=create) == 'value'
+        stats = self.store.stats()
+        assert len(calls) == 1
+        assert stats['misses'] == 1
+        assert stats['hits'] >= 2
+
+    def test_stats_count_failed_lookups(self):
+        cache = self._cache()
+        for key in 'abcde':
+            cache.get(key, createfunc=lambda: key)
+        # Writes that didn't follow a lookup aren't misses
+        cache.put('f', 'F')
+        self.store.set('other', 'key', 'value')
+        assert self.store.stats()['misses'] == 5
+        try:
+            self.store.get('other', 'missing')
+        except KeyError:
+            pass
+        else:
+            assert False, 'KeyError not raised'
+        assert self.store.stats()['misses'] == 6
+
+    def test_stats_threads(self):
+        import threading
+        cache = self._cache()
+        cache.put('key', 'value')
+        def get():
+            for i in range(500):
+                cache.get('key')
+        threads = [threading.Thread(target=get) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert self.store.stats()['hits'] == 4000
+
+    def test_stale_served_during_regeneration(self):
+        import threading
+        cache = self._cache()
+        calls = []
+        def create():
+            calls.append(1)
+            time.sleep(0.3)
+            return len(calls)
+        assert cache.get('key', createfunc=create, expiretime=0.1) == 1
+        time.sleep(0.2)
+        results = []
+        def get():
+            results.append(cache.get('key', createfunc=create,
+                                     expiretime=0.1))
+        threads = [threading.Thread(target=get) for i in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # A single thread regenerated the value, the others were served
+        # the expired one meanwhile
+        assert len(calls) == 2
+        assert sorted(results) == [1] * 9 + [2]
+        assert self.store.stats()['stale_hits'] >= 9
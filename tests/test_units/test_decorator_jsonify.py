@@ -24,6 +24,14 @@ def make_cache_controller_app():
         def test_good_json(self):
             return dict(fred=42)
 
+        @jsonify(stream=True)
+        def test_stream_json(self):
+            return dict(items=(dict(id=i) for i in xrange(2000)))
+
+        @jsonify(stream=True)
+        def test_stream_array_warning(self):
+            return (i for i in xrange(3))
+
     environ = {}
     app = ControllerWrap(CacheController)
     app = sap = SetupCacheGlobal(app, environ)
@@ -53,3 +61,34 @@ class TestJsonifyDecorator(TestWSGIController):
         response = self.get_response(action='test_good_json')
         assert '{"fred": 42}' in response
         assert response.header('Content-Type') == 'application/json; charset=utf-8'
+
+    def test_stream_json(self):
+        import simplejson
+        from pylons.decorators import JSON_CHUNK_SIZE
+        response = self.get_response(action='test_stream_json')
+        assert response.header('Content-Type') == 'application/json; charset=utf-8'
+        data = simplejson.loads(response.body)
+        assert data['items'][1999] == dict(id=1999)
+        assert len(response.body) > JSON_CHUNK_SIZE
+
+    def test_stream_chunks(self):
+        import simplejson
+        from pylons.decorators import _iter_json
+        data = dict(items=[[i, str(i)] for i in range(1000)],
+                    nested=dict(rows=(dict(id=i) for i in range(250))),
+                    empty=[], scalar=1)
+        chunks = list(_iter_json(data, 100))
+        assert len(chunks) > 1
+        assert all(len(chunk) < 2000 for chunk in chunks)
+        assert simplejson.loads(''.join(chunks)) == dict(
+            items=[[i, str(i)] for i in range(1000)],
+            nested=dict(rows=[dict(id=i) for i in range(250)]),
+            empty=[], scalar=1)
+
+    def test_stream_array_warning(self):
+        try:
+            response = self.get_response(action='test_stream_array_warning')
+        except Warning, msg:
+            assert 'JSON responses with Array envelopes are' in msg[0]
+        else:
+            assert False, 'Warning not raised'
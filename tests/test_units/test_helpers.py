@@ -18,6 +18,10 @@ def make_helperscontroller():
         def test_etag_cache(self):
             etag_cache('test')
             return "from etag_cache"
+
+        def test_etag_cache_modified(self):
+            etag_cache(last_modified=1437480000)
+            return "from etag_cache"
     return HelpersController
 
 class TestHelpers(TestWSGIController):
@@ -44,3 +48,98 @@ class TestHelpers(TestWSGIController):
         response = self.app.get('/')
         assert '"test"' == response.header('Etag')
         assert 'from etag_cache' in response
+
+    def test_etag_cache_not_modified(self):
+        self.baseenviron['pylons.routes_dict']['action'] = 'test_etag_cache'
+        for header in ('"test"', 'W/"test"', '"other", "test"', '*'):
+            response = self.app.get('/', headers={'If-None-Match': header},
+                                    status=304)
+            assert '"test"' == response.header('Etag')
+            assert not response.body
+        response = self.app.get('/', headers={'If-None-Match': '"other"'})
+        assert 'from etag_cache' in response
+
+    def test_etag_cache_last_modified(self):
+        self.baseenviron['pylons.routes_dict']['action'] = \
+            'test_etag_cache_modified'
+        response = self.app.get('/')
+        last_modified = response.header('Last-Modified')
+        assert last_modified == 'Tue, 21 Jul 2015 12:00:00 GMT'
+        self.app.get('/', headers={'If-Modified-Since': last_modified},
+                     status=304)
+        response = self.app.get('/', headers={
+                'If-Modified-Since': 'Tue, 21 Jul 2015 11:00:00 GMT'})
+        assert 'from etag_cache' in response
+        # If-None-Match takes precedence
+        response = self.app.get('/', headers={
+                'If-Modified-Since': last_modified, 'If-None-Match': '"x"'})
+        assert 'from etag_cache' in response
+
+
+class TestSignedCookie(TestCase):
+    def _roundtrip(self, data, secret='secret', read_secret=None, **kwargs):
+        from pylons.controllers.util import Request, Response
+        response = Response()
+        response.signed_cookie('session', data, secret, **kwargs)
+        cookie = response.headers['Set-Cookie'].split(';')[0]
+        request = Request.blank('/', headers={'Cookie': cookie})
+        return request.signed_cookie('session', read_secret or secret,
+                                     codec=kwargs.get('codec'))
+
+    def test_roundtrip(self):
+        data = {'user': u'caf\xe9', 'ids': [1, 2], 'admin': False}
+        assert self._roundtrip(data) == data
+
+    def test_not_json(self):
+        from datetime import datetime
+        self.assertRaises(TypeError, self._roundtrip, datetime.now())
+
+    def test_bad_signature(self):
+        from pylons.controllers.util import SignedCookieCodec
+        codec = SignedCookieCodec('secret')
+        value = codec.dumps({'user': 'bob'}, 'session')
+        assert codec.loads(value, 'session') == {'user': 'bob'}
+        assert codec.loads(value, 'other') is None
+        assert SignedCookieCodec('other').loads(value, 'session') is None
+        data, sig = value.split('.')
+        tampered = codec.dumps({'user': 'alice'}).split('.')[0]
+        assert codec.loads('%s.%s' % (tampered, sig), 'session') is None
+        for bad in ('', '.', 'abc', 'a.b', 'a.!!!', value + 'x'):
+            assert codec.loads(bad, 'session') is None
+
+    def test_key_rotation(self):
+        assert self._roundtrip([1], 'old', ['new', 'old']) == [1]
+        assert self._roundtrip([1], ['new', 'old'], 'new') == [1]
+        assert self._roundtrip([1], 'old', ['new']) is None
+
+    def test_compression(self):
+        from pylons.controllers.util import SignedCookieCodec
+        data = {'items': ['item %d' % (i % 10) for i in range(100)]}
+        compressed = SignedCookieCodec('secret').dumps(data)
+        plain = SignedCookieCodec('secret', compress_threshold=None).dumps(
+            data)
+        assert compressed.startswith('.')
+        assert len(compressed) < len(plain) / 4
+        assert SignedCookieCodec('secret').loads(compressed) == data
+        assert SignedCookieCodec('secret').loads(plain) == data
+
+    def test_serializer(self):
+        import pickle
+        from pylons.controllers.util import SignedCookieCodec
+        codec = SignedCookieCodec('secret', serializer=pickle)
+        assert self._roundtrip((1, 'a'), codec=codec) == (1, 'a')
+
+    def test_legacy(self):
+        import base64
+        import hmac
+        import pickle
+        from hashlib import sha1
+        from pylons.controllers.util import Request
+        pickled = pickle.dumps({'user': 'bob'}, pickle.HIGHEST_PROTOCOL)
+        cookie = hmac.new('secret', pickled, sha1).hexdigest() + \
+            base64.standard_b64encode(pickled)
+        request = Request.blank('/', headers={'Cookie': 'session=' + cookie})
+        assert request.signed_cookie('session', 'secret') is None
+        assert request.signed_cookie('session', 'secret',
+                                     legacy=True) == {'user': 'bob'}
+        assert request.signed_cookie('session', 'other', legacy=True) is None
@@ -55,3 +55,78 @@ class TestI18N(object):
         pylons.translator._push_object(t)
         assert Bar().local_foo == u'¡Hola!'
         assert foo == 'Hello'
+
+
+class TestTranslatorCache(object):
+    def setUp(self):
+        from pylons.i18n.translation import clear_translator_cache
+        setup_py_trans()
+        clear_translator_cache()
+
+    def test_cached_copies(self):
+        from pylons.i18n.translation import _get_translator, translator_cache
+        first = _get_translator('fr', pylons_config=lang_setup)
+        second = _get_translator('fr', pylons_config=lang_setup)
+        assert first is not second
+        assert first._catalog is second._catalog
+        assert len(translator_cache._translators) == 1
+        assert second.ugettext('Hello') == 'Bonjour'
+
+    def test_fallbacks_not_shared(self):
+        from pylons.i18n.translation import _get_translator
+        first = _get_translator('fr', pylons_config=lang_setup)
+        first.add_fallback(_get_translator('es', pylons_config=lang_setup))
+        second = _get_translator('fr', pylons_config=lang_setup)
+        assert getattr(second, '_fallback', None) is None
+
+    def test_language_error_cached(self):
+        from pylons.i18n.translation import (_get_translator, LanguageError,
+                                             translator_cache)
+        for i in range(2):
+            try:
+                _get_translator('xx', pylons_config=lang_setup)
+            except LanguageError:
+                pass
+            else:
+                assert False, 'LanguageError not raised'
+        assert len(translator_cache._translators) == 1
+
+    def test_keyed_by_catalogs(self):
+        from pylons.i18n.translation import (_get_translator, LanguageError,
+                                             translator_cache)
+        for lang in ('fr', ['fr', 'xx'], ['xx', 'fr']):
+            assert _get_translator(lang, pylons_config=lang_setup).ugettext(
+                'Hello') == 'Bonjour'
+        # Languages without a catalog share the failed lookup
+        for lang in ('xx', 'yy', ['zz', 'xx']):
+            try:
+                _get_translator(lang, pylons_config=lang_setup)
+            except LanguageError:
+                pass
+            else:
+                assert False, 'LanguageError not raised'
+        assert len(translator_cache._translators) == 2
+        assert len(translator_cache._catalogs) == 6
+
+    def test_size_option(self):
+        from pylons.i18n.translation import _get_translator, translator_cache
+        conf = dict(lang_setup, **{'pylons.translator_cache_size': '1'})
+        _get_translator('fr', pylons_config=conf)
+        _get_translator('es', pylons_config=conf)
+        assert len(translator_cache._translators) == 1
+
+    def test_bounded(self):
+        from pylons.i18n.translation import TranslatorCache
+        from gettext import NullTranslations
+        cache = TranslatorCache(size=2)
+        for key in ('a', 'b', 'a', 'c'):
+            cache.get(key, NullTranslations)
+        assert sorted(cache._translators) == ['a', 'c']
+
+    def test_clear(self):
+        from pylons.i18n.translation import (_get_translator,
+                                             clear_translator_cache,
+                                             translator_cache)
+        _get_translator('fr', pylons_config=lang_setup)
+        clear_translator_cache()
+        assert len(translator_cache._translators) == 0
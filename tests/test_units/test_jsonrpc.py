@@ -7,6 +7,8 @@ import json
 
 from __init__ import TestWSGIController
 
+notified = []
+
 def make_basejsonrpc():
     from pylons.controllers import JSONRPCController, JSONRPCError
 
@@ -49,6 +51,16 @@ def make_basejsonrpc():
             else:
                 return x - y
 
+        def notify(self, message):
+            notified.append(message)
+
+        def not_found(self):
+            from pylons.controllers.util import abort
+            abort(404)
+
+        def bad_sum(self, x):
+            return len(x, x)
+
         def _private(self):
             return 'private method'
 
@@ -69,12 +81,35 @@ class TestJSONRPCController(TestWSGIController):
         app = RegistryManager(app)
         self.app = TestApp(app)
 
+    def batchreq(self, calls, app=None):
+        from urllib import quote_plus
+        ee = dict(CONTENT_TYPE='application/json')
+        self.response = (app or self.app).post(
+            '/', params=quote_plus(json.dumps(calls)), extra_environ=ee)
+        return self.response.body and json.loads(self.response.body)
+
     def test_echo(self):
         response = self.jsonreq('echo', args=('hello, world',))
         assert dict(jsonrpc='2.0',
                     id='test',
                     result='hello, world') == response
 
+    def test_compressed(self):
+        import gzip
+        from StringIO import StringIO
+        from urllib import quote_plus
+        from pylons.middleware import CompressionMiddleware
+        app = TestApp(CompressionMiddleware(self.app.app, min_size=100))
+        message = 'hello, world ' * 50
+        data = json.dumps(dict(id='test', method='echo', params=[message]))
+        response = app.post('/', params=quote_plus(data), extra_environ={
+                'CONTENT_TYPE': 'application/json',
+                'HTTP_ACCEPT_ENCODING': 'gzip'})
+        assert response.header('Content-Encoding') == 'gzip'
+        assert int(response.header('Content-Length')) == len(response.body)
+        body = gzip.GzipFile(fileobj=StringIO(response.body)).read()
+        assert json.loads(body)['result'] == message
+
     def test_int_arg_check(self):
         response = self.jsonreq('int_arg_check', args=('1',))
         assert dict(jsonrpc='2.0',
@@ -138,6 +173,28 @@ class TestJSONRPCController(TestWSGIController):
                     error={'code': -32602,
                            'message': "Invalid params"}) == response
 
+    def test_v2_missing_argument(self):
+        response = self.jsonreq('subtract', args={'x': 1})
+        assert dict(jsonrpc='2.0',
+                    id='test',
+                    error={'code': -32602,
+                           'message': "Invalid params"}) == response
+
+    def test_type_error_in_method(self):
+        response = self.jsonreq('bad_sum', args=['abc'])
+        assert dict(jsonrpc='2.0',
+                    id='test',
+                    error={'code': -32603,
+                           'message': "Internal error"}) == response
+
+    def test_abort(self):
+        response = self.jsonreq('not_found')
+        assert dict(jsonrpc='2.0',
+                    id='test',
+                    error={'code': -32000,
+                           'message': "404 Not Found",
+                           'data': {'status': 404}}) == response
+
     def test_wrong_param_type(self):
         response = self.jsonreq('subtract', args=['1', '2'])
         assert dict(jsonrpc='2.0',
@@ -194,3 +251,160 @@ class TestJSONRPCController(TestWSGIController):
                     id='test',
                     error={'code': -32602,
                            'message': "Invalid params"}) == response
+
+    def test_parse_error(self):
+        response = self.app.post('/', params='{"id": "test', extra_environ=dict(
+                CONTENT_TYPE='application/json'))
+        assert dict(jsonrpc='2.0',
+                    id=None,
+                    error={'code': -32700,
+                           'message': "Parse error"}) == \
+            json.loads(response.body)
+
+    def test_notification(self):
+        del notified[:]
+        response = self.batchreq(dict(method='notify', params=['hello']))
+        assert self.response.status == 204
+        assert response == ''
+        assert 'Content-Type' not in dict(self.response.headers)
+        assert notified == ['hello']
+
+    def test_batch(self):
+        response = self.batchreq([
+                dict(id=1, method='echo', params=['hello']),
+                dict(id=2, method='subtract', params=[4, 2]),
+                dict(id=3, method='v2_decrement', params={'x': 50})])
+        assert self.response.header('Content-Type') == 'application/json'
+        assert [dict(jsonrpc='2.0', id=1, result='hello'),
+                dict(jsonrpc='2.0', id=2, result=2),
+                dict(jsonrpc='2.0', id=3, result=49)] == response
+
+    def test_batch_errors(self):
+        response = self.batchreq([
+                dict(id=1, method='foo'),
+                dict(id=2, method='subtract', params=[1]),
+                dict(id=3, method='return_garbage'),
+                dict(id=4, method='int_arg_check', params=['1']),
+                5,
+                dict(id=6, method='echo', params=['hello']),
+                dict(id=7, method='subtract', params={'x': 1}),
+                dict(id=8, method='not_found'),
+                dict(id=9, method='bad_sum', params=['abc'])])
+        assert [dict(jsonrpc='2.0', id=1,
+                     error={'code': -32601, 'message': "Method not found"}),
+                dict(jsonrpc='2.0', id=2,
+                     error={'code': -32602, 'message': "Invalid params"}),
+                dict(jsonrpc='2.0', id=3,
+                     error={'code': -32603, 'message': "Internal error"}),
+                dict(jsonrpc='2.0', id=4,
+                     error={'code': 1, 'message': "That is not an integer"}),
+                dict(jsonrpc='2.0', id=None,
+                     error={'code': -32600, 'message': "Invalid Request"}),
+                dict(jsonrpc='2.0', id=6, result='hello'),
+                dict(jsonrpc='2.0', id=7,
+                     error={'code': -32602, 'message': "Invalid params"}),
+                dict(jsonrpc='2.0', id=8,
+                     error={'code': -32000, 'message': "404 Not Found",
+                            'data': {'status': 404}}),
+                dict(jsonrpc='2.0', id=9,
+                     error={'code': -32603, 'message': "Internal error"})
+                ] == response
+
+    def test_batch_notifications(self):
+        del notified[:]
+        response = self.batchreq([
+                dict(method='notify', params=['first']),
+                dict(id=1, method='echo', params=['hello']),
+                dict(method='notify', params=['second'])])
+        assert [dict(jsonrpc='2.0', id=1, result='hello')] == response
+        assert notified == ['first', 'second']
+
+        response = self.batchreq([dict(method='notify', params=['third']),
+                                  dict(method='foo')])
+        assert self.response.status == 204
+        assert notified == ['first', 'second', 'third']
+
+    def test_empty_batch(self):
+        response = self.batchreq([])
+        assert dict(jsonrpc='2.0',
+                    id=None,
+                    error={'code': -32600,
+                           'message': "Invalid Request"}) == response
+
+    def test_concurrent_batch(self):
+        import threading
+        from pylons.testutil import ControllerWrap, SetupCacheGlobal
+
+        BaseJSONRPCController = make_basejsonrpc()
+        class ConcurrentController(BaseJSONRPCController):
+            batch_workers = 4
+
+            def thread(self):
+                return threading.current_thread().name
+
+        app = SetupCacheGlobal(ControllerWrap(ConcurrentController),
+                               self.baseenviron)
+        app = TestApp(RegistryManager(app))
+        calls = [dict(id=i, method='subtract', params=[i, 1])
+                 for i in range(20)]
+        calls.append(dict(id='thread', method='thread'))
+        response = self.batchreq(calls, app)
+        assert [dict(jsonrpc='2.0', id=i, result=i - 1)
+                for i in range(20)] == response[:20]
+        assert response[20]['result'] != threading.current_thread().name
+
+        pool = ConcurrentController.batch_pool()
+        assert ConcurrentController.batch_pool() is pool
+        assert BaseJSONRPCController.__dict__.get('_batch_pool') is None
+        ConcurrentController.close_batch_pool()
+        assert ConcurrentController.__dict__.get('_batch_pool') is None
+        response = self.batchreq(calls[:2], app)
+        assert [dict(jsonrpc='2.0', id=0, result=-1),
+                dict(jsonrpc='2.0', id=1, result=0)] == response
+        assert ConcurrentController.batch_pool() is not pool
+        ConcurrentController.close_batch_pool()
+
+    def test_raw_json_body(self):
+        data = json.dumps(dict(id='test', method='echo', params=['1 + 1']))
+        response = self.app.post('/', params=data, extra_environ=dict(
+                CONTENT_TYPE='application/json'))
+        assert dict(jsonrpc='2.0',
+                    id='test',
+                    result='1 + 1') == json.loads(response.body)
+        assert response.header('Content-Length') == str(len(response.body))
+
+    def test_max_body_length(self):
+        data = json.dumps(dict(id='test', method='echo',
+                               params=['x' * 4194304]))
+        self.assertRaises(exc.HTTPRequestEntityTooLarge,
+                          lambda: self.app.post('/', params=data))
+
+    def test_json_codec(self):
+        from pylons.controllers.jsonrpc import JSONCodec
+        from pylons.testutil import ControllerWrap, SetupCacheGlobal
+
+        decoded = []
+        def loads(body):
+            decoded.append(body)
+            return json.loads(body)
+        BaseJSONRPCController = make_basejsonrpc()
+        class CodecController(BaseJSONRPCController):
+            json_codec = JSONCodec(loads, lambda obj: json.dumps(obj,
+                                                                 indent=1))
+
+        app = SetupCacheGlobal(ControllerWrap(CodecController),
+                               self.baseenviron)
+        app = TestApp(RegistryManager(app))
+        response = self.batchreq(dict(id=1, method='echo', params=['hi']),
+                                 app)
+        assert dict(jsonrpc='2.0', id=1, result='hi') == response
+        assert '\n' in self.response.body
+        assert len(decoded) == 1
+
+    def test_batch_unencodable_result(self):
+        response = self.batchreq([
+                dict(id=1, method='return_garbage'),
+                dict(id=2, method='echo', params=['hello'])])
+        assert [dict(jsonrpc='2.0', id=1,
+                     error={'code': -32603, 'message': "Internal error"}),
+                dict(jsonrpc='2.0', id=2, result='hello')] == response
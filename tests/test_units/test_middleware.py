@@ -48,3 +48,217 @@ def test_retains_request():
         assert 'pylons.original_request' in res.environ
         assert '/fredrick' == res.environ['pylons.original_request'].path_info
     
+
+
+class StreamedApp(object):
+    """Yields its body in chunks, keeping track of how much was read"""
+    def __init__(self, chunks, headers=()):
+        self.chunks = chunks
+        self.headers = list(headers)
+        self.read = 0
+        self.closed = False
+
+    def __call__(self, environ, start_response):
+        start_response('200 OK', [('Content-type', 'text/plain')] +
+                       self.headers)
+        return self
+
+    def __iter__(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+    def close(self):
+        self.closed = True
+
+def test_conditional_get():
+    from hashlib import sha1
+    from pylons.middleware import ConditionalGetMiddleware
+    app = TestApp(ConditionalGetMiddleware(simple_app))
+    res = app.get('/')
+    etag = res.headers['ETag']
+    assert etag == '"%s"' % sha1('Hello world!').hexdigest()
+    res = app.get('/', headers={'If-None-Match': etag}, status=304)
+    assert res.body == ''
+    assert res.headers['ETag'] == etag
+    assert 'Content-type' not in res.headers
+    res = app.get('/', headers={'If-None-Match': '"other"'})
+    assert res.body == 'Hello world!'
+    res = app.post('/', headers={'If-None-Match': etag})
+    assert 'ETag' not in res.headers
+
+def test_conditional_get_streamed():
+    from pylons.middleware import ConditionalGetMiddleware
+    streamed = StreamedApp(['a' * 10] * 5)
+    app = TestApp(ConditionalGetMiddleware(streamed))
+    etag = app.get('/').headers['ETag']
+    res = app.get('/', headers={'If-None-Match': etag}, status=304)
+    assert streamed.closed
+    # Too large to be held back
+    streamed = StreamedApp(['a' * 10] * 5)
+    app = TestApp(ConditionalGetMiddleware(streamed, max_size=25))
+    res = app.get('/')
+    assert res.body == 'a' * 50
+    assert 'ETag' not in res.headers
+    assert streamed.closed
+
+def test_conditional_get_validators():
+    from pylons.middleware import ConditionalGetMiddleware
+    streamed = StreamedApp(['body'], [('ETag', '"v1"')])
+    app = TestApp(ConditionalGetMiddleware(streamed))
+    app.get('/', headers={'If-None-Match': '"v1"'}, status=304)
+    assert streamed.read == 0 and streamed.closed
+    streamed = StreamedApp(['body'], [
+            ('Last-Modified', 'Tue, 21 Jul 2015 12:00:00 GMT')])
+    app = TestApp(ConditionalGetMiddleware(streamed))
+    res = app.get('/', headers={
+            'If-Modified-Since': 'Tue, 21 Jul 2015 12:00:00 GMT'}, status=304)
+    assert streamed.read == 0
+    assert res.headers['Last-Modified'] == 'Tue, 21 Jul 2015 12:00:00 GMT'
+    res = app.get('/', headers={
+            'If-Modified-Since': 'Tue, 21 Jul 2015 11:00:00 GMT'})
+    assert res.body == 'body'
+    assert 'ETag' not in res.headers
+    streamed = StreamedApp(['body'], [('Cache-Control', 'no-store')])
+    app = TestApp(ConditionalGetMiddleware(streamed))
+    assert 'ETag' not in app.get('/').headers
+
+def test_conditional_get_head():
+    from webob import Response
+    from pylons.middleware import ConditionalGetMiddleware
+    app = TestApp(ConditionalGetMiddleware(Response('Hello world!')))
+    etag = app.get('/').headers['ETag']
+    res = app.head('/')
+    assert 'ETag' not in res.headers
+    res = app.head('/', headers={'If-None-Match': etag})
+    assert res.status_int == 200
+    assert 'ETag' not in res.headers
+    # Validators set by the application are checked for both
+    app = TestApp(ConditionalGetMiddleware(Response('Hello world!',
+                                                    etag='v1')))
+    get = app.get('/', headers={'If-None-Match': '"v1"'}, status=304)
+    head = app.head('/', headers={'If-None-Match': '"v1"'}, status=304)
+    assert get.headers['ETag'] == head.headers['ETag'] == '"v1"'
+    assert app.head('/').headers['ETag'] == app.get('/').headers['ETag']
+
+def test_conditional_get_errors():
+    from pylons.middleware import ConditionalGetMiddleware
+    app = TestApp(ConditionalGetMiddleware(simple_exception_app))
+    res = app.get('/', headers={'If-None-Match': '*'}, status=404)
+    assert 'ETag' not in res.headers
+
+def text_app(body, content_type='text/html', headers=(), whole=True):
+    def app(environ, start_response):
+        start_response('200 OK', [('Content-Type', content_type)] +
+                       list(headers))
+        if whole:
+            return [body]
+        return StreamedApp([body[i:i + 100]
+                            for i in range(0, len(body), 100)])(
+            environ, lambda *args: None)
+    return app
+
+def raw_request(app, method='GET', **headers):
+    """Call app directly, as WebTest decodes compressed bodies"""
+    from webob import Request
+    req = Request.blank('/', method=method)
+    for name, value in headers.items():
+        req.environ['HTTP_' + name.upper()] = value
+    result = {}
+    def start_response(status, headerlist, exc_info=None):
+        result['status'] = status
+        result['headers'] = dict(headerlist)
+    app_iter = app(req.environ, start_response)
+    result['body'] = ''.join(app_iter)
+    if hasattr(app_iter, 'close'):
+        app_iter.close()
+    return result
+
+def test_compression():
+    import gzip, zlib
+    from StringIO import StringIO
+    from pylons.middleware import CompressionMiddleware
+    body = 'Hello world! ' * 100
+    app = CompressionMiddleware(text_app(body, headers=[
+                ('ETag', '"abc"'), ('Content-Length', str(len(body)))]))
+    res = raw_request(app, accept_encoding='gzip, deflate')
+    headers = res['headers']
+    assert headers['Content-Encoding'] == 'gzip'
+    assert headers['Vary'] == 'Accept-Encoding'
+    assert headers['ETag'] == 'W/"abc"'
+    assert int(headers['Content-Length']) == len(res['body']) < len(body)
+    assert gzip.GzipFile(fileobj=StringIO(res['body'])).read() == body
+    res = raw_request(app, accept_encoding='gzip;q=0, deflate')
+    assert res['headers']['Content-Encoding'] == 'deflate'
+    assert zlib.decompress(res['body']) == body
+    for accept in ('', 'identity', 'gzip;q=0', 'br'):
+        res = raw_request(app, accept_encoding=accept)
+        assert 'Content-Encoding' not in res['headers']
+        assert res['headers']['Vary'] == 'Accept-Encoding'
+        assert res['headers']['ETag'] == '"abc"'
+        assert res['body'] == body
+
+def test_compression_streamed():
+    import gzip
+    from StringIO import StringIO
+    from pylons.middleware import CompressionMiddleware
+    body = ''.join(['line %d\n' % i for i in range(1000)])
+    app = CompressionMiddleware(text_app(body, whole=False))
+    res = raw_request(app, accept_encoding='gzip')
+    assert res['headers']['Content-Encoding'] == 'gzip'
+    assert 'Content-Length' not in res['headers']
+    assert gzip.GzipFile(fileobj=StringIO(res['body'])).read() == body
+    # Small streamed bodies are only read up to min_size
+    app = CompressionMiddleware(text_app('small', whole=False))
+    res = raw_request(app, accept_encoding='gzip')
+    assert 'Content-Encoding' not in res['headers']
+    assert res['body'] == 'small'
+
+def test_compression_skipped():
+    from pylons.middleware import CompressionMiddleware
+    body = 'x' * 1000
+    for app in (text_app('small'), text_app(body, 'image/png'),
+                text_app(body, headers=[('Cache-Control', 'no-transform')])):
+        res = raw_request(CompressionMiddleware(app), accept_encoding='gzip')
+        assert 'Content-Encoding' not in res['headers']
+        assert res['body'] in ('small', body)
+    app = text_app(body, headers=[('Content-Encoding', 'br')])
+    res = raw_request(CompressionMiddleware(app), accept_encoding='gzip')
+    assert res['headers']['Content-Encoding'] == 'br'
+    assert res['body'] == body
+    def opt_out(environ, start_response):
+        environ['pylons.compress'] = False
+        return text_app(body)(environ, start_response)
+    res = raw_request(CompressionMiddleware(opt_out), accept_encoding='gzip')
+    assert 'Content-Encoding' not in res['headers']
+    assert 'Vary' not in res['headers']
+
+def test_compression_head():
+    from webob import Response
+    from pylons.middleware import CompressionMiddleware
+    body = 'Hello world! ' * 100
+    app = CompressionMiddleware(Response(body, etag='abc'))
+    get = raw_request(app, accept_encoding='gzip')['headers']
+    res = raw_request(app, method='HEAD', accept_encoding='gzip')
+    assert res['body'] == ''
+    head = res['headers']
+    for name in ('Content-Encoding', 'Vary', 'ETag'):
+        assert head[name] == get[name]
+    assert head['ETag'] == 'W/"abc"'
+    assert 'Content-Length' not in head
+    # Too small to be compressed
+    app = CompressionMiddleware(Response('small', etag='abc'))
+    head = raw_request(app, method='HEAD', accept_encoding='gzip')['headers']
+    assert 'Content-Encoding' not in head
+    assert head['ETag'] == '"abc"'
+    assert head['Content-Length'] == '5'
+
+def test_compression_etag():
+    from pylons.middleware import CompressionMiddleware, \
+        ConditionalGetMiddleware
+    body = 'Hello world! ' * 100
+    app = CompressionMiddleware(ConditionalGetMiddleware(text_app(body)))
+    etag = raw_request(app, accept_encoding='gzip')['headers']['ETag']
+    assert etag.startswith('W/"')
+    res = raw_request(app, accept_encoding='gzip', if_none_match=etag)
+    assert res['status'].startswith('304')
@@ -0,0 +1,212 @@
+import gzip
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+
+from webtest import TestApp
+
+from pylons.static import StaticFiles
+
+
+def dynamic_app(environ, start_response):
+    start_response('200 OK', [('Content-Type', 'text/plain')])
+    return ['dynamic %s' % environ['PATH_INFO']]
+
+
+class FileWrapper(object):
+    """Records the files sent with wsgi.file_wrapper"""
+    sent = []
+
+    def __init__(self, f, block_size):
+        self.f = f
+        self.sent.append(f.name)
+
+    def __iter__(self):
+        return iter(lambda: self.f.read(8192), '')
+
+    def close(self):
+        self.f.close()
+
+
+class TestStaticFiles(object):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.write('css/site.css', 'body { color: red; }')
+        self.write('css/site.css.gz', self.gzip('body { color: red; }'))
+        self.write('js/app.js', 'x' * 100000)
+        self.write('favicon.ico', 'icon')
+        self.write('.hidden', 'secret')
+        self.static = StaticFiles(dynamic_app, self.directory,
+                                  memory_size=1024)
+        self.app = TestApp(self.static)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, path, content):
+        filename = os.path.join(self.directory, *path.split('/'))
+        if not os.path.isdir(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename))
+        f = open(filename, 'wb')
+        f.write(content)
+        f.close()
+        return filename
+
+    def gzip(self, content):
+        buf = StringIO()
+        f = gzip.GzipFile(fileobj=buf, mode='wb', mtime=0)
+        f.write(content)
+        f.close()
+        return buf.getvalue()
+
+    def test_index(self):
+        assert sorted(self.static.files) == [
+            '/css/site.css', '/css/site.css.gz', '/favicon.ico',
+            '/js/app.js']
+        assert self.static.prefixes == frozenset(['css', 'js',
+                                                  'favicon.ico'])
+
+    def test_serve(self):
+        res = self.app.get('/css/site.css')
+        assert res.body == 'body { color: red; }'
+        assert res.headers['Content-Type'] == 'text/css'
+        assert res.headers['Cache-Control'] == 'max-age=3600'
+        assert res.headers['Vary'] == 'Accept-Encoding'
+        assert res.headers['Content-Length'] == '20'
+        res = self.app.get('/favicon.ico')
+        assert res.body == 'icon'
+        res = self.app.head('/favicon.ico')
+        assert res.body == ''
+        assert res.headers['Content-Length'] == '4'
+
+    def test_dynamic(self):
+        for path in ('/', '/users/1', '/css/missing.css', '/.hidden',
+                     '/css/../.hidden'):
+            assert self.app.get(path).body == 'dynamic %s' % path
+        assert self.app.post('/css/site.css').body == \
+            'dynamic /css/site.css'
+
+    def test_precompressed(self):
+        from webob import Request
+        # WebTest would decompress the body
+        req = Request.blank('/css/site.css',
+                            headers={'Accept-Encoding': 'gzip'})
+        res = req.get_response(self.static)
+        assert res.headers['Content-Encoding'] == 'gzip'
+        assert res.headers['Content-Type'] == 'text/css'
+        assert res.body == self.gzip('body { color: red; }')
+        assert res.headers['Content-Length'] == str(len(res.body))
+        res = self.app.get('/css/site.css.gz')
+        assert res.headers['Content-Type'] == 'application/x-gzip'
+        assert 'Content-Encoding' not in res.headers
+
+    def test_not_modified(self):
+        res = self.app.get('/favicon.ico')
+        etag, last_modified = res.headers['ETag'], res.headers['Last-Modified']
+        res = self.app.get('/favicon.ico', headers={'If-None-Match': etag},
+                           status=304)
+        assert 'Content-Type' not in res.headers
+        self.app.get('/favicon.ico',
+                     headers={'If-Modified-Since': last_modified},
+                     status=304)
+
+    def test_file_wrapper(self):
+        FileWrapper.sent = []
+        res = self.app.get('/js/app.js', extra_environ={
+                'wsgi.file_wrapper': FileWrapper})
+        assert res.body == 'x' * 100000
+        assert FileWrapper.sent == [os.path.join(self.directory, 'js',
+                                                 'app.js')]
+        # Without one, the file is read in blocks
+        res = self.app.get('/js/app.js')
+        assert res.body == 'x' * 100000
+
+    def test_range(self):
+        res = self.app.get('/favicon.ico')
+        assert res.headers['Accept-Ranges'] == 'bytes'
+        for header, body in (('bytes=1-2', 'co'), ('bytes=2-', 'on'),
+                             ('bytes=-3', 'con'), ('bytes=1-100', 'con'),
+                             ('bytes=-100', 'icon')):
+            res = self.app.get('/favicon.ico', headers={'Range': header},
+                               status=206)
+            assert res.body == body
+            assert res.headers['Content-Length'] == str(len(body))
+        assert res.headers['Content-Range'] == 'bytes 0-3/4'
+        # Read from the file
+        res = self.app.get('/js/app.js', headers={'Range': 'bytes=99990-'},
+                           status=206)
+        assert res.body == 'x' * 10
+        assert res.headers['Content-Range'] == 'bytes 99990-99999/100000'
+        res = self.app.head('/js/app.js', headers={'Range': 'bytes=0-9'},
+                            status=206)
+        assert res.headers['Content-Length'] == '10'
+        # Unsatisfiable
+        res = self.app.get('/favicon.ico', headers={'Range': 'bytes=4-'},
+                           status=416)
+        assert res.headers['Content-Range'] == 'bytes */4'
+        assert res.body == ''
+        # Several ranges, or invalid ones, get the whole file
+        for header in ('bytes=0-1,3-', 'bytes=3-1', 'lines=1-2'):
+            res = self.app.get('/favicon.ico', headers={'Range': header},
+                               status=200)
+            assert res.body == 'icon'
+        # As does a range of a file that has changed
+        etag = res.headers['ETag']
+        res = self.app.get('/favicon.ico', status=206,
+                           headers={'Range': 'bytes=1-', 'If-Range': etag})
+        assert res.body == 'con'
+        res = self.app.get('/favicon.ico', status=200,
+                           headers={'Range': 'bytes=1-', 'If-Range': '"x"'})
+        assert res.body == 'icon'
+
+    def test_fingerprint(self):
+        url = self.static.url('/css/site.css')
+        assert url.startswith('/css/site.') and url.endswith('.css')
+        assert len(url) == len('/css/site.css') + 13
+        assert self.static.url('/css/missing.css') == '/css/missing.css'
+        res = self.app.get(url, headers={'Accept-Encoding': 'gzip'})
+        assert res.body == 'body { color: red; }'
+        assert res.headers['Cache-Control'] == \
+            'public, max-age=31536000, immutable'
+        # An outdated fingerprint still gets the file, briefly cached
+        res = self.app.get('/css/site.0123456789ab.css')
+        assert res.headers['Cache-Control'] == 'max-age=3600'
+        # A top level file, whose fingerprinted name isn't a prefix
+        url = self.static.url('/favicon.ico')
+        assert url.startswith('/favicon.') and url.endswith('.ico')
+        res = self.app.get(url)
+        assert res.body == 'icon'
+        assert res.headers['Cache-Control'] == \
+            'public, max-age=31536000, immutable'
+        assert self.app.get('/favicon.0123456789ab.ico').body == 'icon'
+        assert self.app.get('/users.0123456789ab.ico').body == \
+            'dynamic /users.0123456789ab.ico'
+
+    def test_static_url(self):
+        import pylons
+        from pylons.static import static_url
+        assert static_url('/css/site.css') == '/css/site.css'
+        pylons.config['pylons.static'] = self.static
+        try:
+            assert static_url('/css/site.css') == \
+                self.static.url('/css/site.css')
+        finally:
+            pylons.config['pylons.static'] = None
+
+    def test_rescan(self):
+        static = StaticFiles(dynamic_app, self.directory, rescan=True)
+        app = TestApp(static)
+        assert app.get('/favicon.ico').body == 'icon'
+        # Without rescan, changes aren't noticed
+        assert self.app.get('/favicon.ico').body == 'icon'
+        filename = self.write('favicon.ico', 'new icon')
+        mtime = time.time() + 10
+        os.utime(filename, (mtime, mtime))
+        assert app.get('/favicon.ico').body == 'new icon'
+        self.write('images/logo.png', 'logo')
+        assert app.get('/images/logo.png').body == 'logo'
+        assert self.app.get('/images/logo.png').body == \
+            'dynamic /images/logo.png'
+        assert app.get('/users').body == 'dynamic /users'
@@ -78,3 +78,554 @@ class TestTemplatingApp(object):
         resp2 = self.app.get('/hello/time_template')
         assert resp.body == resp2.body
 
+
+class TestTemplateProfiling(object):
+    def setUp(self):
+        from pylons.templating import template_stats
+        template_stats.clear()
+        self.app = TestApp(make_app(
+                {'cache_dir': os.path.join(os.path.dirname(__file__),
+                                           'cache')},
+                include_cache_middleware=True,
+                **{'pylons.template_profiling': 'true'}))
+
+    def _get(self, path):
+        renders = []
+        self.app.get(path, extra_environ={'pylons.template_renders': renders})
+        return renders
+
+    def test_render(self):
+        renders = self._get('/hello/intro_template')
+        assert len(renders) == 1
+        record = renders[0]
+        assert record['engine'] == 'mako'
+        assert record['template'] == '/hello.html'
+        assert record['cache'] is None
+        assert record['size'] > 0
+        assert record['total'] >= record['compile'] + record['render']
+
+    def test_cache(self):
+        from pylons.templating import template_stats
+        cache_dir = os.path.join(os.path.dirname(__file__), 'cache')
+        CacheManager(type='dbm', data_dir=os.path.join(cache_dir, 'cache')
+                     ).get_cache('/time.html').clear()
+        miss = self._get('/hello/time_template')[0]
+        hit = self._get('/hello/time_template')[0]
+        assert miss['cache'] == 'miss'
+        assert miss['render'] is not None
+        assert hit['cache'] == 'hit'
+        assert hit['render'] is None and hit['size'] is None
+        row = template_stats.report()[0]
+        assert row['template'] == '/time.html'
+        assert row['renders'] == 2
+        assert row['hits'] + row['misses'] == 2
+
+    def test_disabled(self):
+        app = TestApp(make_app({}))
+        renders = []
+        app.get('/hello/intro_template',
+                extra_environ={'pylons.template_renders': renders})
+        assert renders == []
+
+    def test_report(self):
+        from pylons.templating import TemplateStats
+        stats = TemplateStats()
+        for template, total in [('a', 0.1), ('a', 0.3), ('b', 0.25)]:
+            stats.add(dict(engine='mako', template=template, compile=None,
+                           render=total, total=total, size=10, cache=None))
+        assert [row['template'] for row in stats.report()] == ['a', 'b']
+        assert [row['template'] for row in stats.report('average')] == \
+            ['b', 'a']
+        row = stats.report(limit=1)[0]
+        assert row['renders'] == 2
+        assert row['max'] == 0.3
+        assert row['size'] == 10
+        assert 'a' in stats.format().splitlines()[1]
+        stats.clear()
+        assert stats.report() == []
+
+    def test_middleware(self):
+        from pylons.middleware import TemplateStatsMiddleware
+        self._get('/hello/intro_template')
+        app = TestApp(TemplateStatsMiddleware(self.app.app))
+        resp = app.get('/_template_stats?order=max&limit=5')
+        assert '/hello.html' in resp
+        app.get('/_template_stats?order=size', status=400)
+        assert 'Hi there' in app.get('/hello/intro_template')
+
+
+class TestCachedTemplate(object):
+    def setUp(self):
+        import pylons
+        self.cache = CacheManager(type='memory')
+        pylons.cache._push_object(self.cache)
+        self.calls = []
+
+    def tearDown(self):
+        import pylons
+        pylons.cache._pop_object(self.cache)
+
+    def render(self):
+        self.calls.append(1)
+        return 'rendered %d' % len(self.calls)
+
+    def test_dict_key(self):
+        from pylons.templating import cached_template
+        first = cached_template('page.mako', self.render,
+                                cache_key=dict(page=1, sort='name'),
+                                cache_type='memory')
+        second = cached_template('page.mako', self.render,
+                                 cache_key=dict(sort='name', page=1),
+                                 cache_type='memory')
+        assert first == second == 'rendered 1'
+        cached_template('page.mako', self.render,
+                        cache_key=dict(page=2, sort='name'),
+                        cache_type='memory')
+        assert len(self.calls) == 2
+
+    def test_cache_version(self):
+        from pylons.templating import cached_template
+        cached_template('page.mako', self.render, cache_key='key',
+                        cache_type='memory', cache_version=1)
+        cached_template('page.mako', self.render, cache_key='key',
+                        cache_type='memory', cache_version=1)
+        assert len(self.calls) == 1
+        cached_template('page.mako', self.render, cache_key='key',
+                        cache_type='memory', cache_version=2)
+        assert len(self.calls) == 2
+        assert 'key' in self.cache.get_cache('page.mako@1', type='memory')
+
+
+class TestRenderNamespace(object):
+    def setUp(self):
+        from pylons.requestlocal import request_local
+        from pylons.util import ContextObj, PylonsContext
+        self.pylons_obj = pylons_obj = PylonsContext()
+        pylons_obj.config = {'pylons.app_globals': object(),
+                             'pylons.h': object()}
+        pylons_obj.tmpl_context = ContextObj()
+        pylons_obj.request = object()
+        pylons_obj.response = object()
+        pylons_obj.translator = object()
+        pylons_obj.url = object()
+        pylons_obj.session = object()
+        request_local.push(pylons_obj)
+
+    def tearDown(self):
+        from pylons.requestlocal import request_local
+        request_local.pop(self.pylons_obj)
+
+    def test_built_once(self):
+        from pylons.templating import pylons_globals, render_namespace
+        globs = render_namespace()
+        assert render_namespace() is globs
+        assert globs['session'] is self.pylons_obj.session
+        copy = pylons_globals()
+        assert copy == globs and copy is not globs
+
+    def test_extra_vars(self):
+        from pylons.templating import render_namespace
+        extra_vars = dict(title='Title', c='overridden')
+        globs = render_namespace(extra_vars)
+        assert globs['title'] == 'Title'
+        assert globs['c'] == 'overridden'
+        assert globs['request'] is self.pylons_obj.request
+        assert extra_vars == dict(title='Title', c='overridden')
+        assert 'title' not in render_namespace()
+        assert render_namespace()['c'] is self.pylons_obj.tmpl_context
+
+    def test_rebuilt_when_replaced(self):
+        from pylons.templating import render_namespace
+        globs = render_namespace()
+        self.pylons_obj.translator = translator = object()
+        assert render_namespace()['translator'] is translator
+        self.pylons_obj.response = response = object()
+        assert render_namespace()['response'] is response
+        assert render_namespace() is not globs
+
+    def test_lean_context(self):
+        from pylons.requestlocal import request_local
+        from pylons.templating import render_namespace
+        from pylons.util import LeanPylonsContext
+        lean = LeanPylonsContext(object, object)
+        for attr in ('config', 'tmpl_context', 'request', 'url'):
+            setattr(lean, attr, getattr(self.pylons_obj, attr))
+        request_local.push(lean)
+        try:
+            globs = render_namespace()
+            assert render_namespace() is globs
+            assert 'session' not in globs
+        finally:
+            request_local.pop(lean)
+
+
+class TestCacheFragment(object):
+    def setUp(self):
+        import tempfile
+        import pylons
+        from pylons.lrucache import get_store
+        from pylons.requestlocal import request_local
+        from pylons.templating import FRAGMENT_STORE
+        from pylons.util import ContextObj, PylonsContext
+        self.cache = CacheManager(type='memory')
+        pylons.cache._push_object(self.cache)
+        self.template_dir = tempfile.mkdtemp()
+        self.template_file = os.path.join(self.template_dir, 'page.mako')
+        open(self.template_file, 'w').write(
+            '<%def name="sidebar(title)">${title} ${c.calls}</%def>')
+        class AppGlobals(object):
+            mako_lookup = TemplateLookup(directories=[self.template_dir])
+        self.pylons_obj = pylons_obj = PylonsContext()
+        pylons_obj.config = {'pylons.app_globals': AppGlobals(),
+                             'pylons.h': None}
+        pylons_obj.tmpl_context = ContextObj()
+        pylons_obj.tmpl_context.calls = 0
+        for attr in ('request', 'response', 'translator', 'url'):
+            setattr(pylons_obj, attr, None)
+        request_local.push(pylons_obj)
+        get_store(FRAGMENT_STORE).clear()
+        # Memory namespaces are shared by every CacheManager
+        self.cache.get_cache('fragment:nav').clear()
+        self.calls = []
+
+    def tearDown(self):
+        import shutil
+        import pylons
+        from pylons.requestlocal import request_local
+        request_local.pop(self.pylons_obj)
+        pylons.cache._pop_object(self.cache)
+        shutil.rmtree(self.template_dir)
+
+    def render(self):
+        self.calls.append(1)
+        return '<p>%d</p>' % len(self.calls)
+
+    def test_memory_tier(self):
+        from pylons.templating import cache_fragment
+        assert cache_fragment('nav', self.render) == '<p>1</p>'
+        # Served from the memory tier, without going to Beaker
+        self.cache.get_cache('fragment:nav').clear()
+        content = cache_fragment('nav', self.render)
+        assert content == '<p>1</p>'
+        assert hasattr(content, '__html__')
+        assert len(self.calls) == 1
+
+    def test_backend_tier(self):
+        from pylons.lrucache import get_store
+        from pylons.templating import FRAGMENT_STORE, cache_fragment
+        cache_fragment('nav', self.render, type='memory')
+        get_store(FRAGMENT_STORE).clear()
+        assert cache_fragment('nav', self.render) == '<p>1</p>'
+        assert len(self.calls) == 1
+
+    def test_depends(self):
+        from pylons.templating import cache_fragment
+        cache_fragment('nav', self.render, depends=dict(user=1))
+        cache_fragment('nav', self.render, depends=dict(user=2))
+        assert cache_fragment('nav', self.render,
+                              depends=dict(user=1)) == '<p>1</p>'
+        assert len(self.calls) == 2
+
+    def test_template_mtime(self):
+        from pylons.templating import cache_fragment
+        cache_fragment('nav', self.render, template_file=self.template_file)
+        cache_fragment('nav', self.render, template_file=self.template_file)
+        assert len(self.calls) == 1
+        mtime = os.path.getmtime(self.template_file) + 10
+        os.utime(self.template_file, (mtime, mtime))
+        assert cache_fragment('nav', self.render,
+                              template_file=self.template_file) == '<p>2</p>'
+
+    def test_expire(self):
+        import time
+        from pylons.templating import cache_fragment
+        cache_fragment('nav', self.render, expire=0.2)
+        cache_fragment('nav', self.render, expire=0.2)
+        assert len(self.calls) == 1
+        time.sleep(0.3)
+        assert cache_fragment('nav', self.render, expire=0.2) == '<p>2</p>'
+
+    def test_render_mako_def(self):
+        from pylons.templating import render_mako_def
+        c = self.pylons_obj.tmpl_context
+        def render(title, user):
+            c.calls += 1
+            return render_mako_def('/page.mako', 'sidebar', title=title,
+                                   cache_depends=[user]).strip()
+        assert render('Hi', 1) == 'Hi 1'
+        assert render('Hi', 1) == 'Hi 1'
+        assert render('Hi', 2) == 'Hi 3'
+        assert render('Bye', 1) == 'Bye 4'
+        mtime = os.path.getmtime(self.template_file) + 10
+        os.utime(self.template_file, (mtime, mtime))
+        assert render('Hi', 1) == 'Hi 5'
+
+
+class TestCompileTemplates(object):
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        self.templates = os.path.join(self.dir, 'templates')
+        os.makedirs(os.path.join(self.templates, 'sub'))
+        os.makedirs(os.path.join(self.templates, '.svn'))
+        for name, content in [('index.html', 'Hello ${name}'),
+                              ('sub/page.html', 'Page'),
+                              ('.svn/entries', '${'),
+                              ('helpers.py', '${')]:
+            open(os.path.join(self.templates, name), 'w').write(content)
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def test_mako(self):
+        from pylons.templating import compile_templates
+        modules = os.path.join(self.dir, 'modules')
+        class AppGlobals(object):
+            mako_lookup = TemplateLookup(directories=[self.templates],
+                                         module_directory=modules)
+        results = list(compile_templates(AppGlobals(), [self.templates]))
+        assert [(engine, name, error) for engine, name, seconds, error
+                in results] == [('mako', 'index.html', None),
+                                ('mako', 'sub/page.html', None)]
+        assert os.path.isfile(os.path.join(modules, 'sub', 'page.html.py'))
+
+    def test_jinja2(self):
+        from jinja2 import Environment, FileSystemBytecodeCache, \
+            FileSystemLoader
+        from pylons.templating import compile_templates
+        bytecode_dir = os.path.join(self.dir, 'bytecode')
+        os.makedirs(bytecode_dir)
+        open(os.path.join(self.templates, 'broken.html'), 'w').write(
+            '{% if %}')
+        class AppGlobals(object):
+            jinja2_env = Environment(
+                loader=FileSystemLoader(self.templates),
+                bytecode_cache=FileSystemBytecodeCache(bytecode_dir))
+        results = dict((name, error) for engine, name, seconds, error
+                       in compile_templates(AppGlobals(), self.templates))
+        assert sorted(results) == ['broken.html', 'index.html',
+                                   'sub/page.html']
+        assert results['broken.html'] is not None
+        assert results['index.html'] is None
+        assert len(os.listdir(bytecode_dir)) == 2
+
+    def test_extensions(self):
+        from pylons.templating import compile_templates
+        open(os.path.join(self.templates, 'mail.txt'), 'w').write('Mail')
+        class AppGlobals(object):
+            mako_lookup = TemplateLookup(directories=[self.templates])
+        results = list(compile_templates(AppGlobals(), [self.templates],
+                                         extensions=['.txt']))
+        assert [name for engine, name, seconds, error in results] == \
+            ['mail.txt']
+
+
+class TestLazyContext(object):
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        for name, content in [
+                ('lazy.mako', '% if c.show:\n${c.value} ${c.value}\n'
+                 '% endif\n'),
+                ('lazy.jinja2', '{% if c.show %}{{ c.value }} {{ c.value }}\n'
+                 '{% endif %}'),
+                ('lazy.genshi', '<p xmlns:py="http://genshi.edgewall.org/">'
+                 '<py:if test="c.show">${c.value} ${c.value}\n</py:if></p>')]:
+            open(os.path.join(self.dir, name), 'w').write(content)
+        self.calls = []
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def _make_app(self, **app_conf):
+        import pylons.configuration as configuration
+        from genshi.template import TemplateLoader
+        from jinja2 import Environment, FileSystemLoader
+        from pylons import request, tmpl_context as c
+        from pylons.controllers import WSGIController
+        from pylons.templating import render_genshi, render_jinja2, \
+            render_mako
+        from pylons.wsgiapp import PylonsApp
+        calls = self.calls
+
+        def compute(value):
+            calls.append(value)
+            return value
+
+        class LazyController(WSGIController):
+            def __before__(self):
+                c.show = request.params.get('show') == '1'
+                c.set_lazy('value', compute, 'computed')
+
+            def mako(self):
+                return render_mako('/lazy.mako')
+
+            def jinja2(self):
+                return render_jinja2('lazy.jinja2')
+
+            def genshi(self):
+                return render_genshi('lazy.genshi', method='xml')
+
+        class AppGlobals(object):
+            mako_lookup = TemplateLookup(directories=[self.dir])
+            jinja2_env = Environment(loader=FileSystemLoader(self.dir))
+            genshi_loader = TemplateLoader([self.dir])
+
+        config = configuration.PylonsConfig()
+        config.init_app({}, app_conf, package='lazy', paths=dict(root=None))
+        config['pylons.app_globals'] = AppGlobals()
+        mapper = Mapper()
+        mapper.connect('/{action}', controller=LazyController)
+        return TestApp(RoutesMiddleware(PylonsApp(config=config), mapper,
+                                        singleton=False))
+
+    def _check(self, app):
+        for action in ('mako', 'jinja2', 'genshi'):
+            del self.calls[:]
+            resp = app.get('/%s?show=0' % action)
+            assert 'computed' not in resp
+            assert self.calls == []
+            resp = app.get('/%s?show=1' % action)
+            assert 'computed computed' in resp
+            assert self.calls == ['computed']
+
+    def test_strict(self):
+        self._check(self._make_app())
+
+    def test_attribsafe(self):
+        self._check(self._make_app(**{'pylons.strict_tmpl_context': False}))
+
+    def test_tracking(self):
+        from pylons.util import tmpl_context_stats
+        tmpl_context_stats.clear()
+        self._check(self._make_app(**{'pylons.tmpl_context_stats': 'true'}))
+        # value was read by the render that showed it
+        assert tmpl_context_stats.report()['/lazy.mako'] == dict(
+            renders=2, unused=[], missing=[])
+        tmpl_context_stats.clear()
+
+
+class TestStreamRender(object):
+    rows = 3000
+
+    def setUp(self):
+        import tempfile
+        self.dir = tempfile.mkdtemp()
+        for name, content in [
+                ('rows.mako', u'% for row in c.rows:\n'
+                 u'${row} caf\xe9 ${h.name()}\n% endfor\n'),
+                ('rows.jinja2', u'{{ c.subtitle }}{% for row in c.rows %}'
+                 u'{{ row }} caf\xe9 {{ h.name() }}\n{% endfor %}'),
+                ('rows.genshi', u'<p xmlns:py="http://genshi.edgewall.org/">'
+                 u'<py:for each="row in c.rows">${row} caf\xe9 ${h.name()}\n'
+                 u'</py:for></p>')]:
+            open(os.path.join(self.dir, name), 'w').write(
+                content.encode('utf-8'))
+
+    def tearDown(self):
+        import shutil
+        shutil.rmtree(self.dir)
+
+    def _make_app(self, **app_conf):
+        import pylons
+        import pylons.configuration as configuration
+        from genshi.template import TemplateLoader
+        from jinja2 import Environment, FileSystemLoader
+        from pylons import tmpl_context as c
+        from pylons.controllers import WSGIController
+        from pylons.templating import render_genshi, render_jinja2, \
+            render_mako
+        from pylons.wsgiapp import PylonsApp
+
+        class StreamController(WSGIController):
+            def mako(self):
+                c.rows = range(TestStreamRender.rows)
+                c.title = 'Rows'
+                return render_mako('/rows.mako', stream=True)
+
+            def jinja2(self):
+                c.rows = range(TestStreamRender.rows)
+                c.title = 'Rows'
+                return render_jinja2('rows.jinja2', stream=True)
+
+            def genshi(self):
+                c.rows = range(TestStreamRender.rows)
+                c.title = 'Rows'
+                return render_genshi('rows.genshi', method='xml',
+                                     stream=True)
+
+        class Helpers(object):
+            # Only works while the request's context is current
+            @staticmethod
+            def name():
+                return pylons.request.environ['PATH_INFO'][1:]
+
+        class AppGlobals(object):
+            mako_lookup = TemplateLookup(directories=[self.dir])
+            jinja2_env = Environment(loader=FileSystemLoader(self.dir))
+            genshi_loader = TemplateLoader([self.dir])
+
+        config = configuration.PylonsConfig()
+        config.init_app({}, app_conf, package='stream',
+                        paths=dict(root=None))
+        config['pylons.app_globals'] = AppGlobals()
+        config['pylons.h'] = Helpers
+        mapper = Mapper()
+        mapper.connect('/{action}', controller=StreamController)
+        return RoutesMiddleware(PylonsApp(config=config), mapper,
+                                singleton=False)
+
+    def _get(self, action, app_conf=None, **environ):
+        from pylons.controllers.util import EncodedAppIter
+        environ.update({'REQUEST_METHOD': 'GET', 'SCRIPT_NAME': '',
+                        'PATH_INFO': '/' + action, 'QUERY_STRING': '',
+                        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80',
+                        'wsgi.url_scheme': 'http', 'wsgi.input': None})
+        status = []
+        def start_response(status_line, headers, exc_info=None):
+            status.append(status_line)
+        app = self._make_app(**dict(app_conf or {}, **{
+                    'pylons.template_profiling': 'true'}))
+        app_iter = app(environ, start_response)
+        assert isinstance(app_iter, EncodedAppIter)
+        chunks = list(app_iter)
+        assert status == ['200 OK']
+        assert len(chunks) > 1
+        for chunk in chunks:
+            assert isinstance(chunk, str)
+        return ''.join(chunks).decode('utf-8')
+
+    def _expected(self, action):
+        return u''.join(u'%d caf\xe9 %s\n' % (row, action)
+                        for row in range(self.rows))
+
+    def test_mako(self):
+        assert self._get('mako') == self._expected('mako')
+
+    def test_jinja2(self):
+        assert self._get('jinja2') == self._expected('jinja2')
+
+    def test_genshi(self):
+        assert self._get('genshi') == u'<p>%s</p>' % self._expected('genshi')
+
+    def test_profiling(self):
+        for action in ('mako', 'jinja2'):
+            renders = []
+            self._get(action, **{'pylons.template_renders': renders})
+            assert len(renders) == 1
+            assert renders[0]['size'] == len(self._expected(action))
+            assert renders[0]['render'] > 0
+
+    def test_tmpl_context_stats(self):
+        from pylons.util import tmpl_context_stats
+        tmpl_context_stats.clear()
+        conf = {'pylons.tmpl_context_stats': 'true'}
+        assert self._get('jinja2', conf) == self._expected('jinja2')
+        assert self._get('mako', conf) == self._expected('mako')
+        report = tmpl_context_stats.report()
+        assert report['rows.jinja2'] == dict(renders=1, unused=['title'],
+                                             missing=['subtitle'])
+        assert report['/rows.mako'] == dict(renders=1, unused=['title'],
+                                            missing=[])
@@ -93,7 +93,7 @@ class TestXMLRPCController(TestWSGIController):
     
     def test_listmethods(self):
         response = self.xmlreq('system.listMethods')
-        assert response == ['docs', 'intargcheck', 'longdoc', 'nosig', 'structured.methodname', 'system.listMethods', 'system.methodHelp', 'system.methodSignature', 'uni', 'userstatus']    
+        assert response == ['docs', 'intargcheck', 'longdoc', 'nosig', 'structured.methodname', 'system.listMethods', 'system.methodHelp', 'system.methodSignature', 'system.multicall', 'uni', 'userstatus']    
     
     def test_unicode(self):
         response = self.xmlreq('uni')
@@ -158,3 +158,58 @@ class TestXMLRPCController(TestWSGIController):
         self.assertRaises(xmlrpclib.Fault, self.xmlreq, 'foo')
     
 
+    def test_multicall(self):
+        response = self.xmlreq('system.multicall', ([
+                    {'methodName': 'userstatus', 'params': []},
+                    {'methodName': 'intargcheck', 'params': [12]},
+                    {'methodName': 'intargcheck', 'params': ['12']},
+                    {'methodName': 'intargcheck', 'params': [12.5]},
+                    {'methodName': 'structured.methodname',
+                     'params': ['foo']},
+                    {'methodName': 'missing', 'params': []},
+                    {'methodName': '_private', 'params': []},
+                    {'methodName': 'system.multicall', 'params': [[]]},
+                    {'methodName': 'system.listMethods'}],))
+        assert response[0] == ['basic string']
+        assert response[1] == ['received int']
+        assert response[2]['faultCode'] == 0
+        assert 'Incorrect argument signature' in response[2]['faultString']
+        assert response[3]['faultCode'] == 0
+        assert response[4] == ['Transform okay']
+        assert response[5] == {'faultCode': 0,
+                               'faultString': "No such method name 'missing'"}
+        assert response[6]['faultCode'] == 0
+        assert response[7] == {'faultCode': 0, 'faultString':
+                                   'Recursive system.multicall forbidden'}
+        assert 'system.multicall' in response[8][0]
+
+    def test_multicall_returned_fault(self):
+        response = self.xmlreq('system.multicall', ([
+                    {'methodName': 'system.methodSignature',
+                     'params': ['missing']},
+                    {'methodName': 'nosig', 'params': []}],))
+        assert response == [{'faultCode': 0,
+                             'faultString': 'No such method name'},
+                            ['not much']]
+
+    def test_multicall_bad_call(self):
+        response = self.xmlreq('system.multicall', (['userstatus'],))
+        assert response[0]['faultCode'] == 0
+        assert 'array of structs' in response[0]['faultString']
+
+    def test_method_registry(self):
+        from pylons.controllers.xmlrpc import method_registry
+        controller = make_basexmlrpc()()
+        registry = method_registry(controller)
+        assert registry is method_registry(controller)
+        assert '_private' not in registry.methods
+        assert 'foo' not in registry.methods
+        method = registry.methods['intargcheck']
+        assert method.public_name == 'intargcheck'
+        assert method.argnames == ('arg',)
+        assert method.check([1])
+        assert not method.check(['1'])
+        assert not method.check([1, 2])
+        assert registry.methods['nosig'].check(['anything'])
+        assert registry.methods['structured_methodname'].public_name == \
+            'structured.methodname'